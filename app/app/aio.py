@@ -0,0 +1,601 @@
+"""Async implementation of the ``/api/<resource>`` routes
+
+The routes of :mod:`app.api` served by Quart, with the queries run through a
+shared pool of connections by :mod:`databases` (``asyncpg`` for PostgreSQL
+and ``aiosqlite`` for SQLite). The queries are built with SQLAlchemy Core
+from the tables of :mod:`app.models` and the query string is parsed by the
+helpers of :mod:`app.api`, so both implementations answer with the same
+JSON.
+"""
+import logging
+from urllib.parse import urlencode
+from typing import Any, Dict, List, Tuple, Optional, AsyncIterator
+
+import sqlalchemy as sa  # type: ignore
+from sqlalchemy.orm import configure_mappers  # type: ignore
+from databases import Database  # type: ignore
+from flask import abort
+from quart import Quart, Response, jsonify, request  # type: ignore
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import parse_accept_header, parse_etags, quote_etag
+
+from app import api, config
+from app.app import Base
+
+logger = logging.getLogger(__name__)
+
+# The backrefs of the models are only made once the mappers are configured
+configure_mappers()
+
+
+class AsyncApp(Quart):
+    """Quart application with the database it serves"""
+
+    database: Optional[Database] = None
+
+
+aio_app = AsyncApp(__name__)
+aio_app.config.from_object(config.DevelopmentConfig)
+
+
+def create_database(url: str, min_size: int, max_size: int) -> Database:
+    """Create the database with a pool of connections
+
+    Parameters
+    ----------
+    url : :obj:`str`
+        The url of the database
+    min_size : :obj:`int`
+        Number of connections the pool keeps open
+    max_size : :obj:`int`
+        Maximum number of connections of the pool. SQLite has no pool so
+        the sizes are only used for PostgreSQL
+
+    Returns
+    -------
+    database : :class:`databases.Database`
+        The database, not yet connected
+    """
+    options = {}
+    if url.startswith('postgresql'):
+        options = {'min_size': min_size, 'max_size': max_size}
+    return Database(url, **options)
+
+
+def get_database() -> Database:
+    if aio_app.database is None:
+        raise RuntimeError('The database is not connected')
+    return aio_app.database
+
+
+@aio_app.before_serving
+async def connect() -> None:
+    aio_app.database = create_database(
+        aio_app.config['SQLALCHEMY_DATABASE_URI'],
+        aio_app.config['DATABASE_POOL_MIN'],
+        aio_app.config['DATABASE_POOL_MAX'],
+    )
+    await aio_app.database.connect()
+
+
+@aio_app.after_serving
+async def disconnect() -> None:
+    await get_database().disconnect()
+    aio_app.database = None
+
+
+@aio_app.after_request
+async def allow_origins(response: Response) -> Response:
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    return response
+
+
+@aio_app.errorhandler(HTTPException)
+async def handle_http_exception(error: HTTPException) -> Tuple[str, int]:
+    # The helpers of app.api abort with the exceptions of werkzeug
+    return error.description, error.code
+
+
+class Serializer:
+    """Select and serialize the items of a resource
+
+    Serializes rows like the model's ``to_dict`` or, with a projection,
+    ``to_partial_dict``. The expanded relationships are joined into the
+    select and their columns are labelled ``<relationship>__<column>``.
+
+    Parameters
+    ----------
+    Resource : :class:`app.app.Base`
+        The model of the resource
+    projection : :class:`app.api.Projection`, optional
+        Only select the columns and relationships of the projection
+    columns : :obj:`tuple` of :obj:`str`
+        Other columns to select, which are not serialized
+    """
+
+    def __init__(self, Resource: Base,
+                 projection: Optional[api.Projection] = None,
+                 columns: Tuple[str, ...] = ()):
+        self.table = Resource.__table__
+        names = [column.name for column in self.table.columns]
+        if projection is None:
+            self.fields = names
+            expand = list(api.EAGER_LOADS.get(Resource, ()))
+        else:
+            self.fields = projection.fields or names
+            expand = projection.expand
+        selected = list(dict.fromkeys([*self.fields, *columns]))
+        labelled = [self.table.c[name].label(name) for name in selected]
+        joined = self.table
+        self.expand: Dict[str, List[str]] = {}
+        relationships = sa.inspect(Resource).relationships
+        for name in expand:
+            relationship = relationships[name]
+            related = relationship.mapper.local_table
+            # The foreign keys cannot be null so an inner join loses no items
+            joined = joined.join(related, relationship.primaryjoin)
+            self.expand[name] = [column.name for column in related.columns]
+            labelled.extend(
+                column.label(f'{name}__{column.name}')
+                for column in related.columns
+            )
+        self.select = sa.select(labelled).select_from(joined)
+
+    @staticmethod
+    def _value(value: Any) -> Any:
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        return value
+
+    def to_dict(self, row: Any) -> Dict[str, Any]:
+        """Serialize a row of :attr:`select`"""
+        item = {name: self._value(row[name]) for name in self.fields}
+        for name, columns in self.expand.items():
+            item[name] = {
+                column: self._value(row[f'{name}__{column}'])
+                for column in columns
+            }
+        return item
+
+
+def get_args() -> Dict[str, str]:
+    return {key: value for key, value in request.args.items()}
+
+
+async def get_data_from_json() -> Any:
+    data = await request.get_json()
+    if data is None:
+        msg = 'Need to pass resource information through json'
+        logger.error(msg)
+        abort(400, msg)
+    return data
+
+
+def _defaults(table: sa.Table, kind: str) -> Dict[str, Any]:
+    # Python side defaults are applied by the ORM, not in the statement
+    values = {}
+    for column in table.columns:
+        default = getattr(column, kind)
+        if default is None:
+            continue
+        elif default.is_callable:
+            values[column.name] = default.arg(None)
+        elif default.is_scalar:
+            values[column.name] = default.arg
+    return values
+
+
+async def get_item(Resource: Base, ID: int,
+                   projection: Optional[api.Projection] = None) -> dict:
+    serializer = Serializer(Resource, projection)
+    query = serializer.select.where(serializer.table.c.ID == ID)
+    row = await get_database().fetch_one(query)
+    if row is None:
+        abort(404, f'Could not find resource {Resource.__name__} {ID}')
+    return serializer.to_dict(row)
+
+
+def select_collection(Resource: Base,
+                      args: Dict[str, str]) -> Tuple[Serializer, Any, str]:
+    """Select a collection filtered and ordered by the query string
+
+    Like :func:`app.api.query_collection`
+
+    Parameters
+    ----------
+    Resource : :class:`app.app.Base`
+        The model of the collection
+    args : :obj:`dict`
+        The query string parameters
+
+    Returns
+    -------
+    serializer : :class:`Serializer`
+        Serializer of the selected rows
+    query : :class:`sqlalchemy.sql.expression.Select`
+        Select of the items after the ``cursor``, without a limit
+    order_by : :obj:`str`
+        The ordering of the collection
+    """
+    order_by = api.get_order_by(Resource, args)
+    descending = order_by.startswith('-')
+    names = api.ORDER_KEYSETS[order_by.lstrip('-')]
+    table = Resource.__table__
+    columns = [table.c[name] for name in names]
+
+    # The keyset of the last item of a page makes the next cursor
+    projection = api.get_projection(Resource, args)
+    serializer = Serializer(Resource, projection, names)
+    query = serializer.select
+    for condition in api.get_filters(Resource, args):
+        query = query.where(condition)
+    cursor = args.get('cursor')
+    if cursor is not None:
+        keyset = api.decode_cursor(cursor, order_by)
+        query = query.where(api.after_keyset(columns, keyset, descending))
+    query = query.order_by(
+        *[column.desc() if descending else column for column in columns]
+    )
+    return serializer, query, order_by
+
+
+async def get_page(Resource: Base, args: Dict[str, str],
+                   limit: int) -> Tuple[List[dict], Optional[str]]:
+    """Get a page of a collection, like :func:`app.api.get_page`"""
+    serializer, query, order_by = select_collection(Resource, args)
+    # One more item tells if there is a next page
+    rows = await get_database().fetch_all(query.limit(limit + 1))
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        names = api.ORDER_KEYSETS[order_by.lstrip('-')]
+        next_cursor = api.encode_cursor(
+            order_by,
+            [rows[-1][name] for name in names],
+        )
+    return [serializer.to_dict(row) for row in rows], next_cursor
+
+
+async def encode_rows(serializer: Serializer, query: Any,
+                      ndjson: bool) -> AsyncIterator[bytes]:
+    """Serialize the rows of a query as they are fetched
+
+    Parameters
+    ----------
+    serializer : :class:`Serializer`
+        Serializer of the rows
+    query : :class:`sqlalchemy.sql.expression.Select`
+        The query of the rows
+    ndjson : :obj:`bool`
+        Encode newline delimited JSON instead of a JSON array
+
+    Returns
+    -------
+    chunks : :obj:`async iterator` of :obj:`bytes`
+        The encoded rows, :data:`app.api.STREAM_BATCH` at a time
+    """
+    if not ndjson:
+        yield b'['
+    chunk = []
+    n = 0
+    async for row in get_database().iterate(query):
+        item = api.dumps(serializer.to_dict(row))
+        if ndjson:
+            chunk.append(item + '\n')
+        elif n == 0:
+            chunk.append(item)
+        else:
+            chunk.append(',' + item)
+        n += 1
+        if len(chunk) == api.STREAM_BATCH:
+            yield ''.join(chunk).encode()
+            chunk = []
+    if not ndjson:
+        chunk.append(']')
+    yield ''.join(chunk).encode()
+
+
+async def get_collection_etag(
+    Resource: Base,
+    args: Dict[str, str],
+    mimetype: str = api.COLLECTION_MIMETYPES[0],
+) -> str:
+    """Get the weak ETag of a collection
+
+    The same tag as :func:`app.api.get_collection_etag`
+    """
+    table = Resource.__table__
+    query = sa.select([
+        sa.func.count(table.c.ID).label('count'),
+        sa.func.max(table.c.Updated).label('updated'),
+    ])
+    for condition in api.get_filters(Resource, args):
+        query = query.where(condition)
+    database = get_database()
+    row = await database.fetch_one(query)
+    parts = [str(row['count']), api.etag_timestamp(row['updated'])]
+    for Embedded in api.EMBEDDED.get(Resource, ()):
+        updated = await database.fetch_val(
+            sa.select([sa.func.max(Embedded.__table__.c.Updated)])
+        )
+        parts.append(api.etag_timestamp(updated))
+    parts.append(api.etag_variant(mimetype, args))
+    return '-'.join(parts)
+
+
+async def get_collection(Resource: Base) -> Response:
+    args = get_args()
+    accept = parse_accept_header(request.headers.get('Accept'), MIMEAccept)
+    mimetype = accept.best_match(
+        api.COLLECTION_MIMETYPES,
+        default=api.COLLECTION_MIMETYPES[0],
+    )
+    etag = await get_collection_etag(Resource, args, mimetype)
+    # The format depends on the Accept header so caches must key on it
+    headers = {'ETag': quote_etag(etag, weak=True), 'Vary': 'Accept'}
+    if parse_etags(request.headers.get('If-None-Match')).contains_weak(etag):
+        return Response('', status=304, headers=headers)
+    ndjson = mimetype == 'application/x-ndjson'
+    limit = api.get_limit(args)
+    if limit is None:
+        serializer, query, _ = select_collection(Resource, args)
+        body = encode_rows(serializer, query, ndjson)
+        return Response(body, headers=headers, mimetype=mimetype)
+
+    items, cursor = await get_page(Resource, args, limit)
+    if ndjson:
+        content = ''.join(api.dumps(item) + '\n' for item in items)
+    else:
+        content = api.dumps(items)
+    if cursor is not None:
+        args['cursor'] = cursor
+        link = f'{request.base_url}?{urlencode(args)}'
+        headers['Link'] = f'<{link}>; rel="next"'
+    return Response(content, headers=headers, mimetype=mimetype)
+
+
+async def get_stats(Resource: Base, args: Dict[str, str],
+                    etag: str) -> List[dict]:
+    """Count the items of a collection by group, like
+    :func:`app.api.get_stats`
+    """
+    key = api.stats_cache_key(Resource, etag, args)
+    stats = api.get_cached_stats(key)
+    if stats is None:
+        group_by = api.get_group_by(Resource, args)
+        filters = api.get_filters(Resource, args)
+        query = api.select_stats(Resource, group_by, filters)
+        rows = await get_database().fetch_all(query)
+        columns = [*group_by, 'count']
+        stats = [
+            api.stats_item(group_by, [row[name] for name in columns])
+            for row in rows
+        ]
+        api.cache_stats(key, stats)
+    return stats
+
+
+async def create_resource(Resource: Base) -> dict:
+    logger.info(f'Creating Resource: {Resource.__name__}')
+    data = await get_data_from_json()
+    database = get_database()
+    table = Resource.__table__
+    try:
+        values = _defaults(table, 'default')
+        values.update(api.column_values(Resource.from_dict(data)))
+        query = table.insert().values(values)
+        if database.url.dialect == 'postgresql':
+            # The ID is the result of the insert instead of the last row ID
+            query = query.returning(table.c.ID)
+        async with database.transaction():
+            ID = await database.execute(query)
+        logger.info('Success')
+    except Exception as e:
+        logger.exception(
+            f'Failed to create resource: {Resource.__name__}'
+        )
+        abort(
+            400,
+            f'Unable to create resource {Resource.__name__} from data '
+            f'{data} with the following error: \n\n{str(e)}'
+        )
+    return await get_item(Resource, ID)
+
+
+async def update_resource(Resource: Base, ID: int) -> dict:
+    await get_item(Resource, ID)
+    logger.info(f'Updating resource {Resource.__name__} with ID {ID}')
+    table = Resource.__table__
+    values = api.get_update_values(Resource, await get_data_from_json())
+    if values:
+        values.update(_defaults(table, 'onupdate'))
+        query = table.update().where(table.c.ID == ID).values(values)
+        database = get_database()
+        async with database.transaction():
+            await database.execute(query)
+    logger.info('Success')
+    return await get_item(Resource, ID)
+
+
+async def delete_resource(Resource: Base, ID: int) -> dict:
+    await get_item(Resource, ID)
+    logger.info(f'Deleting resource {Resource.__name__} with ID {ID}')
+    table = Resource.__table__
+    values = _defaults(table, 'onupdate')
+    values['Active'] = False
+    query = table.update().where(table.c.ID == ID).values(values)
+    database = get_database()
+    async with database.transaction():
+        await database.execute(query)
+    logger.info('Success')
+    return await get_item(Resource, ID)
+
+
+async def bulk_create_resources(Resource: Base) -> Tuple[dict, int]:
+    """Create resources in one transaction, like
+    :func:`app.api.bulk_create_resources`
+    """
+    logger.info(f'Bulk creating resources: {Resource.__name__}')
+    data = await get_data_from_json()
+    mappings, errors = api.get_bulk_mappings(Resource, data)
+    if errors:
+        logger.error(f'{len(errors)} invalid resources, none created')
+        return {'created': 0, 'errors': errors}, 400
+    table = Resource.__table__
+    rows = [{**_defaults(table, 'default'), **row} for row in mappings]
+    database = get_database()
+    try:
+        if rows:
+            async with database.transaction():
+                await database.execute_many(table.insert(), rows)
+    except Exception as e:
+        logger.exception(
+            f'Failed to bulk create resources: {Resource.__name__}'
+        )
+        abort(
+            400,
+            f'Unable to create resources {Resource.__name__} with the '
+            f'following error: \n\n{str(e)}'
+        )
+    logger.info(f'Created {len(rows)} resources')
+    return {'created': len(rows), 'errors': []}, 201
+
+
+async def bulk_update_resources(Resource: Base) -> Tuple[dict, int]:
+    """Update the resources matching the filters, like
+    :func:`app.api.bulk_update_resources`
+    """
+    filters = api.get_filters(Resource, get_args(), active_only=False)
+    if not filters:
+        msg = 'Bulk update needs at least one filter'
+        logger.error(msg)
+        abort(400, msg)
+    data = await get_data_from_json()
+    values = api.get_update_values(Resource, data)
+    if not values:
+        msg = f'No fields of resource {Resource.__name__} in {data}'
+        logger.error(msg)
+        abort(400, msg)
+    logger.info(f'Bulk updating resources {Resource.__name__}: {values}')
+    table = Resource.__table__
+    values.update(_defaults(table, 'onupdate'))
+    count = sa.select([sa.func.count(table.c.ID)])
+    update = table.update().values(values)
+    for condition in filters:
+        count = count.where(condition)
+        update = update.where(condition)
+    database = get_database()
+    try:
+        async with database.transaction():
+            updated = await database.fetch_val(count)
+            await database.execute(update)
+    except Exception as e:
+        logger.exception(
+            f'Failed to bulk update resources: {Resource.__name__}'
+        )
+        abort(
+            400,
+            f'Unable to update resources {Resource.__name__} with data '
+            f'{data} with the following error: \n\n{str(e)}'
+        )
+    logger.info(f'Updated {updated} resources')
+    return {'updated': updated}, 200
+
+
+async def bulk_set_active(Resource: Base, active: bool) -> int:
+    """Delete or restore the resources matching the filters, like
+    :func:`app.api.bulk_set_active`
+    """
+    filters = api.get_bulk_active_filters(Resource, active, get_args())
+    table = Resource.__table__
+    values = _defaults(table, 'onupdate')
+    values['Active'] = active
+    count = sa.select([sa.func.count(table.c.ID)])
+    update = table.update().values(values)
+    for condition in filters:
+        count = count.where(condition)
+        update = update.where(condition)
+    database = get_database()
+    async with database.transaction():
+        changed = await database.fetch_val(count)
+        await database.execute(update)
+    return changed
+
+
+@aio_app.route('/api/<string:resource>/restore', methods=['POST'])
+async def bulk_restore(resource: str) -> Tuple[Response, int]:
+    Resource = api.get_model(resource)
+    logger.info(f'Bulk restoring resources: {Resource.__name__}')
+    restored = await bulk_set_active(Resource, True)
+    logger.info(f'Restored {restored} resources')
+    return jsonify({'restored': restored}), 200
+
+
+@aio_app.route(
+    '/api/<string:resource>/by_name/<string:name>',
+    methods=['GET'],
+)
+async def get_by_name(resource: str, name: str) -> Any:
+    Resource = api.get_model(resource)
+    serializer = Serializer(Resource, api.get_projection(Resource, get_args()))
+    query = serializer.select.where(serializer.table.c.Name == name)
+    row = await get_database().fetch_one(query)
+    if row is None:
+        abort(404, f'Could not find resource {Resource.__name__} {name}')
+    return jsonify(serializer.to_dict(row)), 200
+
+
+@aio_app.route('/api/<string:resource>/stats', methods=['GET'])
+async def get_resource_stats(resource: str) -> Any:
+    Resource = api.get_model(resource)
+    args = get_args()
+    etag = await get_collection_etag(Resource, args)
+    headers = {'ETag': quote_etag(etag, weak=True)}
+    if parse_etags(request.headers.get('If-None-Match')).contains_weak(etag):
+        return Response('', status=304, headers=headers)
+    stats = await get_stats(Resource, args, etag)
+    return Response(
+        api.dumps(stats),
+        headers=headers,
+        mimetype='application/json',
+    )
+
+
+@aio_app.route('/api/<string:resource>/bulk', methods=['POST', 'PUT'])
+async def bulk_create_or_update(resource: str) -> Tuple[Response, int]:
+    Resource = api.get_model(resource)
+    if request.method == 'POST':
+        result, status_code = await bulk_create_resources(Resource)
+    else:
+        result, status_code = await bulk_update_resources(Resource)
+    return jsonify(result), status_code
+
+
+@aio_app.route(
+    '/api/<string:resource>/<int:ID>',
+    methods=['GET', 'PUT', 'DELETE'],
+)
+@aio_app.route(
+    '/api/<string:resource>',
+    methods=['GET', 'POST', 'DELETE'],
+)
+async def get_create_update_or_delete(resource: str,
+                                      ID: Optional[int] = None) -> Any:
+    Resource = api.get_model(resource)
+    if request.method == 'GET' and ID is None:
+        return await get_collection(Resource)
+    elif request.method == 'DELETE' and ID is None:
+        logger.info(f'Bulk deleting resources: {Resource.__name__}')
+        deleted = await bulk_set_active(Resource, False)
+        logger.info(f'Deleted {deleted} resources')
+        return jsonify({'deleted': deleted}), 200
+    elif request.method == 'GET':
+        projection = api.get_projection(Resource, get_args())
+        return jsonify(await get_item(Resource, ID, projection)), 200
+    elif request.method == 'POST':
+        return jsonify(await create_resource(Resource)), 201
+    elif request.method == 'PUT':
+        return jsonify(await update_resource(Resource, ID)), 200
+    else:
+        return jsonify(await delete_resource(Resource, ID)), 200
@@ -1,8 +1,46 @@
+import json
+import base64
+import hashlib
 import logging
-from typing import Optional, Tuple, Union, List, Callable, Any, Dict
+import operator
+import binascii
+import threading
+from datetime import datetime
+from urllib.parse import urlencode
+from typing import (
+    Any,
+    Dict,
+    List,
+    Tuple,
+    Union,
+    Callable,
+    Iterable,
+    Mapping,
+    Iterator,
+    Optional,
+    NamedTuple,
+)
 
-from flask import abort, jsonify, request, Response
+from sqlalchemy import (  # type: ignore
+    func,
+    or_,
+    and_,
+    true,
+    false,
+    select,
+    inspect,
+)
+from sqlalchemy.orm import joinedload, load_only  # type: ignore
+from flask import (
+    abort,
+    jsonify,
+    request,
+    Response,
+    has_request_context,
+    stream_with_context,
+)
 
+from app import pds_index
 from app.app import (
     db,
     app,
@@ -12,12 +50,106 @@ from app.models import (
     Image,
     Camera,
     ProductType,
+    IndexIngest,
 )
 
+try:
+    import orjson  # type: ignore
+except ImportError:
+    orjson = None
+
 CodeResponse = Tuple[Response, int]
+Args = Mapping[str, str]
+
+RESOURCES = {
+    'product_types': ProductType,
+    'images': Image,
+    'cameras': Camera,
+}
+
+# Columns set by the database rather than from the request
+SERVER_COLUMNS = ('ID', 'Created', 'Updated')
 
 logger = logging.getLogger(__name__)
 
+# Resources embedded in the serialized items of another resource. A change to
+# them changes the collections of the embedding resource
+EMBEDDED: Dict[Base, Tuple[Base, ...]] = {
+    Image: (Camera, ProductType),
+}
+
+# Relationships serialized by to_dict. They are joined into the query of the
+# items instead of being loaded with a query per item
+EAGER_LOADS: Dict[Base, Tuple[str, ...]] = {
+    Image: ('camera', 'product_type'),
+}
+
+# Query string parameters that page, order, project and group collections
+# instead of filtering them
+OPTION_PARAMS = (
+    'limit',
+    'order_by',
+    'cursor',
+    'fields',
+    'expand',
+    'group_by',
+    'since',
+)
+MAX_LIMIT = 1000
+
+# Operators of filters written as <column>__<operator>=<value>. Values of
+# ``in`` filters are separated by commas
+FILTER_OPERATORS: Dict[str, Callable[[Any, Any], Any]] = {
+    'eq': operator.eq,
+    'ne': operator.ne,
+    'lt': operator.lt,
+    'lte': operator.le,
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'in': lambda column, values: column.in_(values),
+    'startswith': lambda column, value: column.startswith(
+        value,
+        autoescape=True,
+    ),
+    'contains': lambda column, value: column.contains(
+        value,
+        autoescape=True,
+    ),
+}
+
+# Operators matching a pattern, which only filter text columns
+PATTERN_OPERATORS = ('startswith', 'contains')
+
+BOOLEANS = {
+    'true': True,
+    '1': True,
+    'false': False,
+    '0': False,
+}
+
+# Rows fetched from the database and items written to the response at a time
+# when streaming a collection
+STREAM_BATCH = 500
+
+COLLECTION_MIMETYPES = ('application/json', 'application/x-ndjson')
+
+_encoder = json.JSONEncoder(separators=(',', ':'))
+
+# Counts of the stats endpoint by the resource, grouping, filters and the
+# ETag of the filtered collection. The ETag changes with every write so
+# entries are never stale, the old ones are dropped once the cache is full.
+# Requests are served by several threads so it is only used under the lock
+STATS_CACHE: Dict[Tuple[Any, ...], List[dict]] = {}
+STATS_CACHE_SIZE = 128
+STATS_LOCK = threading.Lock()
+
+# Columns collections can be ordered by and the columns of the keyset that
+# continues the order from a cursor. The ID makes every keyset unique
+ORDER_KEYSETS = {
+    'ID': ('ID',),
+    'Sol': ('Sol', 'ID'),
+}
+
 
 def get_data_from_json() -> dict:
     data = request.get_json()
@@ -28,20 +160,652 @@ def get_data_from_json() -> dict:
     return data
 
 
-def get_query_string_params() -> dict:
-    params = {key: val for key, val in request.args.items()}
+def _get_args(args: Optional[Args]) -> Args:
+    return request.args if args is None else args
+
+
+def get_query_string_params(args: Optional[Args] = None) -> dict:
+    params = {
+        key: val for key, val in _get_args(args).items()
+        if key not in OPTION_PARAMS
+    }
     return params
 
 
+def parse_filter_value(column: Any, value: str) -> Any:
+    """Convert a query string value to the type of a column
+
+    Parameters
+    ----------
+    column : :class:`sqlalchemy.Column`
+        The column the value is compared to
+    value : :obj:`str`
+        The value from the query string
+
+    Returns
+    -------
+    value : :obj:`object`
+        The value as the python type of the column
+    """
+    python_type = column.type.python_type
+    if python_type is bool:
+        try:
+            return BOOLEANS[value.lower()]
+        except KeyError:
+            raise ValueError(f'{value} is not a boolean')
+    elif python_type is datetime:
+        return datetime.fromisoformat(value)
+    return python_type(value)
+
+
+def get_since(args: Optional[Args] = None) -> Optional[datetime]:
+    value = _get_args(args).get('since')
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        msg = f'since must be an ISO 8601 time, got {value}'
+        logger.error(msg)
+        abort(400, msg)
+
+
+def get_filters(Resource: Base, args: Optional[Args] = None,
+                active_only: bool = True) -> List[Any]:
+    """Get the filters of the query string parameters
+
+    Parameters are ``<column>=<value>`` for equality or
+    ``<column>__<operator>=<value>`` with an operator of
+    :data:`FILTER_OPERATORS`, such as ``Sol__gte=10`` or ``Sol__in=1,2,3``.
+    Values are converted to the type of the column. Text columns can also be
+    matched with ``Name__startswith=1P1290`` or ``Name__contains=EFF``.
+
+    ``since`` selects the items created or updated after a time, which is
+    the ``Updated`` time of the latest change a client has seen. Deleted
+    items are inactive rather than removed so they are changes too.
+
+    Otherwise only active items are read unless the parameters filter by
+    ``Active``, such as ``Active=false`` for the deleted items.
+
+    Parameters
+    ----------
+    Resource : :class:`app.app.Base`
+        The model to filter
+    args : :obj:`dict`, optional
+        The query string parameters, those of the current request by default
+    active_only : :obj:`bool`
+        Whether to leave out the deleted items when the parameters do not
+        filter by ``Active`` or ``since``. Writes filter on their own
+
+    Returns
+    -------
+    filters : :obj:`list`
+        The filters to pass to :meth:`sqlalchemy.orm.query.Query.filter`
+    """
+    filters = []
+    columns = Resource.__table__.columns
+    params = get_query_string_params(args)
+    for key, value in params.items():
+        name, _, op = key.partition('__')
+        op = op or 'eq'
+        if name not in columns or op not in FILTER_OPERATORS:
+            msg = f'Cannot filter resource {Resource.__name__} by {key}'
+            logger.error(msg)
+            abort(400, msg)
+        column = columns[name]
+        if op in PATTERN_OPERATORS and column.type.python_type is not str:
+            msg = f'Cannot filter {name} of {Resource.__name__} by {op}'
+            logger.error(msg)
+            abort(400, msg)
+        try:
+            if op == 'in':
+                parsed = [
+                    parse_filter_value(column, item)
+                    for item in value.split(',')
+                ]
+            else:
+                parsed = parse_filter_value(column, value)
+        except ValueError as e:
+            msg = f'Invalid value for filter {key}: {e}'
+            logger.error(msg)
+            abort(400, msg)
+        filters.append(FILTER_OPERATORS[op](column, parsed))
+    since = get_since(args)
+    if since is not None:
+        filters.append(columns['Updated'] > since)
+    elif active_only and not any(
+        key.partition('__')[0] == 'Active' for key in params
+    ):
+        # Comparing with true matches the partial indexes of active items
+        filters.append(columns['Active'] == true())
+    return filters
+
+
+class Projection(NamedTuple):
+    """Columns and relationships requested by ``fields`` and ``expand``"""
+
+    # None for every column
+    fields: Optional[List[str]]
+    expand: List[str]
+
+
+def _split_param(name: str, args: Optional[Args]) -> Optional[List[str]]:
+    value = _get_args(args).get(name)
+    if value is None:
+        return None
+    return [item for item in value.split(',') if item]
+
+
+def get_projection(Resource: Base,
+                   args: Optional[Args] = None) -> Optional[Projection]:
+    """Get the projection of the ``fields`` and ``expand`` parameters
+
+    ``fields`` lists the columns to serialize and ``expand`` the
+    relationships of :data:`EAGER_LOADS` to embed. Relationships are only
+    embedded when asked for if either parameter is given.
+
+    Parameters
+    ----------
+    Resource : :class:`app.app.Base`
+        The model to serialize
+    args : :obj:`dict`, optional
+        The query string parameters, those of the current request by default
+
+    Returns
+    -------
+    projection : :class:`Projection` or :obj:`None`
+        The projection or :obj:`None` for the whole ``to_dict``
+    """
+    fields = _split_param('fields', args)
+    expand = _split_param('expand', args)
+    if fields is None and expand is None:
+        return None
+    columns = Resource.__table__.columns
+    relationships = EAGER_LOADS.get(Resource, ())
+    for field in fields or []:
+        if field not in columns:
+            msg = f'Resource {Resource.__name__} has no field {field}'
+            logger.error(msg)
+            abort(400, msg)
+    for name in expand or []:
+        if name not in relationships:
+            msg = f'Cannot expand {name} of resource {Resource.__name__}'
+            logger.error(msg)
+            abort(400, msg)
+    return Projection(fields, expand or [])
+
+
+def serialize(resource: Base, projection: Optional[Projection]) -> dict:
+    if projection is None:
+        return resource.to_dict()
+    return resource.to_partial_dict(projection.fields, projection.expand)
+
+
+def query_serializable(Resource: Base,
+                       projection: Optional[Projection] = None,
+                       columns: Tuple[str, ...] = ()):
+    """Query a resource, loading what its items need to be serialized
+
+    Parameters
+    ----------
+    Resource : :class:`app.app.Base`
+        The model to query
+    projection : :class:`Projection`, optional
+        Only load the columns and relationships of the projection
+    columns : :obj:`tuple` of :obj:`str`
+        Other columns to load with the projection
+
+    Returns
+    -------
+    query : :class:`flask_sqlalchemy.BaseQuery`
+        Query of the resource with the relationships in
+        :data:`EAGER_LOADS` loaded in the same statement
+    """
+    if projection is None:
+        expand = EAGER_LOADS.get(Resource, ())
+    else:
+        expand = tuple(projection.expand)
+    # The foreign keys cannot be null so an inner join loses no items
+    options = [joinedload(name, innerjoin=True) for name in expand]
+    if projection is not None and projection.fields is not None:
+        options.append(load_only(*projection.fields, *columns))
+    return Resource.query.options(*options)
+
+
+def get_limit(args: Optional[Args] = None) -> Optional[int]:
+    args = _get_args(args)
+    if 'limit' not in args:
+        return None
+    try:
+        limit = int(args['limit'])
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        msg = f'limit must be a positive integer, got {args["limit"]}'
+        logger.error(msg)
+        abort(400, msg)
+    return min(limit, MAX_LIMIT)
+
+
+def get_order_by(Resource: Base, args: Optional[Args] = None) -> str:
+    order_by = _get_args(args).get('order_by', 'ID')
+    name = order_by[1:] if order_by.startswith('-') else order_by
+    if name not in ORDER_KEYSETS or not hasattr(Resource, name):
+        msg = f'Cannot order resource {Resource.__name__} by {order_by}'
+        logger.error(msg)
+        abort(400, msg)
+    return order_by
+
+
+def encode_cursor(order_by: str, keyset: List[Any]) -> str:
+    """Encode the position after an item in an ordered collection
+
+    Parameters
+    ----------
+    order_by : :obj:`str`
+        The ordering of the collection
+    keyset : :obj:`list`
+        The values of the ordering's keyset columns for the item
+
+    Returns
+    -------
+    cursor : :obj:`str`
+        Opaque and url safe cursor
+    """
+    data = json.dumps({'order_by': order_by, 'after': keyset})
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def decode_cursor(cursor: str, order_by: str) -> List[Any]:
+    """Decode a cursor made by :func:`encode_cursor`
+
+    Parameters
+    ----------
+    cursor : :obj:`str`
+        The cursor from the ``next`` link of the previous page
+    order_by : :obj:`str`
+        The ordering of the requested page, which must be the ordering the
+        cursor was made for
+
+    Returns
+    -------
+    keyset : :obj:`list`
+        The values of the keyset columns the page starts after
+    """
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        keyset = data['after']
+        if data['order_by'] != order_by:
+            raise ValueError(f'Cursor is for the order {data["order_by"]}')
+        if len(keyset) != len(ORDER_KEYSETS[order_by.lstrip('-')]):
+            raise ValueError('Cursor does not match the order')
+    except (binascii.Error, ValueError, KeyError, TypeError) as e:
+        msg = f'Invalid cursor {cursor}: {e}'
+        logger.error(msg)
+        abort(400, msg)
+    return keyset
+
+
+def after_keyset(columns: List[Any], keyset: List[Any], descending: bool):
+    # (a, b) > (x, y) is a > x or (a == x and b > y)
+    column, value = columns[0], keyset[0]
+    after = column < value if descending else column > value
+    if len(columns) == 1:
+        return after
+    rest = after_keyset(columns[1:], keyset[1:], descending)
+    return or_(after, and_(column == value, rest))
+
+
+def query_collection(Resource: Base):
+    """Query a collection filtered and ordered by the query string
+
+    Parameters
+    ----------
+    Resource : :class:`app.app.Base`
+        The model of the collection
+
+    Returns
+    -------
+    query : :class:`flask_sqlalchemy.BaseQuery`
+        Query of the items after the ``cursor``, without a limit
+    """
+    order_by = get_order_by(Resource)
+    descending = order_by.startswith('-')
+    names = ORDER_KEYSETS[order_by.lstrip('-')]
+    columns = [getattr(Resource, name) for name in names]
+
+    # The keyset of the last item of a page makes the next cursor
+    query = query_serializable(Resource, get_projection(Resource), names)
+    query = query.filter(*get_filters(Resource))
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        keyset = decode_cursor(cursor, order_by)
+        query = query.filter(after_keyset(columns, keyset, descending))
+    return query.order_by(
+        *[column.desc() if descending else column for column in columns]
+    )
+
+
+def get_page(Resource: Base) -> Tuple[List[dict], Optional[str]]:
+    """Get a page of a collection from the query string parameters
+
+    Items are filtered with :func:`get_filters` and ordered by ``order_by``
+    (``ID`` by default, prefixed with ``-`` for descending order) in the
+    database. ``limit`` sets the size of the page and ``cursor`` continues
+    from the end of the previous page.
+    Pages are found from the keyset of the last item so new items do not
+    shift them and they are found through the index instead of skipping
+    rows like an offset.
+
+    Parameters
+    ----------
+    Resource : :class:`app.app.Base`
+        The model of the collection
+
+    Returns
+    -------
+    items : :obj:`list` of :obj:`dict`
+        The items of the page
+    cursor : :obj:`str` or :obj:`None`
+        Cursor of the next page or :obj:`None` if this is the last page
+    """
+    limit = get_limit()
+    order_by = get_order_by(Resource)
+    names = ORDER_KEYSETS[order_by.lstrip('-')]
+    query = query_collection(Resource)
+    if limit is not None:
+        # One more item tells if there is a next page
+        query = query.limit(limit + 1)
+    resources = query.all()
+
+    next_cursor = None
+    if limit is not None and len(resources) > limit:
+        resources = resources[:limit]
+        last = resources[-1]
+        next_cursor = encode_cursor(
+            order_by,
+            [getattr(last, name) for name in names],
+        )
+    projection = get_projection(Resource)
+    return [serialize(r, projection) for r in resources], next_cursor
+
+
+def iter_collection(Resource: Base) -> Iterator[dict]:
+    """Serialize every item of a collection, loading them in batches
+
+    Like :func:`get_page` without a limit but rows are fetched
+    :data:`STREAM_BATCH` at a time through a server side cursor instead of
+    all at once.
+
+    Parameters
+    ----------
+    Resource : :class:`app.app.Base`
+        The model of the collection
+
+    Returns
+    -------
+    items : :obj:`iterator` of :obj:`dict`
+        The serialized items
+    """
+    projection = get_projection(Resource)
+    query = query_collection(Resource).yield_per(STREAM_BATCH)
+    return (serialize(resource, projection) for resource in query)
+
+
+def dumps(obj: Any) -> str:
+    """Encode JSON, with :mod:`orjson` if it is installed"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return _encoder.encode(obj)
+
+
+def _encode_items(items: Iterable[dict], ndjson: bool) -> Iterator[str]:
+    if not ndjson:
+        yield '['
+    chunk = []
+    for n, item in enumerate(items):
+        if ndjson:
+            chunk.append(dumps(item) + '\n')
+        elif n == 0:
+            chunk.append(dumps(item))
+        else:
+            chunk.append(',' + dumps(item))
+        if len(chunk) == STREAM_BATCH:
+            yield ''.join(chunk)
+            chunk = []
+    if not ndjson:
+        chunk.append(']')
+    yield ''.join(chunk)
+
+
+def get_collection_mimetype() -> str:
+    return request.accept_mimetypes.best_match(
+        COLLECTION_MIMETYPES,
+        default=COLLECTION_MIMETYPES[0],
+    )
+
+
+def collection_response(items: Iterable[dict]) -> Response:
+    """Stream the items of a collection as they are serialized
+
+    The items are a JSON array, or newline delimited JSON if the request
+    accepts ``application/x-ndjson``.
+
+    Parameters
+    ----------
+    items : :obj:`iterable` of :obj:`dict`
+        The serialized items
+
+    Returns
+    -------
+    response : :class:`flask.Response`
+        Streamed response of the items
+    """
+    mimetype = get_collection_mimetype()
+    chunks = _encode_items(items, mimetype == 'application/x-ndjson')
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    # Caches must not serve one format to a request accepting the other
+    response.vary.add('Accept')
+    return response
+
+
+def get_next_link(cursor: str) -> str:
+    args = request.args.to_dict()
+    args['cursor'] = cursor
+    return f'<{request.base_url}?{urlencode(args)}>; rel="next"'
+
+
 def get_resource(Resource: Base, ID: int) -> Union[dict, List[dict]]:
     if ID is None:
-        params = get_query_string_params()
-        items = [
-            r.to_dict() for r in Resource.query.filter_by(**params).all()
-        ]
+        items, _ = get_page(Resource)
         return items
     else:
-        return Resource.query.filter_by(ID=ID).first_or_404().to_dict()
+        # Single resources can be got outside of a request
+        projection = None
+        if has_request_context():
+            projection = get_projection(Resource)
+        resource = query_serializable(Resource, projection).filter_by(ID=ID)
+        return serialize(resource.first_or_404(), projection)
+
+
+def get_resource_by_name(Resource: Base, name: str) -> dict:
+    """Get the resource with a name through the unique index on ``Name``
+
+    Parameters
+    ----------
+    Resource : :class:`app.app.Base`
+        The model of the resource
+    name : :obj:`str`
+        The name of the resource
+
+    Returns
+    -------
+    resource : :obj:`dict`
+        The serialized resource, projected by ``fields`` and ``expand``
+    """
+    projection = get_projection(Resource)
+    query = query_serializable(Resource, projection).filter_by(Name=name)
+    return serialize(query.first_or_404(), projection)
+
+
+def etag_timestamp(updated: Optional[datetime]) -> str:
+    if updated is None:
+        return '0'
+    return updated.strftime('%Y%m%d%H%M%S%f')
+
+
+def etag_variant(mimetype: str, args: Optional[Args] = None) -> str:
+    """Hash the query string and the format of a response for its ETag
+
+    Parameters
+    ----------
+    mimetype : :obj:`str`
+        The format of the response
+    args : :obj:`dict`, optional
+        The query string, the one of the request by default
+
+    Returns
+    -------
+    variant : :obj:`str`
+        Short hash of the format and the query string parameters, in any
+        order
+    """
+    params = sorted(_get_args(args).items())
+    content = _encoder.encode([mimetype, params]).encode()
+    return hashlib.blake2b(content, digest_size=8).hexdigest()
+
+
+def get_collection_etag(Resource: Base,
+                        mimetype: str = COLLECTION_MIMETYPES[0]) -> str:
+    """Get the weak ETag of a collection from the query string filters
+
+    The tag is made from the number of matching rows and the latest time one
+    of them (or a resource embedded in them) was updated so it is found
+    without loading and serializing the rows. The query string and the
+    format change the body so they are part of the tag too, see
+    :func:`etag_variant`.
+
+    Parameters
+    ----------
+    Resource : :class:`app.app.Base`
+        The model of the collection
+    mimetype : :obj:`str`
+        The format of the response
+
+    Returns
+    -------
+    etag : :obj:`str`
+        The ETag, without the weak prefix or quotes
+    """
+    filters = get_filters(Resource)
+    count, updated = Resource.query.filter(*filters).with_entities(
+        func.count(Resource.ID),
+        func.max(Resource.Updated),
+    ).one()
+    parts = [str(count), etag_timestamp(updated)]
+    for Embedded in EMBEDDED.get(Resource, ()):
+        updated = db.session.query(func.max(Embedded.Updated)).scalar()
+        parts.append(etag_timestamp(updated))
+    parts.append(etag_variant(mimetype))
+    return '-'.join(parts)
+
+
+def get_group_by(Resource: Base, args: Optional[Args] = None) -> List[str]:
+    group_by = _split_param('group_by', args) or []
+    columns = Resource.__table__.columns
+    for name in group_by:
+        if name not in columns:
+            msg = f'Cannot group resource {Resource.__name__} by {name}'
+            logger.error(msg)
+            abort(400, msg)
+    return group_by
+
+
+def select_stats(Resource: Base, group_by: List[str], filters: List[Any]):
+    """Select the number of items in each group of a collection
+
+    Parameters
+    ----------
+    Resource : :class:`app.app.Base`
+        The model of the collection
+    group_by : :obj:`list` of :obj:`str`
+        The columns to group by
+    filters : :obj:`list`
+        The filters of the items to count
+
+    Returns
+    -------
+    query : :class:`sqlalchemy.sql.expression.Select`
+        Select of the group columns and the ``count`` of each group, ordered
+        by the group columns
+    """
+    table = Resource.__table__
+    columns = [table.c[name] for name in group_by]
+    query = select([*columns, func.count(table.c.ID).label('count')])
+    for condition in filters:
+        query = query.where(condition)
+    return query.group_by(*columns).order_by(*columns)
+
+
+def stats_cache_key(Resource: Base, etag: str,
+                    args: Optional[Args] = None) -> Tuple[Any, ...]:
+    params = sorted(get_query_string_params(args).items())
+    group_by = tuple(get_group_by(Resource, args))
+    return (Resource.__name__, group_by, tuple(params), etag)
+
+
+def get_cached_stats(key: Tuple[Any, ...]) -> Optional[List[dict]]:
+    with STATS_LOCK:
+        return STATS_CACHE.get(key)
+
+
+def cache_stats(key: Tuple[Any, ...], stats: List[dict]) -> None:
+    with STATS_LOCK:
+        while len(STATS_CACHE) >= STATS_CACHE_SIZE:
+            # Dictionaries keep their order so the first entry is the oldest
+            del STATS_CACHE[next(iter(STATS_CACHE))]
+        STATS_CACHE[key] = stats
+
+
+def stats_item(group_by: List[str], row: Any) -> dict:
+    item = {}
+    for name, value in zip(group_by, row):
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        item[name] = value
+    item['count'] = row[len(group_by)]
+    return item
+
+
+def get_stats(Resource: Base, etag: str) -> List[dict]:
+    """Count the items of a collection by the ``group_by`` columns
+
+    The items are filtered like the collection and counted with
+    ``GROUP BY`` in the database. The counts are cached until the
+    collection changes.
+
+    Parameters
+    ----------
+    Resource : :class:`app.app.Base`
+        The model of the collection
+    etag : :obj:`str`
+        The ETag of the filtered collection, see
+        :func:`get_collection_etag`
+
+    Returns
+    -------
+    stats : :obj:`list` of :obj:`dict`
+        The values of the group columns and the ``count`` of each group
+    """
+    key = stats_cache_key(Resource, etag)
+    stats = get_cached_stats(key)
+    if stats is None:
+        group_by = get_group_by(Resource)
+        query = select_stats(Resource, group_by, get_filters(Resource))
+        rows = db.session.execute(query).fetchall()
+        stats = [stats_item(group_by, row) for row in rows]
+        cache_stats(key, stats)
+    return stats
 
 
 def create_resource(Resource: Base, **kwargs) -> dict:
@@ -73,7 +837,9 @@ def update_resource(Resource: Base, ID: Optional[int] = None,
         )
     else:
         params = get_query_string_params()
-        resources = Resource.query.filter_by(**params).all()
+        # Deleted resources can be updated like by ID
+        filters = get_filters(Resource, active_only=False)
+        resources = Resource.query.filter(*filters).all()
         if not resources:
             msg = (
                 f'Could not find resource {Resource.__name__} '
@@ -95,7 +861,12 @@ def update_resource(Resource: Base, ID: Optional[int] = None,
                 f'ID {resource.ID}'
             )
     data = get_data_from_json()
-    resource.update_from_dict(data)
+    try:
+        resource.update_from_dict(data)
+    except ValueError as e:
+        msg = f'Unable to update resource {Resource.__name__}: {e}'
+        logger.error(msg)
+        abort(400, msg)
     db.session.add(resource)
     db.session.commit()
     logger.info('Success')
@@ -117,21 +888,363 @@ def delete_resource(Resource: Base, ID: int) -> dict:
     return resource.to_dict()
 
 
+def column_values(resource: Base) -> Dict[str, Any]:
+    return {
+        attr.key: getattr(resource, attr.key)
+        for attr in inspect(resource).mapper.column_attrs
+        if getattr(resource, attr.key) is not None
+    }
+
+
+def get_bulk_mappings(Resource: Base,
+                      data: Any) -> Tuple[List[dict], List[dict]]:
+    """Check the items of a bulk create and get their column values
+
+    Parameters
+    ----------
+    Resource : :class:`app.app.Base`
+        The model of the resources
+    data : :obj:`list` of :obj:`dict`
+        The items from the JSON data
+
+    Returns
+    -------
+    mappings : :obj:`list` of :obj:`dict`
+        The column values of each valid item
+    errors : :obj:`list` of :obj:`dict`
+        The ``index`` and ``error`` of each invalid item
+    """
+    if not isinstance(data, list):
+        msg = 'Bulk create needs a list of resources'
+        logger.error(msg)
+        abort(400, msg)
+    mappings = []
+    errors = []
+    for index, item in enumerate(data):
+        try:
+            mappings.append(column_values(Resource.from_dict(item)))
+        except Exception as e:
+            errors.append({'index': index, 'error': f'{e!r}'})
+    return mappings, errors
+
+
+def get_update_values(Resource: Base, data: dict) -> Dict[str, Any]:
+    """Get the columns an update sets
+
+    The data is applied to a blank resource with the model's
+    ``update_from_dict`` so the same fields can be changed as when updating
+    a single resource.
+
+    Parameters
+    ----------
+    Resource : :class:`app.app.Base`
+        The model of the resources
+    data : :obj:`dict`
+        The JSON data of the update
+
+    Returns
+    -------
+    values : :obj:`dict`
+        The new values of the columns
+    """
+    probe = Resource()
+    try:
+        probe.update_from_dict(data)
+    except ValueError as e:
+        msg = f'Unable to update resource {Resource.__name__}: {e}'
+        logger.error(msg)
+        abort(400, msg)
+    return {
+        key: value for key, value in column_values(probe).items()
+        if key not in SERVER_COLUMNS
+    }
+
+
+def bulk_create_resources(Resource: Base) -> Tuple[dict, int]:
+    """Create the resources in a JSON list in one transaction
+
+    Every item is checked with the model's ``from_dict`` first. If any item
+    is invalid nothing is created and the errors are reported by the index
+    of the item. Otherwise the items are inserted by
+    ``bulk_insert_mappings`` with a single ``executemany``.
+
+    Parameters
+    ----------
+    Resource : :class:`app.app.Base`
+        The model of the resources
+
+    Returns
+    -------
+    result : :obj:`dict`
+        The number of resources ``created`` and the ``errors`` of the items
+    status_code : :obj:`int`
+        201 if the resources were created and 400 otherwise
+    """
+    logger.info(f'Bulk creating resources: {Resource.__name__}')
+    mappings, errors = get_bulk_mappings(Resource, get_data_from_json())
+    if errors:
+        logger.error(f'{len(errors)} invalid resources, none created')
+        return {'created': 0, 'errors': errors}, 400
+    try:
+        db.session.bulk_insert_mappings(Resource, mappings)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.exception(
+            f'Failed to bulk create resources: {Resource.__name__}'
+        )
+        abort(
+            400,
+            f'Unable to create resources {Resource.__name__} with the '
+            f'following error: \n\n{str(e)}'
+        )
+    logger.info(f'Created {len(mappings)} resources')
+    return {'created': len(mappings), 'errors': []}, 201
+
+
+def bulk_update_resources(Resource: Base) -> Tuple[dict, int]:
+    """Update every resource matching the filters with one ``UPDATE``
+
+    The JSON data is applied like a single update, see
+    :func:`get_update_values`.
+
+    Parameters
+    ----------
+    Resource : :class:`app.app.Base`
+        The model of the resources
+
+    Returns
+    -------
+    result : :obj:`dict`
+        The number of resources ``updated``
+    status_code : :obj:`int`
+        200
+    """
+    filters = get_filters(Resource, active_only=False)
+    if not filters:
+        msg = 'Bulk update needs at least one filter'
+        logger.error(msg)
+        abort(400, msg)
+    data = get_data_from_json()
+    values = get_update_values(Resource, data)
+    if not values:
+        msg = f'No fields of resource {Resource.__name__} in {data}'
+        logger.error(msg)
+        abort(400, msg)
+    logger.info(f'Bulk updating resources {Resource.__name__}: {values}')
+    try:
+        updated = Resource.query.filter(*filters).update(
+            values,
+            synchronize_session=False,
+        )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.exception(
+            f'Failed to bulk update resources: {Resource.__name__}'
+        )
+        abort(
+            400,
+            f'Unable to update resources {Resource.__name__} with data '
+            f'{data} with the following error: \n\n{str(e)}'
+        )
+    logger.info(f'Updated {updated} resources')
+    return {'updated': updated}, 200
+
+
+def get_bulk_active_filters(Resource: Base, active: bool,
+                            args: Optional[Args] = None) -> List[Any]:
+    """Get the filters of the resources a bulk delete or restore changes
+
+    Parameters
+    ----------
+    Resource : :class:`app.app.Base`
+        The model of the resources
+    active : :obj:`bool`
+        ``False`` to delete the resources and ``True`` to restore them
+    args : :obj:`dict`, optional
+        The query string parameters, those of the current request by default
+
+    Returns
+    -------
+    filters : :obj:`list`
+        The query string filters and the filter of the resources not
+        deleted or restored yet, so only the changed resources are counted
+    """
+    filters = get_filters(Resource, args, active_only=False)
+    if not filters:
+        action = 'restore' if active else 'delete'
+        msg = f'Bulk {action} needs at least one filter'
+        logger.error(msg)
+        abort(400, msg)
+    column = Resource.__table__.c.Active
+    filters.append(column == (false() if active else true()))
+    return filters
+
+
+def bulk_set_active(Resource: Base, active: bool) -> int:
+    filters = get_bulk_active_filters(Resource, active)
+    try:
+        changed = Resource.query.filter(*filters).update(
+            {'Active': active},
+            synchronize_session=False,
+        )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.exception(
+            f'Failed to bulk change resources: {Resource.__name__}'
+        )
+        abort(
+            400,
+            f'Unable to change resources {Resource.__name__} with the '
+            f'following error: \n\n{str(e)}'
+        )
+    return changed
+
+
+def bulk_delete_resources(Resource: Base) -> Tuple[dict, int]:
+    """Delete every resource matching the filters with one ``UPDATE``
+
+    Resources are deleted by making them inactive, see
+    :func:`bulk_restore_resources`.
+
+    Parameters
+    ----------
+    Resource : :class:`app.app.Base`
+        The model of the resources
+
+    Returns
+    -------
+    result : :obj:`dict`
+        The number of resources ``deleted``
+    status_code : :obj:`int`
+        200
+    """
+    logger.info(f'Bulk deleting resources: {Resource.__name__}')
+    deleted = bulk_set_active(Resource, False)
+    logger.info(f'Deleted {deleted} resources')
+    return {'deleted': deleted}, 200
+
+
+def bulk_restore_resources(Resource: Base) -> Tuple[dict, int]:
+    """Restore every deleted resource matching the filters with one
+    ``UPDATE``
+
+    Parameters
+    ----------
+    Resource : :class:`app.app.Base`
+        The model of the resources
+
+    Returns
+    -------
+    result : :obj:`dict`
+        The number of resources ``restored``
+    status_code : :obj:`int`
+        200
+    """
+    logger.info(f'Bulk restoring resources: {Resource.__name__}')
+    restored = bulk_set_active(Resource, True)
+    logger.info(f'Restored {restored} resources')
+    return {'restored': restored}, 200
+
+
+def get_model(resource: str) -> Base:
+    Resource = RESOURCES.get(resource)
+    if not Resource:
+        abort(404, f'Could not find resource {resource}')
+    return Resource
+
+
+@app.route('/api/ingest/index', methods=['POST'])
+def create_index_ingest() -> CodeResponse:
+    data = get_data_from_json()
+    try:
+        job = IndexIngest.from_dict(data)
+    except Exception as e:
+        logger.exception('Failed to create index ingest')
+        abort(
+            400,
+            f'Unable to ingest index from data {data} with the following '
+            f'error: \n\n{str(e)}'
+        )
+    db.session.add(job)
+    db.session.commit()
+    logger.info(f'Ingesting index {job.Table} as ingest {job.ID}')
+    pds_index.start_ingest(job)
+    return jsonify(job.to_dict()), 202
+
+
+@app.route('/api/ingest/index/<int:ID>', methods=['GET', 'PUT'])
+def get_or_resume_index_ingest(ID: int) -> CodeResponse:
+    job = IndexIngest.query.filter_by(ID=ID).first_or_404()
+    if request.method == 'GET':
+        return jsonify(job.to_dict()), 200
+    # Ingests left pending or running by a stopped API are resumed from the
+    # command line. Claiming the failed ingest in the update means only one
+    # of several concurrent requests starts it
+    claimed = IndexIngest.query.filter_by(ID=ID, Status='failed').update(
+        {'Status': 'pending', 'Error': None},
+        synchronize_session=False,
+    )
+    db.session.commit()
+    if not claimed:
+        db.session.refresh(job)
+        msg = f'Cannot resume ingest {ID} with status {job.Status}'
+        logger.error(msg)
+        abort(400, msg)
+    db.session.refresh(job)
+    logger.info(f'Resuming ingest {ID} after row {job.Done}')
+    pds_index.start_ingest(job)
+    return jsonify(job.to_dict()), 202
+
+
+@app.route('/api/<string:resource>/by_name/<string:name>', methods=['GET'])
+def get_by_name(resource: str, name: str) -> CodeResponse:
+    Resource = get_model(resource)
+    return jsonify(get_resource_by_name(Resource, name)), 200
+
+
+@app.route('/api/<string:resource>/stats', methods=['GET'])
+def get_resource_stats(resource: str) -> CodeResponse:
+    Resource = get_model(resource)
+    etag = get_collection_etag(Resource)
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag, weak=True)
+        return response, 304
+    response = jsonify(get_stats(Resource, etag))
+    response.set_etag(etag, weak=True)
+    return response, 200
+
+
+@app.route('/api/<string:resource>/restore', methods=['POST'])
+def bulk_restore(resource: str) -> CodeResponse:
+    Resource = get_model(resource)
+    result, status_code = bulk_restore_resources(Resource)
+    return jsonify(result), status_code
+
+
+@app.route('/api/<string:resource>/bulk', methods=['POST', 'PUT'])
+def bulk_create_or_update(resource: str) -> CodeResponse:
+    Resource = get_model(resource)
+    if request.method == 'POST':
+        result, status_code = bulk_create_resources(Resource)
+    else:
+        result, status_code = bulk_update_resources(Resource)
+    return jsonify(result), status_code
+
+
 @app.route(
     '/api/<string:resource>/<int:ID>',
     methods=['GET', 'PUT', 'DELETE'],
 )
 @app.route(
     '/api/<string:resource>',
-    methods=['GET', 'POST'],
+    methods=['GET', 'POST', 'DELETE'],
 )
 def get_create_update_or_delete(resource: str,
                                 ID: Optional[int] = None) -> CodeResponse:
-    resources = {
-        'product_types': ProductType,
-        'images': Image,
-        'cameras': Camera,
-    }
     methods: Dict[str, Tuple[Callable[..., Any], int]]
     methods = {
         'GET': (get_resource, 200),
@@ -139,9 +1252,29 @@ def get_create_update_or_delete(resource: str,
         'DELETE': (delete_resource, 200),
         'PUT': (update_resource, 200),
     }
-    Resource = resources.get(resource)
-    if not Resource:
-        abort(404, f'Could not find resource {resource}')
+    Resource = get_model(resource)
+
+    if request.method == 'GET' and ID is None:
+        etag = get_collection_etag(Resource, get_collection_mimetype())
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+            response.set_etag(etag, weak=True)
+            response.vary.add('Accept')
+            return response, 304
+        items: Iterable[dict]
+        cursor: Optional[str] = None
+        if get_limit() is None:
+            items = iter_collection(Resource)
+        else:
+            items, cursor = get_page(Resource)
+        response = collection_response(items)
+        response.set_etag(etag, weak=True)
+        if cursor is not None:
+            response.headers['Link'] = get_next_link(cursor)
+        return response, 200
+    elif request.method == 'DELETE' and ID is None:
+        result, status_code = bulk_delete_resources(Resource)
+        return jsonify(result), status_code
 
     method: Callable[..., Any]
     status_code: int
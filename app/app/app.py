@@ -1,4 +1,4 @@
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Sequence
 
 from datetime import datetime
 
@@ -31,11 +31,13 @@ class Base(Model):
         nullable=False,
         default=datetime.utcnow,
     )
+    # Indexed for the changes since a time and the ETags of collections
     Updated = sa.Column(
         sa.DateTime,
         nullable=False,
         default=datetime.utcnow,
         onupdate=datetime.utcnow,
+        index=True,
     )
 
     def __repr__(self):
@@ -49,6 +51,36 @@ class Base(Model):
             'Active': self.Active,
         }
 
+    def to_partial_dict(self, fields: Optional[Sequence[str]] = None,
+                        expand: Sequence[str] = ()) -> Dict[str, Any]:
+        """Serialize some of the columns and relationships
+
+        Parameters
+        ----------
+        fields : :obj:`list` of :obj:`str`, optional
+            Names of the columns to include. Every column by default
+        expand : :obj:`list` of :obj:`str`
+            Names of the relationships to include, serialized with their
+            ``to_dict``
+
+        Returns
+        -------
+        model_dict : :obj:`dict`
+            The serialized columns and relationships
+        """
+        if fields is None:
+            mapper = sa.inspect(self).mapper
+            fields = [attr.key for attr in mapper.column_attrs]
+        model_dict = {}
+        for name in fields:
+            value = getattr(self, name)
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            model_dict[name] = value
+        for name in expand:
+            model_dict[name] = getattr(self, name).to_dict()
+        return model_dict
+
     @classmethod
     def from_dict(cls, model_dict: Dict[str, Any]):
         raise NotImplementedError('from_dict not implemented')
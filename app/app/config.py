@@ -17,6 +17,9 @@ class Config(object):
         port=5432,
     )
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Connections kept open and the most opened by the pool of the async app
+    DATABASE_POOL_MIN = 2
+    DATABASE_POOL_MAX = 10
 
 
 class ProductionConfig(Config):
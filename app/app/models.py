@@ -1,9 +1,24 @@
-from typing import Any, Dict
+from datetime import datetime
+from typing import Any, Dict, Callable
+
+import sqlalchemy as sa  # type: ignore
 
 from app.app import db
 
 Model: Any = db.Model
 
+# Columns of the images set from their labels, other than the start time,
+# with the conversion of their JSON values
+LABEL_COLUMNS: Dict[str, Callable[[Any], Any]] = {
+    'SpacecraftClockStart': float,
+    'ExposureDuration': float,
+    'FilterName': str,
+    'Lines': int,
+    'LineSamples': int,
+    'Bands': int,
+    'SampleType': str,
+}
+
 
 class Camera(Model):
     __tablename__ = 'cameras'
@@ -76,10 +91,22 @@ class Image(Model):
         db.ForeignKey('product_types.ID'),
         nullable=False,
     )
+    # Keywords of the label, stored by the web service when it caches the
+    # image so images are filtered by them without reading their labels.
+    # Null until the image is cached
+    StartTime = db.Column(db.DateTime, index=True)
+    SpacecraftClockStart = db.Column(db.Float, index=True)
+    # Milliseconds
+    ExposureDuration = db.Column(db.Float, index=True)
+    FilterName = db.Column(db.String(30), index=True)
+    Lines = db.Column(db.Integer)
+    LineSamples = db.Column(db.Integer)
+    Bands = db.Column(db.Integer)
+    SampleType = db.Column(db.String(30))
 
     @classmethod
     def from_dict(cls, image_dict: Dict[str, Any]) -> 'Image':
-        return cls(
+        image = cls(
             Name=str(image_dict['Name']),
             URL=str(image_dict['URL']),
             Sol=int(image_dict['Sol']),
@@ -87,6 +114,19 @@ class Image(Model):
             CameraID=int(image_dict['CameraID']),
             ProductTypeID=int(image_dict['ProductTypeID']),
         )
+        image.update_label_from_dict(image_dict)
+        return image
+
+    def update_label_from_dict(self, image_dict: Dict[str, Any]) -> None:
+        converters = dict(LABEL_COLUMNS, StartTime=datetime.fromisoformat)
+        for name, convert in converters.items():
+            value = image_dict.get(name)
+            if value is None:
+                continue
+            try:
+                setattr(self, name, convert(value))
+            except (TypeError, ValueError) as e:
+                raise ValueError(f'Invalid {name} {value!r}: {e}') from e
 
     def to_dict(self) -> Dict[str, Any]:
         to_dict = super().to_dict()
@@ -100,8 +140,14 @@ class Image(Model):
                 'camera': self.camera.to_dict(),
                 'ProductTypeID': self.ProductTypeID,
                 'product_type': self.product_type.to_dict(),
+                'StartTime': (
+                    None if self.StartTime is None
+                    else self.StartTime.isoformat()
+                ),
             }
         )
+        for name in LABEL_COLUMNS:
+            to_dict[name] = getattr(self, name)
         return to_dict
 
     def update_from_dict(self, image_dict: Dict[str, Any]) -> None:
@@ -118,3 +164,89 @@ class Image(Model):
             self.CameraID = image_dict['CameraID']
         if 'ProductTypeID' in image_dict:
             self.ProductTypeID = image_dict['ProductTypeID']
+        self.update_label_from_dict(image_dict)
+
+
+class IndexIngest(Model):
+    """Progress of ingesting a PDS index table, see :mod:`app.pds_index`"""
+
+    __tablename__ = 'index_ingests'
+
+    Table = db.Column(db.Text, nullable=False)
+    Label = db.Column(db.Text, nullable=False)
+    BaseURL = db.Column(db.Text, nullable=False)
+    ProductType = db.Column(db.String(4), nullable=False)
+    # Rows of the table from its label, rows ingested or skipped so far and
+    # rows skipped because they could not be mapped to an image
+    Rows = db.Column(db.Integer)
+    Done = db.Column(db.Integer, nullable=False, default=0)
+    Skipped = db.Column(db.Integer, nullable=False, default=0)
+    # pending, running, finished or failed
+    Status = db.Column(db.String(10), nullable=False, default='pending')
+    Error = db.Column(db.Text)
+
+    @classmethod
+    def from_dict(cls, ingest_dict: Dict[str, Any]) -> 'IndexIngest':
+        return cls(
+            Table=str(ingest_dict['Table']),
+            Label=str(ingest_dict['Label']),
+            BaseURL=str(ingest_dict['BaseURL']),
+            ProductType=str(ingest_dict['ProductType']),
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        to_dict = super().to_dict()
+        to_dict.update(
+            {
+                'Table': self.Table,
+                'Label': self.Label,
+                'BaseURL': self.BaseURL,
+                'ProductType': self.ProductType,
+                'Rows': self.Rows,
+                'Done': self.Done,
+                'Skipped': self.Skipped,
+                'Status': self.Status,
+                'Error': self.Error,
+            }
+        )
+        return to_dict
+
+
+# Images are browsed and filtered by sol, on their own or with the camera or
+# product type. The partial index only holds the active images, which is what
+# the web service lists
+db.Index('ix_images_active_sol', Image.Active, Image.Sol)
+db.Index('ix_images_camera_sol', Image.CameraID, Image.Sol)
+db.Index('ix_images_product_type_sol', Image.ProductTypeID, Image.Sol)
+db.Index(
+    'ix_images_sol_id_active',
+    Image.Sol,
+    Image.ID,
+    postgresql_where=Image.Active,
+    sqlite_where=Image.Active,
+)
+# Collections only list the active images by default, in the order of their
+# IDs unless they are ordered by sol
+db.Index(
+    'ix_images_id_active',
+    Image.ID,
+    postgresql_where=Image.Active,
+    sqlite_where=Image.Active,
+)
+
+# Names are searched by prefix, such as the products of a sequence, and by
+# substring. On PostgreSQL a pattern index serves prefixes and a trigram
+# index any LIKE pattern. Elsewhere LIKE falls back to the unique index or a
+# scan
+for statement in [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX ix_images_name_pattern ON images '
+    '("Name" varchar_pattern_ops)',
+    'CREATE INDEX ix_images_name_trgm ON images '
+    'USING gin ("Name" gin_trgm_ops)',
+]:
+    sa.event.listen(
+        Image.__table__,
+        'after_create',
+        sa.DDL(statement).execute_if(dialect='postgresql'),
+    )
@@ -0,0 +1,405 @@
+"""Bulk ingest of PDS index tables into the images catalog
+
+PDS volumes list every product in an ``INDEX.TAB`` table described by an
+``INDEX.LBL`` label. The table is streamed a row at a time, each row is
+mapped to an image and the images are upserted by name in large batches.
+The progress is kept in an :class:`app.models.IndexIngest` and committed
+with each batch so an interrupted ingest resumes after the last batch.
+
+The ingest runs from the command line::
+
+    python -m app.pds_index INDEX.LBL INDEX.TAB \\
+        https://pds-imaging.jpl.nasa.gov/data/mer/opportunity/mer1po_0xxx \\
+        EDR
+
+or as a background job of the API, see :func:`start_ingest`.
+"""
+import sys
+import logging
+import argparse
+import threading
+import posixpath
+from datetime import datetime
+from typing import (
+    Any,
+    Dict,
+    List,
+    Callable,
+    Iterable,
+    Iterator,
+    Optional,
+    NamedTuple,
+)
+
+import pvl
+import requests
+from sqlalchemy.dialects.postgresql import insert  # type: ignore
+
+from app.app import db, app
+from app.models import Image, Camera, ProductType, IndexIngest
+
+logger = logging.getLogger(__name__)
+
+# Rows upserted in each statement and committed with the progress
+BATCH_SIZE = 5000
+# Names looked up at a time when upserting without ON CONFLICT
+LOOKUP_SIZE = 500
+
+# Columns of an image set from the index, the others keep their value when
+# an image is ingested again
+UPSERT_COLUMNS = ('URL', 'Sol', 'DetatchedLabel', 'CameraID', 'ProductTypeID')
+
+# Cameras of the instrument IDs without the eye, which fit the camera names
+CAMERAS = {
+    'FRONT_HAZCAM': 'FHAZ',
+    'REAR_HAZCAM': 'RHAZ',
+    'MI': 'MI',
+    'NAVCAM': 'NAVCAM',
+    'PANCAM': 'PANCAM',
+}
+
+Progress = Callable[[IndexIngest], None]
+
+
+class IndexColumn(NamedTuple):
+    """Bytes of a column in the rows of an index table"""
+
+    name: str
+    # Offset of the first byte in the row, from 0
+    start: int
+    size: int
+
+    def read(self, row: str) -> str:
+        return row[self.start:self.start + self.size].strip().strip('"')
+
+
+class IndexMapping(NamedTuple):
+    """Columns of an index table the images are made from"""
+
+    path: str = 'FILE_SPECIFICATION_NAME'
+    sol: str = 'PLANET_DAY_NUMBER'
+    camera: str = 'INSTRUMENT_ID'
+
+
+def read_lines(location: str) -> Iterator[str]:
+    """Read the lines of a file or url without loading all of them
+
+    Parameters
+    ----------
+    location : :obj:`str`
+        Path or http(s) url of the file
+
+    Returns
+    -------
+    lines : :obj:`iterator` of :obj:`str`
+        The lines without their line endings
+    """
+    if location.startswith(('http://', 'https://')):
+        with requests.get(location, stream=True) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                yield line.decode('ascii', errors='replace')
+    else:
+        with open(location, 'rb') as stream:
+            for line in stream:
+                yield line.rstrip(b'\r\n').decode('ascii', errors='replace')
+
+
+def read_label(location: str) -> pvl.PVLModule:
+    return pvl.loads('\n'.join(read_lines(location)), strict=False)
+
+
+def get_table(label: pvl.PVLModule) -> pvl.PVLObject:
+    for key, value in label.items():
+        if key.endswith('TABLE') and isinstance(value, pvl.PVLObject):
+            return value
+    raise ValueError('The label has no index table')
+
+
+def get_columns(table: pvl.PVLObject) -> Dict[str, IndexColumn]:
+    """Get the columns of an index table from its label
+
+    Parameters
+    ----------
+    table : :class:`pvl.PVLObject`
+        The table object of the label
+
+    Returns
+    -------
+    columns : :obj:`dict`
+        The :class:`IndexColumn` by their name
+    """
+    columns = {}
+    for column in table.getlist('COLUMN'):
+        name = str(column['NAME'])
+        columns[name] = IndexColumn(
+            name=name,
+            start=int(column['START_BYTE']) - 1,
+            size=int(column['BYTES']),
+        )
+    return columns
+
+
+def camera_name(instrument_id: str) -> str:
+    for eye in ('_LEFT', '_RIGHT'):
+        if instrument_id.endswith(eye):
+            instrument_id = instrument_id[:-len(eye)]
+    name = CAMERAS.get(instrument_id, instrument_id)
+    if len(name) > Camera.Name.type.length:
+        raise ValueError(f'No camera for the instrument {instrument_id}')
+    return name
+
+
+def map_row(row: str, columns: Dict[str, IndexColumn], mapping: IndexMapping,
+            base_url: str) -> Dict[str, Any]:
+    """Map a row of an index table to an image
+
+    Parameters
+    ----------
+    row : :obj:`str`
+        The row of the table
+    columns : :obj:`dict`
+        The columns of the table, see :func:`get_columns`
+    mapping : :class:`IndexMapping`
+        The columns to make the image from
+    base_url : :obj:`str`
+        The url of the volume the paths of the table are relative to
+
+    Returns
+    -------
+    image : :obj:`dict`
+        The ``Name``, ``URL``, ``Sol`` and ``DetatchedLabel`` of the image
+        and the name of its ``camera``
+    """
+    # The imaging node serves the files of the volumes in lower case
+    path = columns[mapping.path].read(row).lower()
+    detached = path.endswith('.lbl')
+    if detached:
+        # Detached labels are listed instead of their image
+        path = path[:-len('.lbl')] + '.img'
+    url = f'{base_url.rstrip("/")}/{path.lstrip("/")}'
+    return {
+        'Name': posixpath.basename(url),
+        'URL': url,
+        'Sol': int(columns[mapping.sol].read(row)),
+        'DetatchedLabel': detached,
+        'camera': camera_name(columns[mapping.camera].read(row)),
+    }
+
+
+def _get_or_create(Resource: Any, name: str) -> int:
+    resource = Resource.query.filter_by(Name=name).first()
+    if resource is None:
+        resource = Resource(Name=name)
+        db.session.add(resource)
+        db.session.flush()
+    return resource.ID
+
+
+def upsert_images(images: List[Dict[str, Any]]) -> None:
+    """Insert images or update the images with the same names
+
+    On PostgreSQL this is a single multi-row ``INSERT ... ON CONFLICT``
+    statement with the values of every image. Other databases look up the
+    existing names first and insert and update the images in bulk.
+
+    Parameters
+    ----------
+    images : :obj:`list` of :obj:`dict`
+        The column values of the images, with unique names
+    """
+    if not images:
+        return
+    now = datetime.utcnow()
+    rows = [dict(image, Updated=now) for image in images]
+    table = Image.__table__
+    if db.engine.dialect.name == 'postgresql':
+        rows = [dict(row, Created=now, Active=True) for row in rows]
+        # The rows are values of the statement rather than parameters of an
+        # executemany, which would make a round trip per image
+        statement = insert(table).values(rows)
+        updates = {
+            name: statement.excluded[name]
+            for name in UPSERT_COLUMNS + ('Updated',)
+        }
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.Name],
+            set_=updates,
+        )
+        db.session.execute(statement)
+        return
+    names = [row['Name'] for row in rows]
+    existing: Dict[str, int] = {}
+    # SQLite limits the number of parameters of a statement
+    for n in range(0, len(names), LOOKUP_SIZE):
+        query = db.session.query(Image.Name, Image.ID).filter(
+            Image.Name.in_(names[n:n + LOOKUP_SIZE]),
+        )
+        existing.update(query)
+    inserts = [row for row in rows if row['Name'] not in existing]
+    updates = [
+        dict(row, ID=existing[row['Name']])
+        for row in rows if row['Name'] in existing
+    ]
+    db.session.bulk_insert_mappings(Image, inserts)
+    db.session.bulk_update_mappings(Image, updates)
+
+
+def _batches(rows: Iterable[str], start: int) -> Iterator[List[str]]:
+    batch = []
+    # Blank lines are not rows, so the rows counted in Done are the same
+    lines = (row for row in rows if row.strip())
+    for n, row in enumerate(lines):
+        # Rows ingested before resuming are skipped without being parsed
+        if n < start:
+            continue
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def ingest(job: IndexIngest, mapping: IndexMapping = IndexMapping(),
+           progress: Optional[Progress] = None) -> IndexIngest:
+    """Ingest the rows of an index table not ingested yet
+
+    Parameters
+    ----------
+    job : :class:`app.models.IndexIngest`
+        The ingest, which starts after the rows it has ``Done``
+    mapping : :class:`IndexMapping`
+        The columns of the table the images are made from
+    progress : :obj:`callable`, optional
+        Called with the ingest after each batch
+
+    Returns
+    -------
+    job : :class:`app.models.IndexIngest`
+        The finished or failed ingest
+    """
+    logger.info(f'Ingesting {job.Table} from row {job.Done}')
+    try:
+        table = get_table(read_label(job.Label))
+        columns = get_columns(table)
+        missing = set(mapping) - set(columns)
+        if missing:
+            raise ValueError(f'The table has no columns {sorted(missing)}')
+        job.Rows = int(table['ROWS']) if 'ROWS' in table else None
+        job.Status = 'running'
+        db.session.commit()
+        product_type_ID = _get_or_create(ProductType, job.ProductType)
+        camera_IDs: Dict[str, int] = {}
+        for batch in _batches(read_lines(job.Table), job.Done):
+            images: Dict[str, Dict[str, Any]] = {}
+            for row in batch:
+                try:
+                    image = map_row(row, columns, mapping, job.BaseURL)
+                except (ValueError, IndexError) as e:
+                    logger.warning(f'Skipping row {row!r}: {e}')
+                    job.Skipped += 1
+                    continue
+                camera = image.pop('camera')
+                if camera not in camera_IDs:
+                    camera_IDs[camera] = _get_or_create(Camera, camera)
+                image['CameraID'] = camera_IDs[camera]
+                image['ProductTypeID'] = product_type_ID
+                # A product listed twice is upserted once
+                images[image['Name']] = image
+            upsert_images(list(images.values()))
+            # The progress is committed with the images it counts
+            job.Done += len(batch)
+            db.session.commit()
+            logger.info(f'Ingested {job.Done} rows of {job.Table}')
+            if progress is not None:
+                progress(job)
+        job.Status = 'finished'
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.exception(f'Failed ingesting {job.Table}')
+        job.Status = 'failed'
+        job.Error = f'{type(e).__name__}: {e}'
+        db.session.commit()
+    return job
+
+
+def _run(ID: int) -> None:
+    with app.app_context():
+        ingest(IndexIngest.query.get(ID))
+        db.session.remove()
+
+
+def start_ingest(job: IndexIngest) -> None:
+    """Ingest in a background thread of the API
+
+    Parameters
+    ----------
+    job : :class:`app.models.IndexIngest`
+        The committed ingest
+    """
+    thread = threading.Thread(target=_run, args=(job.ID,), daemon=True)
+    thread.start()
+
+
+def _print_progress(job: IndexIngest) -> None:
+    total = '?' if job.Rows is None else job.Rows
+    sys.stderr.write(f'\r{job.Done}/{total} rows ({job.Skipped} skipped)')
+    sys.stderr.flush()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description='Ingest a PDS index table into the images catalog',
+    )
+    parser.add_argument('label', help='Path or url of INDEX.LBL')
+    parser.add_argument('table', help='Path or url of INDEX.TAB')
+    parser.add_argument(
+        'base_url',
+        help='Url of the volume the paths of the table are relative to',
+    )
+    parser.add_argument('product_type', help='Product type of the images')
+    parser.add_argument(
+        '--restart',
+        action='store_true',
+        help='Start from the first row instead of resuming the last ingest '
+             'of the table',
+    )
+    for name, default in IndexMapping._field_defaults.items():
+        parser.add_argument(
+            f'--{name}-column',
+            default=default,
+            help=f'Column of the {name} of the images (default: {default})',
+        )
+    args = parser.parse_args(argv)
+    mapping = IndexMapping(
+        path=args.path_column,
+        sol=args.sol_column,
+        camera=args.camera_column,
+    )
+    job = None
+    if not args.restart:
+        job = IndexIngest.query.filter(
+            IndexIngest.Table == args.table,
+            IndexIngest.Status != 'finished',
+        ).order_by(IndexIngest.ID.desc()).first()
+    if job is None:
+        job = IndexIngest.from_dict({
+            'Table': args.table,
+            'Label': args.label,
+            'BaseURL': args.base_url,
+            'ProductType': args.product_type,
+        })
+        db.session.add(job)
+        db.session.commit()
+    job = ingest(job, mapping, _print_progress)
+    sys.stderr.write('\n')
+    if job.Status != 'finished':
+        sys.stderr.write(f'Failed: {job.Error}\n')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
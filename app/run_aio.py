@@ -0,0 +1,9 @@
+from app.aio import aio_app
+
+
+def run():
+    aio_app.run(host='0.0.0.0', port=80, debug=False)
+
+
+if __name__ == '__main__':
+    run()
@@ -21,6 +21,11 @@ setup(
         'psycopg2-binary==2.7.7',
         'flask-cors==3.0.7',
         'sentry-sdk[flask]==0.7.6',
+        'pvl==0.3.0',
+        'Quart==0.8.1',
+        'databases==0.2.6',
+        'asyncpg==0.18.3',
+        'aiosqlite==0.10.0',
     ],
     license="BSD",
     zip_safe=False,
@@ -3,6 +3,7 @@ import time
 
 import pytest
 import docker
+import sqlalchemy as sa  # type: ignore
 
 from app.app import db
 from app import config
@@ -58,6 +59,25 @@ def application():
     return testing_app
 
 
+@pytest.fixture
+def statements(session):
+    """SQL statements executed by the database while the test runs"""
+    executed = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        executed.append(statement)
+
+    sa.event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield executed
+    finally:
+        sa.event.remove(
+            db.engine,
+            'before_cursor_execute',
+            before_cursor_execute,
+        )
+
+
 @pytest.fixture
 def session(application, docker_container):
     assert db.get_app().config['TESTING']
@@ -0,0 +1,301 @@
+import json
+from urllib.parse import urlsplit, parse_qsl
+
+import pytest
+import sqlalchemy as sa  # type: ignore
+
+from app import aio, api
+from app.app import db
+from app.models import Image
+
+
+@pytest.fixture
+async def client(tmpdir):
+    url = f'sqlite:///{tmpdir.join("aio.db")}'
+    db.metadata.create_all(sa.create_engine(url))
+    database = aio.create_database(url, 1, 1)
+    await database.connect()
+    aio.aio_app.database = database
+    try:
+        yield aio.aio_app.test_client()
+    finally:
+        aio.aio_app.database = None
+        await database.disconnect()
+
+
+async def _add_images(client, sols):
+    response = await client.post('/api/cameras', json={'Name': 'foo'})
+    assert response.status_code == 201
+    response = await client.post('/api/product_types', json={'Name': 'EDR'})
+    assert response.status_code == 201
+    images = [
+        {
+            'Name': f'image{n}',
+            'URL': f'url{n}',
+            'Sol': sol,
+            'DetatchedLabel': False,
+            'CameraID': 1,
+            'ProductTypeID': 1,
+        }
+        for n, sol in enumerate(sols)
+    ]
+    response = await client.post('/api/images/bulk', json=images)
+    assert response.status_code == 201
+    assert (await response.get_json()) == {'created': len(sols), 'errors': []}
+
+
+@pytest.mark.asyncio
+async def test_create_and_get_resource(client):
+    response = await client.post('/api/cameras', json={'Name': 'foo'})
+    assert response.status_code == 201
+    created = await response.get_json()
+    assert created['ID'] == 1
+    assert created['Name'] == 'foo'
+    assert created['Active'] is True
+
+    response = await client.get('/api/cameras/1')
+    assert response.status_code == 200
+    assert (await response.get_json()) == created
+
+    response = await client.get('/api/cameras/2')
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_create_resource_invalid(client):
+    response = await client.post('/api/cameras', json={'Foo': 'bar'})
+    assert response.status_code == 400
+    response = await client.post('/api/foo', json={'Name': 'foo'})
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_get_image_embeds_relationships(client):
+    await _add_images(client, [1])
+    response = await client.get('/api/images/1')
+    image = await response.get_json()
+    columns = [column.name for column in Image.__table__.columns]
+    assert set(image) == set(columns) | {'camera', 'product_type'}
+    assert image['camera']['Name'] == 'foo'
+    assert image['product_type']['Name'] == 'EDR'
+
+    response = await client.get(
+        '/api/images/1',
+        query_string={'fields': 'ID,Name', 'expand': 'camera'},
+    )
+    image = await response.get_json()
+    assert set(image) == {'ID', 'Name', 'camera'}
+    assert image['camera']['Name'] == 'foo'
+
+
+@pytest.mark.asyncio
+async def test_get_by_name(client):
+    await _add_images(client, [42])
+    response = await client.get('/api/images/by_name/image0')
+    assert response.status_code == 200
+    image = await response.get_json()
+    assert image['Sol'] == 42
+    assert image['camera']['Name'] == 'foo'
+
+    response = await client.get('/api/images/by_name/image1')
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_get_collection(client):
+    await _add_images(client, [3, 1, 2])
+    response = await client.get('/api/images')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/json'
+    images = await response.get_json()
+    assert [image['ID'] for image in images] == [1, 2, 3]
+    assert 'Link' not in response.headers
+
+    response = await client.get(
+        '/api/images',
+        query_string={'Sol__gte': '2', 'order_by': '-Sol'},
+    )
+    images = await response.get_json()
+    assert [image['Sol'] for image in images] == [3, 2]
+
+    response = await client.get(
+        '/api/images',
+        query_string={'Name__startswith': 'image1'},
+    )
+    assert [image['Sol'] for image in await response.get_json()] == [1]
+
+    response = await client.get('/api/images', query_string={'Sol': 'a'})
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_get_collection_ndjson(client):
+    await _add_images(client, [1, 2])
+    response = await client.get(
+        '/api/images',
+        headers={'Accept': 'application/x-ndjson'},
+    )
+    assert response.mimetype == 'application/x-ndjson'
+    assert response.headers['Vary'] == 'Accept'
+    lines = (await response.get_data()).decode().splitlines()
+    assert [json.loads(line)['Sol'] for line in lines] == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_get_collection_pages(client):
+    await _add_images(client, [1, 2, 3, 4, 5])
+    sols = []
+    params = {'limit': '2', 'order_by': 'Sol'}
+    while True:
+        response = await client.get('/api/images', query_string=params)
+        sols.extend(image['Sol'] for image in await response.get_json())
+        if 'Link' not in response.headers:
+            break
+        link = response.headers['Link']
+        assert link.endswith('; rel="next"')
+        params = dict(parse_qsl(urlsplit(link[1:link.index('>')]).query))
+    assert sols == [1, 2, 3, 4, 5]
+
+
+@pytest.mark.asyncio
+async def test_get_collection_not_modified(client):
+    await _add_images(client, [1])
+    response = await client.get('/api/images')
+    etag = response.headers['ETag']
+    assert etag.startswith('W/')
+
+    response = await client.get(
+        '/api/images',
+        headers={'If-None-Match': etag},
+    )
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert response.headers['Vary'] == 'Accept'
+
+    # Other formats and query strings have other bodies
+    response = await client.get(
+        '/api/images',
+        headers={'If-None-Match': etag, 'Accept': 'application/x-ndjson'},
+    )
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    response = await client.get(
+        '/api/images',
+        query_string={'fields': 'ID'},
+        headers={'If-None-Match': etag},
+    )
+    assert response.status_code == 200
+    assert (await response.get_json()) == [{'ID': 1}]
+
+    await client.put('/api/cameras/1', json={'Name': 'bar'})
+    response = await client.get(
+        '/api/images',
+        headers={'If-None-Match': etag},
+    )
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+@pytest.mark.asyncio
+async def test_get_resource_stats(client, mocker):
+    mocker.patch.dict(api.STATS_CACHE, clear=True)
+    await _add_images(client, [1, 2, 2])
+    response = await client.get(
+        '/api/images/stats',
+        query_string={'group_by': 'Sol'},
+    )
+    assert (await response.get_json()) == [
+        {'Sol': 1, 'count': 1},
+        {'Sol': 2, 'count': 2},
+    ]
+    response = await client.get(
+        '/api/images/stats',
+        query_string={'group_by': 'Sol'},
+        headers={'If-None-Match': response.headers['ETag']},
+    )
+    assert response.status_code == 304
+
+
+@pytest.mark.asyncio
+async def test_update_and_delete_resource(client):
+    response = await client.post('/api/cameras', json={'Name': 'foo'})
+    created = await response.get_json()
+
+    response = await client.put('/api/cameras/1', json={'Name': 'bar'})
+    assert response.status_code == 200
+    updated = await response.get_json()
+    assert updated['Name'] == 'bar'
+    assert updated['Created'] == created['Created']
+    assert updated['Updated'] > created['Updated']
+
+    response = await client.delete('/api/cameras/1')
+    assert response.status_code == 200
+    assert (await response.get_json())['Active'] is False
+
+    response = await client.delete('/api/cameras/2')
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_bulk_create_invalid(client):
+    response = await client.post(
+        '/api/cameras/bulk',
+        json=[{'Name': 'foo'}, {'Foo': 'bar'}],
+    )
+    assert response.status_code == 400
+    result = await response.get_json()
+    assert result['created'] == 0
+    assert [error['index'] for error in result['errors']] == [1]
+    response = await client.get('/api/cameras')
+    assert (await response.get_json()) == []
+
+
+@pytest.mark.asyncio
+async def test_bulk_update(client):
+    await _add_images(client, [1, 2, 3])
+    response = await client.put(
+        '/api/images/bulk',
+        query_string={'Sol__lte': '2'},
+        json={'URL': 'moved'},
+    )
+    assert response.status_code == 200
+    assert (await response.get_json()) == {'updated': 2}
+    response = await client.get('/api/images', query_string={'URL': 'moved'})
+    assert [image['Sol'] for image in await response.get_json()] == [1, 2]
+
+    response = await client.put('/api/images/bulk', json={'URL': 'moved'})
+    assert response.status_code == 400
+
+    # Invalid values of a label are rejected on both update paths
+    data = {'StartTime': 'yesterday'}
+    response = await client.put(
+        '/api/images/bulk',
+        query_string={'Sol': '1'},
+        json=data,
+    )
+    assert response.status_code == 400
+    response = await client.put('/api/images/1', json=data)
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_bulk_delete_and_restore(client):
+    await _add_images(client, [1, 1, 2])
+    response = await client.delete('/api/images', query_string={'Sol': '1'})
+    assert response.status_code == 200
+    assert (await response.get_json()) == {'deleted': 2}
+    response = await client.get('/api/images')
+    assert [image['Sol'] for image in await response.get_json()] == [2]
+
+    response = await client.post(
+        '/api/images/restore',
+        query_string={'Name': 'image0'},
+    )
+    assert (await response.get_json()) == {'restored': 1}
+    response = await client.get('/api/images', query_string={'Sol': '1'})
+    assert [image['Name'] for image in await response.get_json()] == [
+        'image0',
+    ]
+
+    response = await client.delete('/api/images')
+    assert response.status_code == 400
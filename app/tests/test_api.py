@@ -1,8 +1,12 @@
+import json
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
 from werkzeug.exceptions import NotFound, BadRequest
 
 from app import api
-from app.models import Camera
+from app.models import Image, Camera, ProductType
 
 
 def test_get_query_string_params(application):
@@ -31,6 +35,29 @@ def test_get_resource_not_found(session):
         api.get_resource(Camera, 2)
 
 
+def test_get_resource_by_name(session, application):
+    _add_images(session, [42])
+    with application.test_request_context('/api/images/by_name/im1'):
+        image = api.get_resource_by_name(Image, 'im1')
+    assert image['ID'] == 1
+    assert image['camera']['Name'] == 'foo'
+
+    url = '/api/images/by_name/im1?fields=Sol'
+    with application.test_request_context(url):
+        assert api.get_resource_by_name(Image, 'im1') == {'Sol': 42}
+
+    with application.test_request_context('/api/images/by_name/im2'):
+        with pytest.raises(NotFound):
+            api.get_resource_by_name(Image, 'im2')
+
+    client = application.test_client()
+    r = client.get('/api/cameras/by_name/foo')
+    assert r.status_code == 200
+    assert r.json['ID'] == 1
+    r = client.get('/api/cameras/by_name/bar')
+    assert r.status_code == 404
+
+
 def test_get_resource_multiple_items(session, application):
     session.add(Camera(Name='foo'))
     session.commit()
@@ -52,6 +79,260 @@ def test_get_resource_multiple_items(session, application):
         assert resources[1]['ID'] == 2
 
 
+def _add_images(session, sols):
+    camera = Camera(Name='foo')
+    product_type = ProductType(Name='EDR')
+    session.add_all([camera, product_type])
+    session.commit()
+    for n, sol in enumerate(sols, 1):
+        session.add(
+            Image(
+                Name=f'im{n}',
+                URL='url',
+                Sol=sol,
+                DetatchedLabel=False,
+                CameraID=camera.ID,
+                ProductTypeID=product_type.ID,
+            )
+        )
+    session.commit()
+
+
+def _get_all_pages(application, url):
+    names = []
+    cursor = None
+    while True:
+        page_url = url if cursor is None else f'{url}&cursor={cursor}'
+        with application.test_request_context(page_url):
+            items, cursor = api.get_page(Image)
+        names.append([item['Name'] for item in items])
+        if cursor is None:
+            return names
+
+
+def test_get_page(session, application):
+    _add_images(session, [3, 1, 2, 1, 3])
+
+    with application.test_request_context('/api/images'):
+        items, cursor = api.get_page(Image)
+    assert [item['ID'] for item in items] == [1, 2, 3, 4, 5]
+    assert cursor is None
+
+    pages = _get_all_pages(application, '/api/images?limit=2')
+    assert pages == [['im1', 'im2'], ['im3', 'im4'], ['im5']]
+    pages = _get_all_pages(application, '/api/images?limit=2&order_by=-ID')
+    assert pages == [['im5', 'im4'], ['im3', 'im2'], ['im1']]
+    # Images with the same sol are ordered by ID
+    pages = _get_all_pages(application, '/api/images?limit=2&order_by=Sol')
+    assert pages == [['im2', 'im4'], ['im3', 'im1'], ['im5']]
+    pages = _get_all_pages(application, '/api/images?limit=3&order_by=-Sol')
+    assert pages == [['im5', 'im1', 'im3'], ['im4', 'im2']]
+    pages = _get_all_pages(application, '/api/images?limit=5')
+    assert pages == [['im1', 'im2', 'im3', 'im4', 'im5']]
+
+    with application.test_request_context('/api/images?limit=1&Sol=1'):
+        items, cursor = api.get_page(Image)
+    assert [item['Name'] for item in items] == ['im2']
+    with application.test_request_context(
+            f'/api/images?limit=1&Sol=1&cursor={cursor}'):
+        items, cursor = api.get_page(Image)
+    assert [item['Name'] for item in items] == ['im4']
+    assert cursor is None
+
+
+def test_get_filters(session, application):
+    _add_images(session, [3, 1, 2, 1, 3])
+    image = Image.query.filter_by(Name='im2').first()
+    image.Active = False
+    session.commit()
+
+    def names(url):
+        with application.test_request_context(url):
+            return [item['Name'] for item in api.get_page(Image)[0]]
+
+    # Deleted images are left out unless filtered by Active
+    assert names('/api/images?Sol=1') == ['im4']
+    assert names('/api/images?Sol__ne=1') == ['im1', 'im3', 'im5']
+    assert names('/api/images?Sol__gte=2') == ['im1', 'im3', 'im5']
+    assert names('/api/images?Sol__gt=2') == ['im1', 'im5']
+    assert names('/api/images?Sol__lt=2') == ['im4']
+    assert names('/api/images?Sol__gte=2&Sol__lte=2') == ['im3']
+    assert names('/api/images?Sol__in=1,2') == ['im3', 'im4']
+    assert names('/api/images?Name__in=im1,im5') == ['im1', 'im5']
+    assert names('/api/images?Name__startswith=im') == [
+        'im1',
+        'im3',
+        'im4',
+        'im5',
+    ]
+    assert names('/api/images?Name__startswith=m') == []
+    assert names('/api/images?Name__contains=m3') == ['im3']
+    assert names('/api/images?Name__contains=%25') == []
+    assert names('/api/images?Name__contains=_') == []
+    assert names('/api/images?Active=true&Sol=1') == ['im4']
+    assert names('/api/images?Active=0') == ['im2']
+    assert names('/api/images?Active__in=true,false&Sol=1') == ['im2', 'im4']
+    assert names('/api/images?Active=True&order_by=-ID&limit=2') == [
+        'im5',
+        'im4',
+    ]
+
+    urls = [
+        '/api/images?Foo=1',
+        '/api/images?Sol__foo=1',
+        '/api/images?Sol=one',
+        '/api/images?Sol__in=1,two',
+        '/api/images?Active=maybe',
+        '/api/images?Created__gte=yesterday',
+        '/api/images?Sol__startswith=1',
+    ]
+    for url in urls:
+        with pytest.raises(BadRequest):
+            with application.test_request_context(url):
+                api.get_filters(Image)
+
+
+def test_get_filters_since(session, application):
+    _add_images(session, [1, 2, 3])
+    since = Image.query.filter_by(Name='im3').first().Updated.isoformat()
+
+    def names(url):
+        with application.test_request_context(url):
+            return [item['Name'] for item in api.get_page(Image)[0]]
+
+    assert names(f'/api/images?since={since}') == []
+    image = Image.query.filter_by(Name='im1').first()
+    image.URL = 'moved'
+    session.commit()
+    image = Image.query.filter_by(Name='im2').first()
+    image.delete()
+    session.commit()
+    assert names(f'/api/images?since={since}') == ['im1', 'im2']
+    assert names(f'/api/images?since={since}&Active=true') == ['im1']
+
+    with application.test_request_context('/api/images?since=yesterday'):
+        with pytest.raises(BadRequest):
+            api.get_filters(Image)
+
+
+def test_parse_filter_value():
+    assert api.parse_filter_value(Image.Sol, '42') == 42
+    assert api.parse_filter_value(Image.Name, '42') == '42'
+    assert api.parse_filter_value(Image.Active, 'FALSE') is False
+    created = api.parse_filter_value(Image.Created, '2019-02-03T04:05:06')
+    assert created == datetime(2019, 2, 3, 4, 5, 6)
+
+
+def test_get_projection(session, application, statements):
+    _add_images(session, [3, 1])
+
+    def get_page(url):
+        with application.test_request_context(url):
+            del statements[:]
+            items, cursor = api.get_page(Image)
+            return items, cursor, list(statements)
+
+    items, cursor, executed = get_page(
+        '/api/images?fields=Name,Sol&limit=1&order_by=Sol'
+    )
+    assert items == [{'Name': 'im2', 'Sol': 1}]
+    assert len(executed) == 1
+    assert 'URL' not in executed[0]
+    assert 'cameras' not in executed[0]
+
+    items, _, executed = get_page(
+        f'/api/images?fields=Name,Sol&order_by=Sol&cursor={cursor}'
+    )
+    assert items == [{'Name': 'im1', 'Sol': 3}]
+    assert len(executed) == 1
+
+    items, _, executed = get_page('/api/images?fields=Name&expand=camera')
+    assert items[0] == {'Name': 'im1', 'camera': items[0]['camera']}
+    assert items[0]['camera']['Name'] == 'foo'
+    assert len(executed) == 1
+    assert 'product_types' not in executed[0]
+
+    # Every column without the relationships
+    items, _, _ = get_page('/api/images?expand=')
+    assert 'URL' in items[0]
+    assert 'camera' not in items[0]
+    items, _, _ = get_page('/api/images')
+    assert 'camera' in items[0]
+
+    with application.test_request_context('/api/images/1?fields=Name'):
+        assert api.get_resource(Image, 1) == {'Name': 'im1'}
+
+    for url in ['/api/images?fields=Foo', '/api/cameras?expand=images']:
+        Resource = Camera if 'cameras' in url else Image
+        with pytest.raises(BadRequest):
+            with application.test_request_context(url):
+                api.get_projection(Resource)
+
+
+def test_get_page_query_count(session, application, statements):
+
+    def count_queries(url):
+        with application.test_request_context(url):
+            del statements[:]
+            items, _ = api.get_page(Image)
+            # Serialize again in case anything is loaded lazily
+            assert [item['camera'] for item in items]
+            assert [item['product_type'] for item in items]
+            return len(statements)
+
+    sols = range(1, 6)
+    for sol in sols:
+        session.add(Camera(Name=f'cam{sol}'))
+        session.add(ProductType(Name=f'pt{sol}'))
+    session.commit()
+    session.add(Image(
+        Name='im1',
+        URL='url',
+        Sol=1,
+        DetatchedLabel=False,
+        CameraID=1,
+        ProductTypeID=1,
+    ))
+    session.commit()
+    single = count_queries('/api/images')
+    assert single == 1
+
+    for sol in sols[1:]:
+        session.add(Image(
+            Name=f'im{sol}',
+            URL='url',
+            Sol=sol,
+            DetatchedLabel=False,
+            CameraID=sol,
+            ProductTypeID=sol,
+        ))
+    session.commit()
+    assert count_queries('/api/images') == single
+    assert count_queries('/api/images?limit=2&order_by=-Sol') == single
+
+
+def test_get_page_errors(session, application):
+    cursor = api.encode_cursor('ID', [1])
+    urls = [
+        '/api/images?limit=0',
+        '/api/images?limit=foo',
+        '/api/images?order_by=Name',
+        '/api/cameras?order_by=Sol',
+        '/api/images?cursor=foo',
+        f'/api/images?order_by=Sol&cursor={cursor}',
+    ]
+    for url in urls:
+        Resource = Camera if 'cameras' in url else Image
+        with pytest.raises(BadRequest):
+            with application.test_request_context(url):
+                api.get_page(Resource)
+
+
+def test_cursor():
+    cursor = api.encode_cursor('-Sol', [42, 7])
+    assert api.decode_cursor(cursor, '-Sol') == [42, 7]
+
+
 def test_get_data_from_json(application):
     with pytest.raises(BadRequest):
         with application.test_request_context(json=None):
@@ -110,6 +391,17 @@ def test_update_resource(session, application):
     assert up2_cam.Updated.isoformat() == cam['Updated']
 
 
+def test_update_deleted_resource(session, application):
+    session.add_all([Camera(Name='foo'), Camera(Name='bar', Active=False)])
+    session.commit()
+    url = '/api?Name=bar'
+    with application.test_request_context(url, json={'Name': 'baz'}):
+        cam = api.update_resource(Camera)
+    assert cam['Name'] == 'baz'
+    assert not cam['Active']
+    assert Camera.query.filter_by(Name='baz').one().ID == 2
+
+
 def test_delete_resource(session):
     session.add(Camera(Name='foo'))
     session.commit()
@@ -127,6 +419,217 @@ def test_delete_resource(session):
         api.delete_resource(Camera, 2)
 
 
+def _image_data(n, sol):
+    return {
+        'Name': f'im{n}',
+        'URL': 'url',
+        'DetatchedLabel': False,
+        'Sol': sol,
+        'CameraID': 1,
+        'ProductTypeID': 1,
+    }
+
+
+def test_bulk_create_resources(session, application, statements):
+    session.add_all([Camera(Name='foo'), ProductType(Name='EDR')])
+    session.commit()
+
+    data = [_image_data(n, 42) for n in range(1, 4)]
+    with application.test_request_context(json=data):
+        del statements[:]
+        result, status_code = api.bulk_create_resources(Image)
+        inserts = [s for s in statements if s.startswith('INSERT')]
+    assert status_code == 201
+    assert result == {'created': 3, 'errors': []}
+    assert len(inserts) == 1
+    images = Image.query.order_by(Image.ID).all()
+    assert [image.Name for image in images] == ['im1', 'im2', 'im3']
+    assert all(image.Active for image in images)
+    assert all(image.Created is not None for image in images)
+
+    data = [_image_data(4, 42), {'Name': 'im5'}, _image_data(6, 'sol')]
+    with application.test_request_context(json=data):
+        result, status_code = api.bulk_create_resources(Image)
+    assert status_code == 400
+    assert result['created'] == 0
+    assert [error['index'] for error in result['errors']] == [1, 2]
+    assert Image.query.count() == 3
+
+    # A duplicate name rolls back every item
+    data = [_image_data(4, 42), _image_data(1, 42)]
+    with pytest.raises(BadRequest):
+        with application.test_request_context(json=data):
+            api.bulk_create_resources(Image)
+    assert Image.query.count() == 3
+
+    with pytest.raises(BadRequest):
+        with application.test_request_context(json={'Name': 'foo'}):
+            api.bulk_create_resources(Camera)
+
+
+def test_bulk_update_resources(session, application, statements):
+    session.add_all([Camera(Name='foo'), ProductType(Name='EDR')])
+    session.commit()
+    for n, sol in enumerate([1, 2, 3], 1):
+        session.add(Image.from_dict(_image_data(n, sol)))
+    session.commit()
+
+    url = '/api/images/bulk?Sol__gte=2'
+    with application.test_request_context(url, json={'URL': 'new'}):
+        del statements[:]
+        result, status_code = api.bulk_update_resources(Image)
+        updates = [s for s in statements if s.startswith('UPDATE')]
+    assert status_code == 200
+    assert result == {'updated': 2}
+    assert len(updates) == 1
+    images = Image.query.order_by(Image.ID).all()
+    assert [image.URL for image in images] == ['url', 'new', 'new']
+    assert images[1].Updated > images[0].Updated
+
+    urls_data = [
+        # Filters are required
+        ('/api/images/bulk', {'URL': 'new'}),
+        # Nothing the model can update
+        (url, {'Foo': 'bar'}),
+        (url, {'ID': 5}),
+        (url, None),
+    ]
+    for url, data in urls_data:
+        with pytest.raises(BadRequest):
+            with application.test_request_context(url, json=data):
+                api.bulk_update_resources(Image)
+
+
+def test_label_metadata(session, application):
+    _add_images(session, [1, 1, 2])
+    client = application.test_client()
+    metadata = {
+        'StartTime': '2004-01-26T03:17:43.880000',
+        'SpacecraftClockStart': 128287538.108,
+        'ExposureDuration': 149.76,
+        'FilterName': 'L2_753NM',
+        'Lines': 1024,
+        'LineSamples': 1024,
+        'Bands': 1,
+        'SampleType': 'MSB_INTEGER',
+    }
+    # The web service stores the values of a label once it is cached
+    r = client.put('/api/images/bulk?Name=im2', json=metadata)
+    assert r.json == {'updated': 1}
+    r = client.put(
+        '/api/images/bulk?Name=im3',
+        json=dict(metadata, StartTime='2004-01-27T00:00:00',
+                  ExposureDuration=20),
+    )
+    assert r.json == {'updated': 1}
+
+    r = client.get('/api/images/by_name/im2')
+    assert {name: r.json[name] for name in metadata} == metadata
+    r = client.get('/api/images/by_name/im1')
+    assert r.json['StartTime'] is None
+
+    for query, names in [
+        ('ExposureDuration__gt=100', ['im2']),
+        ('FilterName=L2_753NM', ['im2', 'im3']),
+        ('StartTime__gte=2004-01-27T00:00:00', ['im3']),
+        ('SpacecraftClockStart__lt=128287539&Sol=1', ['im2']),
+    ]:
+        r = client.get(f'/api/images?{query}&fields=Name')
+        assert [image['Name'] for image in r.json] == names
+
+    r = client.get('/api/images?ExposureDuration__gt=long')
+    assert r.status_code == 400
+
+    # Invalid values of a label are rejected on both update paths
+    for data in [{'StartTime': 'yesterday'}, {'ExposureDuration': 'long'},
+                 {'Lines': [1024]}]:
+        r = client.put('/api/images/bulk?Name=im1', json=data)
+        assert r.status_code == 400
+        r = client.put('/api/images/1', json=data)
+        assert r.status_code == 400
+    r = client.get('/api/images/by_name/im1')
+    assert r.json['StartTime'] is None
+    assert r.json['ExposureDuration'] is None
+
+
+def test_bulk_delete_and_restore(session, application, statements):
+    _add_images(session, [1, 1, 2, 3])
+    url = '/api/images?Sol__lte=2'
+    with application.test_request_context(url, method='DELETE'):
+        del statements[:]
+        result, status_code = api.bulk_delete_resources(Image)
+        updates = [s for s in statements if s.startswith('UPDATE')]
+    assert status_code == 200
+    assert result == {'deleted': 3}
+    assert len(updates) == 1
+    images = Image.query.order_by(Image.ID).all()
+    assert [image.Active for image in images] == [False, False, False, True]
+    assert images[0].Updated > images[3].Updated
+
+    # Only the images changed are counted
+    with application.test_request_context(url, method='DELETE'):
+        assert api.bulk_delete_resources(Image) == ({'deleted': 0}, 200)
+    with application.test_request_context('/api/images/restore?Sol=1'):
+        result, status_code = api.bulk_restore_resources(Image)
+    assert result == {'restored': 2}
+    images = Image.query.order_by(Image.ID).all()
+    assert [image.Active for image in images] == [True, True, False, True]
+
+    for url in ['/api/images', '/api/images?Sol=one']:
+        with pytest.raises(BadRequest):
+            with application.test_request_context(url, method='DELETE'):
+                api.bulk_delete_resources(Image)
+        with pytest.raises(BadRequest):
+            with application.test_request_context(url):
+                api.bulk_restore_resources(Image)
+
+
+def test_bulk_delete_and_restore_routes(session, application):
+    _add_images(session, [1, 1, 2])
+    client = application.test_client()
+    r = client.delete('/api/images?Sol=1')
+    assert r.status_code == 200
+    assert r.json == {'deleted': 2}
+    r = client.get('/api/images?fields=Name')
+    assert r.json == [{'Name': 'im3'}]
+    r = client.get('/api/images?fields=Name&Active=false')
+    assert r.json == [{'Name': 'im1'}, {'Name': 'im2'}]
+
+    r = client.post('/api/images/restore?Name=im2')
+    assert r.status_code == 200
+    assert r.json == {'restored': 1}
+    r = client.get('/api/images?fields=Name')
+    assert r.json == [{'Name': 'im2'}, {'Name': 'im3'}]
+
+    r = client.delete('/api/images')
+    assert r.status_code == 400
+    r = client.post('/api/foo/restore?Name=im2')
+    assert r.status_code == 404
+
+
+def test_bulk_create_or_update(session, application):
+    client = application.test_client()
+    data = [{'Name': 'foo'}, {'Name': 'bar'}]
+    r = client.post('/api/cameras/bulk', json=data)
+    assert r.status_code == 201
+    assert r.json == {'created': 2, 'errors': []}
+    r = client.post('/api/cameras/bulk', json=[{'Name': 'baz'}, {}])
+    assert r.status_code == 400
+    assert r.json['errors'][0]['index'] == 1
+
+    r = client.put('/api/cameras/bulk?Name__in=foo,bar', json={'Name': 'baz'})
+    # Names are unique
+    assert r.status_code == 400
+    r = client.put('/api/cameras/bulk?Name=foo', json={'Name': 'baz'})
+    assert r.status_code == 200
+    assert r.json == {'updated': 1}
+    r = client.get('/api/cameras')
+    assert [camera['Name'] for camera in r.json] == ['baz', 'bar']
+
+    r = client.post('/api/foo/bulk', json=[])
+    assert r.status_code == 404
+
+
 def test_get_create_update_or_delete(session, application):
     client = application.test_client()
     # Test create
@@ -182,3 +685,252 @@ def test_get_create_update_or_delete(session, application):
     r = client.delete('/api/cameras/2')
     assert r.status_code == 200
     assert not r.json['Active']
+
+
+def test_get_collection_etag(session, application):
+    session.add(Camera(Name='foo'))
+    session.commit()
+    with application.test_request_context('/api/cameras'):
+        etag = api.get_collection_etag(Camera)
+    with application.test_request_context('/api/cameras?Name=bar'):
+        assert api.get_collection_etag(Camera).startswith('0-0-')
+    # The query string and the format change the body so they change the tag
+    with application.test_request_context('/api/cameras?fields=ID'):
+        assert api.get_collection_etag(Camera) != etag
+    with application.test_request_context('/api/cameras'):
+        assert api.get_collection_etag(
+            Camera,
+            'application/x-ndjson',
+        ) != etag
+    with application.test_request_context('/api/cameras?Name=foo&ID=1'):
+        variant = api.get_collection_etag(Camera)
+    with application.test_request_context('/api/cameras?ID=1&Name=foo'):
+        assert api.get_collection_etag(Camera) == variant
+
+    session.add(Camera(Name='bar'))
+    session.commit()
+    with application.test_request_context('/api/cameras'):
+        etag2 = api.get_collection_etag(Camera)
+    assert etag2 != etag
+    assert etag2.startswith('2-')
+
+    camera = Camera.query.first()
+    camera.Name = 'baz'
+    session.commit()
+    with application.test_request_context('/api/cameras'):
+        assert api.get_collection_etag(Camera) != etag2
+
+
+def test_get_collection_etag_embedded(session, application):
+    camera = Camera(Name='foo')
+    product_type = ProductType(Name='EDR')
+    session.add_all([camera, product_type])
+    session.commit()
+    session.add(
+        Image(
+            Name='im1',
+            URL='url',
+            Sol=42,
+            DetatchedLabel=False,
+            CameraID=camera.ID,
+            ProductTypeID=product_type.ID,
+        )
+    )
+    session.commit()
+    with application.test_request_context('/api/images'):
+        etag = api.get_collection_etag(Image)
+    camera = Camera.query.first()
+    camera.Name = 'bar'
+    session.commit()
+    with application.test_request_context('/api/images'):
+        assert api.get_collection_etag(Image) != etag
+
+
+def test_get_not_modified(session, application):
+    client = application.test_client()
+    client.post('/api/cameras', json={'Name': 'foo'})
+
+    r = client.get('/api/cameras')
+    assert r.status_code == 200
+    etag = r.headers['ETag']
+    assert etag.startswith('W/"1-')
+
+    r = client.get('/api/cameras', headers={'If-None-Match': etag})
+    assert r.status_code == 304
+    assert r.headers['ETag'] == etag
+    assert r.headers['Vary'] == 'Accept'
+    assert not r.data
+
+    r = client.get('/api/cameras/1', headers={'If-None-Match': etag})
+    assert r.status_code == 200
+    assert 'ETag' not in r.headers
+
+    client.put('/api/cameras/1', json={'Name': 'bar'})
+    r = client.get('/api/cameras', headers={'If-None-Match': etag})
+    assert r.status_code == 200
+    assert r.headers['ETag'] != etag
+    assert r.json[0]['Name'] == 'bar'
+
+
+def test_get_stats(session, application, statements, mocker):
+    mocker.patch.dict(api.STATS_CACHE, clear=True)
+    _add_images(session, [3, 1, 2, 1, 3, 3])
+    url = '/api/images/stats?group_by=Sol'
+    with application.test_request_context(url):
+        etag = api.get_collection_etag(Image)
+        del statements[:]
+        stats = api.get_stats(Image, etag)
+    assert stats == [
+        {'Sol': 1, 'count': 2},
+        {'Sol': 2, 'count': 1},
+        {'Sol': 3, 'count': 3},
+    ]
+    assert len(statements) == 1
+    assert 'GROUP BY' in statements[0]
+
+    # Cached until the collection changes
+    with application.test_request_context(url):
+        del statements[:]
+        assert api.get_stats(Image, etag) == stats
+        assert not statements
+
+    url = '/api/images/stats?group_by=Sol,CameraID&Sol__gte=2'
+    with application.test_request_context(url):
+        stats = api.get_stats(Image, api.get_collection_etag(Image))
+    assert stats == [
+        {'Sol': 2, 'CameraID': 1, 'count': 1},
+        {'Sol': 3, 'CameraID': 1, 'count': 3},
+    ]
+
+    with application.test_request_context('/api/images/stats'):
+        stats = api.get_stats(Image, api.get_collection_etag(Image))
+    assert stats == [{'count': 6}]
+
+    with application.test_request_context('/api/images/stats?group_by=Foo'):
+        with pytest.raises(BadRequest):
+            api.get_stats(Image, etag)
+
+
+def test_cache_stats(mocker):
+    mocker.patch.dict(api.STATS_CACHE, clear=True)
+    mocker.patch.object(api, 'STATS_CACHE_SIZE', 2)
+    api.cache_stats(('a',), [])
+    api.cache_stats(('b',), [])
+    api.cache_stats(('c',), [{'count': 1}])
+    assert list(api.STATS_CACHE) == [('b',), ('c',)]
+    assert api.get_cached_stats(('c',)) == [{'count': 1}]
+    assert api.get_cached_stats(('a',)) is None
+
+
+def test_cache_stats_threads(mocker):
+    mocker.patch.dict(api.STATS_CACHE, clear=True)
+    mocker.patch.object(api, 'STATS_CACHE_SIZE', 2)
+
+    def fill(n):
+        for m in range(200):
+            api.cache_stats((n, m), [])
+            api.get_cached_stats((n, m))
+
+    with ThreadPoolExecutor(8) as executor:
+        # Evicting while another thread adds must not fail
+        list(executor.map(fill, range(8)))
+    assert len(api.STATS_CACHE) == 2
+
+
+def test_get_resource_stats(session, application, mocker):
+    mocker.patch.dict(api.STATS_CACHE, clear=True)
+    _add_images(session, [1, 1, 2])
+    client = application.test_client()
+
+    r = client.get('/api/images/stats?group_by=Sol')
+    assert r.status_code == 200
+    assert r.json == [{'Sol': 1, 'count': 2}, {'Sol': 2, 'count': 1}]
+    etag = r.headers['ETag']
+
+    r = client.get(
+        '/api/images/stats?group_by=Sol',
+        headers={'If-None-Match': etag},
+    )
+    assert r.status_code == 304
+
+    client.post(
+        '/api/images',
+        json={
+            'Name': 'im4',
+            'URL': 'url',
+            'Sol': 2,
+            'DetatchedLabel': False,
+            'CameraID': 1,
+            'ProductTypeID': 1,
+        },
+    )
+    r = client.get(
+        '/api/images/stats?group_by=Sol',
+        headers={'If-None-Match': etag},
+    )
+    assert r.status_code == 200
+    assert r.json == [{'Sol': 1, 'count': 2}, {'Sol': 2, 'count': 2}]
+
+    r = client.get('/api/foo/stats')
+    assert r.status_code == 404
+
+
+def test_encode_items(mocker):
+    mocker.patch('app.api.STREAM_BATCH', 2)
+    items = [{'ID': n} for n in range(5)]
+    chunks = list(api._encode_items(iter(items), ndjson=False))
+    assert len(chunks) == 4
+    assert json.loads(''.join(chunks)) == items
+    chunks = list(api._encode_items(iter(items), ndjson=True))
+    assert len(chunks) == 3
+    lines = ''.join(chunks).splitlines()
+    assert [json.loads(line) for line in lines] == items
+    assert ''.join(api._encode_items([], ndjson=False)) == '[]'
+    assert ''.join(api._encode_items([], ndjson=True)) == ''
+
+
+def test_dumps(mocker):
+    mocker.patch('app.api.orjson', None)
+    assert api.dumps({'a': [1, 'b']}) == '{"a":[1,"b"]}'
+
+
+def test_stream_collection(session, application, mocker):
+    mocker.patch('app.api.STREAM_BATCH', 2)
+    client = application.test_client()
+    for name in ['foo', 'bar', 'baz']:
+        client.post('/api/cameras', json={'Name': name})
+
+    r = client.get('/api/cameras?order_by=-ID', buffered=False)
+    assert r.is_streamed
+    assert r.mimetype == 'application/json'
+    assert [camera['Name'] for camera in r.json] == ['baz', 'bar', 'foo']
+
+    headers = {'Accept': 'application/x-ndjson'}
+    r = client.get('/api/cameras', headers=headers)
+    assert r.mimetype == 'application/x-ndjson'
+    assert r.headers['Vary'] == 'Accept'
+    lines = r.get_data(as_text=True).splitlines()
+    cameras = [json.loads(line) for line in lines]
+    assert [camera['Name'] for camera in cameras] == ['foo', 'bar', 'baz']
+
+    # Pages are not streamed from the database but use the same format
+    r = client.get('/api/cameras?limit=2', headers=headers)
+    assert len(r.get_data(as_text=True).splitlines()) == 2
+    assert 'Link' in r.headers
+
+
+def test_get_next_link(session, application):
+    client = application.test_client()
+    for name in ['foo', 'bar', 'baz']:
+        client.post('/api/cameras', json={'Name': name})
+
+    r = client.get('/api/cameras?limit=2&order_by=-ID')
+    assert [camera['Name'] for camera in r.json] == ['baz', 'bar']
+    url, rel = r.headers['Link'].split('; ')
+    assert rel == 'rel="next"'
+    r = client.get(url.strip('<>'))
+    assert [camera['Name'] for camera in r.json] == ['foo']
+    assert 'Link' not in r.headers
+
+    r = client.get('/api/cameras?order_by=foo')
+    assert r.status_code == 400
@@ -1,3 +1,5 @@
+from datetime import datetime
+
 import pytest
 from sqlalchemy.exc import IntegrityError
 
@@ -117,6 +119,18 @@ class TestImage:
         assert im_dict['camera']['Name'] == 'foo'
         assert not im_dict['DetatchedLabel']
 
+    def test_to_partial_dict(self, image_session):
+        image_session.add(self.image)
+        image_session.commit()
+        im = Image.query.filter().first()
+        assert im.to_partial_dict(['ID', 'Sol']) == {'ID': 1, 'Sol': 42}
+        im_dict = im.to_partial_dict(['Name'], expand=['camera'])
+        assert im_dict == {'Name': 'foobar', 'camera': im.camera.to_dict()}
+        # Every column without relationships by default
+        im_dict = im.to_partial_dict()
+        assert set(im_dict) == set(im.to_dict()) - {'camera', 'product_type'}
+        assert im_dict['Created'] == im.Created.isoformat()
+
     def test_from_dict(self):
         im = Image.from_dict(
             {
@@ -155,6 +169,29 @@ class TestImage:
         assert self.image.ProductTypeID == 3
         assert not self.image.DetatchedLabel
 
+    def test_label_columns(self, image_session):
+        self.image.update_from_dict(
+            {
+                'StartTime': '2004-01-26T03:17:43.880000',
+                'ExposureDuration': '149.76',
+                'Lines': 1024,
+                'FilterName': None,
+            }
+        )
+        assert self.image.StartTime == datetime(2004, 1, 26, 3, 17, 43, 880000)
+        assert self.image.ExposureDuration == 149.76
+        assert self.image.Lines == 1024
+        assert self.image.FilterName is None
+        image_session.add(self.image)
+        image_session.commit()
+        im_dict = Image.query.first().to_dict()
+        assert im_dict['StartTime'] == '2004-01-26T03:17:43.880000'
+        assert im_dict['ExposureDuration'] == 149.76
+        assert im_dict['SampleType'] is None
+        im = Image.from_dict(dict(im_dict, Name='copy'))
+        assert im.StartTime == self.image.StartTime
+        assert im.Lines == 1024
+
     def test_delete(self, image_session):
         image_session.add(self.image)
         image_session.commit()
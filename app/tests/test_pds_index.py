@@ -0,0 +1,250 @@
+import pytest
+
+from app import pds_index
+from app.models import Image, Camera, ProductType, IndexIngest
+
+LABEL = '''PDS_VERSION_ID = PDS3
+RECORD_TYPE = FIXED_LENGTH
+RECORD_BYTES = 76
+^INDEX_TABLE = "INDEX.TAB"
+OBJECT = INDEX_TABLE
+  INTERCHANGE_FORMAT = ASCII
+  ROWS = {rows}
+  ROW_BYTES = 76
+  COLUMNS = 3
+  OBJECT = COLUMN
+    NAME = FILE_SPECIFICATION_NAME
+    DATA_TYPE = CHARACTER
+    START_BYTE = 2
+    BYTES = 48
+  END_OBJECT = COLUMN
+  OBJECT = COLUMN
+    NAME = PLANET_DAY_NUMBER
+    DATA_TYPE = ASCII_INTEGER
+    START_BYTE = 52
+    BYTES = 4
+  END_OBJECT = COLUMN
+  OBJECT = COLUMN
+    NAME = INSTRUMENT_ID
+    DATA_TYPE = CHARACTER
+    START_BYTE = 58
+    BYTES = 16
+  END_OBJECT = COLUMN
+END_OBJECT = INDEX_TABLE
+END
+'''
+
+ROWS = [
+    ('DATA/SOL0001/1P128287538EFF0000P2303L2M1.IMG', 1, 'PANCAM_LEFT'),
+    ('DATA/SOL0001/1N128287600EFF0000P1900R0M1.IMG', 1, 'NAVCAM_RIGHT'),
+    ('DATA/SOL0002/1P128376000EFF0100P2303L2M1.LBL', 2, 'PANCAM_LEFT'),
+    ('DATA/SOL0002/1X128376100EFF0100P2303L2M1.IMG', 2, 'UNKNOWN_CAMERA'),
+    ('DATA/SOL0003/1M128465000EFF0200P2936M2M1.IMG', 3, 'MI'),
+]
+
+BASE_URL = 'https://pds/mer1po_0xxx/'
+
+
+def _row(path, sol, instrument):
+    return f'"{path:<48}",{sol:>4},"{instrument:<16}"\r\n'
+
+
+@pytest.fixture
+def index_files(tmpdir):
+    label = tmpdir.join('INDEX.LBL')
+    label.write(LABEL.format(rows=len(ROWS)))
+    table = tmpdir.join('INDEX.TAB')
+    table.write_binary(''.join(_row(*row) for row in ROWS).encode())
+    return str(label), str(table)
+
+
+@pytest.fixture
+def job(session, index_files):
+    label, table = index_files
+    job = IndexIngest.from_dict({
+        'Table': table,
+        'Label': label,
+        'BaseURL': BASE_URL,
+        'ProductType': 'EDR',
+    })
+    session.add(job)
+    session.commit()
+    return job
+
+
+def test_map_row(index_files):
+    label, table = index_files
+    columns = pds_index.get_columns(
+        pds_index.get_table(pds_index.read_label(label))
+    )
+    assert columns['PLANET_DAY_NUMBER'] == pds_index.IndexColumn(
+        'PLANET_DAY_NUMBER',
+        51,
+        4,
+    )
+    rows = list(pds_index.read_lines(table))
+    assert len(rows) == len(ROWS)
+    mapping = pds_index.IndexMapping()
+    assert pds_index.map_row(rows[0], columns, mapping, BASE_URL) == {
+        'Name': '1p128287538eff0000p2303l2m1.img',
+        'URL': (
+            'https://pds/mer1po_0xxx/data/sol0001/'
+            '1p128287538eff0000p2303l2m1.img'
+        ),
+        'Sol': 1,
+        'DetatchedLabel': False,
+        'camera': 'PANCAM',
+    }
+    image = pds_index.map_row(rows[2], columns, mapping, BASE_URL)
+    assert image['Name'] == '1p128376000eff0100p2303l2m1.img'
+    assert image['DetatchedLabel']
+    with pytest.raises(ValueError):
+        pds_index.map_row(rows[3], columns, mapping, BASE_URL)
+
+
+def test_camera_name():
+    assert pds_index.camera_name('PANCAM_RIGHT') == 'PANCAM'
+    assert pds_index.camera_name('FRONT_HAZCAM_LEFT') == 'FHAZ'
+    assert pds_index.camera_name('MI') == 'MI'
+    with pytest.raises(ValueError):
+        pds_index.camera_name('DESCENT_CAMERA')
+
+
+def test_ingest(job, mocker):
+    mocker.patch.object(pds_index, 'BATCH_SIZE', 2)
+    progress = mocker.Mock()
+    ID = job.ID
+    pds_index.ingest(job, progress=progress)
+
+    job = IndexIngest.query.get(ID)
+    assert job.Status == 'finished'
+    assert job.Rows == 5
+    assert job.Done == 5
+    assert job.Skipped == 1
+    assert progress.call_count == 3
+    assert Image.query.count() == 4
+    assert sorted(c.Name for c in Camera.query) == ['MI', 'NAVCAM', 'PANCAM']
+    assert [p.Name for p in ProductType.query] == ['EDR']
+    image = Image.query.filter_by(Sol=3).one()
+    assert image.camera.Name == 'MI'
+    assert image.product_type.Name == 'EDR'
+
+
+def test_ingest_resume(job, mocker):
+    mocker.patch.object(pds_index, 'BATCH_SIZE', 2)
+    ID = job.ID
+    job.Done = 4
+    pds_index.ingest(job)
+    assert [im.Sol for im in Image.query] == [3]
+    assert IndexIngest.query.get(ID).Done == 5
+
+    # Ingesting again updates the images instead of adding them
+    job = IndexIngest.query.get(ID)
+    job.Done = 0
+    job.BaseURL = 'https://mirror/'
+    pds_index.ingest(job)
+    assert Image.query.count() == 4
+    image = Image.query.filter_by(Sol=3).one()
+    assert image.URL.startswith('https://mirror/data/')
+
+
+def test_ingest_resume_blank_lines(job, mocker):
+    mocker.patch.object(pds_index, 'BATCH_SIZE', 2)
+    ID = job.ID
+    lines = [_row(*row) for row in ROWS]
+    lines[1:1] = ['\r\n', '   \r\n']
+    with open(job.Table, 'w', newline='') as stream:
+        stream.write(''.join(lines))
+    job.Done = 4
+    pds_index.ingest(job)
+    # Blank lines do not move the rows a resumed ingest starts from
+    job = IndexIngest.query.get(ID)
+    assert [im.Sol for im in Image.query] == [3]
+    assert (job.Done, job.Skipped) == (5, 0)
+
+
+def test_ingest_failed(job):
+    ID = job.ID
+    job.Label = 'missing.lbl'
+    pds_index.ingest(job)
+    job = IndexIngest.query.get(ID)
+    assert job.Status == 'failed'
+    assert 'missing.lbl' in job.Error
+    assert Image.query.count() == 0
+
+    job.Label = pds_index.__file__
+    pds_index.ingest(job)
+    assert IndexIngest.query.get(ID).Status == 'failed'
+
+
+def test_main(session, index_files, mocker):
+    label, table = index_files
+    args = [label, table, BASE_URL, 'EDR']
+    ingest = mocker.spy(pds_index, 'ingest')
+    assert pds_index.main(args) == 0
+    assert Image.query.count() == 4
+    assert IndexIngest.query.one().Status == 'finished'
+
+    # Unfinished ingests of the table are resumed
+    job = IndexIngest.query.one()
+    job.Status = 'failed'
+    job.Done = 3
+    session.commit()
+    assert pds_index.main(args) == 0
+    assert IndexIngest.query.count() == 1
+    assert ingest.call_args[0][0].ID == job.ID
+
+    assert pds_index.main(args + ['--restart']) == 0
+    assert IndexIngest.query.count() == 2
+
+    assert pds_index.main(['missing.lbl', table, BASE_URL, 'EDR']) == 1
+
+
+def test_ingest_routes(session, application, index_files, mocker):
+    label, table = index_files
+    start_ingest = mocker.patch.object(pds_index, 'start_ingest')
+    client = application.test_client()
+    r = client.post(
+        '/api/ingest/index',
+        json={
+            'Table': table,
+            'Label': label,
+            'BaseURL': BASE_URL,
+            'ProductType': 'EDR',
+        },
+    )
+    assert r.status_code == 202
+    assert r.json['Status'] == 'pending'
+    assert r.json['Done'] == 0
+    assert start_ingest.call_count == 1
+
+    r = client.post('/api/ingest/index', json={'Table': table})
+    assert r.status_code == 400
+
+    pds_index.ingest(IndexIngest.query.get(1))
+    r = client.get('/api/ingest/index/1')
+    assert r.status_code == 200
+    assert r.json['Status'] == 'finished'
+    assert r.json['Done'] == 5
+
+    r = client.put('/api/ingest/index/1')
+    assert r.status_code == 400
+    assert start_ingest.call_count == 1
+
+    job = IndexIngest.query.get(1)
+    job.Status = 'failed'
+    job.Error = 'ValueError: bad row'
+    session.commit()
+    r = client.put('/api/ingest/index/1')
+    assert r.status_code == 202
+    assert r.json['Status'] == 'pending'
+    assert r.json['Error'] is None
+    assert start_ingest.call_count == 2
+
+    # Pending ingests are already starting so they are not started twice
+    r = client.put('/api/ingest/index/1')
+    assert r.status_code == 400
+    assert start_ingest.call_count == 2
+
+    r = client.get('/api/ingest/index/2')
+    assert r.status_code == 404
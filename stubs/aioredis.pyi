@@ -1,16 +1,44 @@
-from typing import AnyStr, List, Tuple
+from typing import Any, AnyStr, Dict, List, Optional, Tuple
+
+
+class ChannelClosedError(Exception): ...
 
 
 class Redis:
+    SET_IF_NOT_EXIST: str
+
     async def hexists(self, key: AnyStr, field: AnyStr) -> bool: ...
     async def hkeys(self, key: AnyStr) -> List[bytes]: ...
     async def hget(self, key: AnyStr, field: AnyStr) -> bytes: ...
+    async def hmget(self, key: AnyStr, field: AnyStr, *fields: AnyStr) -> List[Optional[bytes]]: ...
+    async def hmset_dict(self, key: AnyStr, *args: Dict[AnyStr, Any], **kwargs: Any) -> bool: ...
     async def hset(self, key: AnyStr, field: AnyStr, value: AnyStr) -> int: ...
-    async def hdel(self, key: AnyStr, field: AnyStr) -> int: ...
+    async def hdel(self, key: AnyStr, field: AnyStr, *fields: AnyStr) -> int: ...
+    async def hincrby(self, key: AnyStr, field: AnyStr, increment: int=1) -> int: ...
+    async def hgetall(self, key: AnyStr, *, encoding: Any=None) -> Dict[Any, Any]: ...
     async def delete(self, key: AnyStr) -> int: ...
     async def get(self, key: AnyStr) -> bytes: ...
-    async def set(self, key: AnyStr, value: AnyStr, expire: int=0, pexpire: int=0, exists: bool=None): ...
+    async def set(self, key: AnyStr, value: AnyStr, expire: int=0, pexpire: int=0, exist: str=None) -> bool: ...
+    async def eval(self, script: str, keys: List[AnyStr]=[], args: List[Any]=[]) -> Any: ...
     async def exists(self, key: AnyStr) -> bool: ...
+    async def expire(self, key: AnyStr, timeout: int) -> bool: ...
+    async def rpush(self, key: AnyStr, value: AnyStr, *values: AnyStr) -> int: ...
+    async def lpush(self, key: AnyStr, value: AnyStr, *values: AnyStr) -> int: ...
+    async def lrem(self, key: AnyStr, count: int, value: AnyStr) -> int: ...
+    async def blpop(self, key: AnyStr, *keys: AnyStr, timeout: int=0, encoding: Any=None) -> Optional[List[bytes]]: ...
+    async def sadd(self, key: AnyStr, member: AnyStr, *members: AnyStr) -> int: ...
+    async def srem(self, key: AnyStr, member: AnyStr, *members: AnyStr) -> int: ...
+    async def smembers(self, key: AnyStr, *, encoding: Any=None) -> List[Any]: ...
+    async def flushall(self) -> bool: ...
+    async def publish(self, channel: AnyStr, message: Any) -> int: ...
+    async def subscribe(self, channel: Any, *channels: Any) -> List[Any]: ...
+    async def unsubscribe(self, channel: Any, *channels: Any) -> None: ...
+    @property
+    def address(self) -> Tuple[str, int]: ...
+    @property
+    def closed(self) -> bool: ...
+    def close(self) -> None: ...
+    async def wait_closed(self) -> None: ...
 
 
 async def create_redis(
@@ -25,3 +53,20 @@ async def create_redis(
     timeout=None,
     connection_cls=None,
     loop=None) -> Redis: ...
+
+
+async def create_redis_pool(
+    address: Tuple[str, int],
+    *,
+    db=None,
+    password=None,
+    ssl=None,
+    encoding=None,
+    commands_factory=Redis,
+    minsize: int=1,
+    maxsize: int=10,
+    parser=None,
+    timeout=None,
+    pool_cls=None,
+    connection_cls=None,
+    loop=None) -> Redis: ...
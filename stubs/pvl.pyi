@@ -1,6 +1,8 @@
 from io import BufferedReader
 
-from typing import Union, MutableMapping, Any, Generator, Tuple, NamedTuple
+from typing import (
+    Union, MutableMapping, Any, Generator, Tuple, NamedTuple, List,
+)
 
 
 class OrderedMultiDict(dict, MutableMapping):
@@ -9,6 +11,7 @@ class OrderedMultiDict(dict, MutableMapping):
     def __setitem__(self, key: Any, value: Any) -> None: ...
     def __iter__(self) -> Generator[Tuple[Any, Any], None, None]: ...
     def __len__(self) -> int: ...
+    def getlist(self, key: Any) -> List[Any]: ...
     def copy(self) -> 'OrderedMultiDict': ...
 
 
@@ -19,6 +22,16 @@ class PVLModule(OrderedMultiDict):
     def copy(self) -> 'PVLModule': ...
 
 
+class PVLGroup(OrderedMultiDict):
+
+    def copy(self) -> 'PVLGroup': ...
+
+
+class PVLObject(OrderedMultiDict):
+
+    def copy(self) -> 'PVLObject': ...
+
+
 class PVLDecoder:
 
     def set_strict(self) -> None: ...
@@ -1,11 +1,14 @@
 import copy
+import json
+import asyncio
 from time import sleep
 
 import pytest
 import aiohttp
 
-from web import app
-from web.redis_cache import ImageCache
+from web import app, ingest, metrics, backends
+from web.redis_cache import ImageCache, ProgressCache
+from web.singleflight import Lease
 app.app.config['TESTING'] = True
 
 PRODUCT_TYPES = [
@@ -13,8 +16,8 @@ PRODUCT_TYPES = [
     {'ID': 2, 'Name': 'RDR'}
 ]
 IMAGES = [
-    {'ID': 1, 'Name': 'im1'},
-    {'ID': 2, 'Name': 'im2'},
+    {'ID': 1, 'Name': 'im1', 'Active': True, 'Updated': '2019-03-01T10:00:00'},
+    {'ID': 2, 'Name': 'im2', 'Active': True, 'Updated': '2019-03-02T10:00:00'},
 ]
 CAMERAS = [
     {'ID': 1, 'Name': 'pancam'},
@@ -31,13 +34,40 @@ async def get_cameras(request):
 
 
 async def get_images(request):
-    return aiohttp.web.json_response(IMAGES)
+    # The images changed since a time, like the change feed of the API
+    images = IMAGES
+    if 'since' in request.query:
+        since = request.query['since']
+        images = [im for im in images if im['Updated'] > since]
+    return aiohttp.web.json_response(images)
 
 
 async def get_product_types(request):
     return aiohttp.web.json_response(PRODUCT_TYPES)
 
 
+async def post_bulk(request):
+    data = await request.json()
+    errors = [
+        {'index': index, 'error': 'negative sol'}
+        for index, item in enumerate(data) if item['Sol'] < 0
+    ]
+    if errors:
+        return aiohttp.web.json_response(
+            {'created': 0, 'errors': errors},
+            status=400,
+        )
+    return aiohttp.web.json_response(
+        {'created': len(data), 'errors': []},
+        status=201,
+    )
+
+
+async def put_bulk(request):
+    request.app['updates'].append((dict(request.query), await request.json()))
+    return aiohttp.web.json_response({'updated': 1})
+
+
 async def post_resource(request):
     try:
         data = await request.json()
@@ -56,6 +86,9 @@ async def cli(mocker, loop, aiohttp_client):
     ioapp.router.add_post('/api/cameras', post_resource)
     ioapp.router.add_post('/api/product_types', post_resource)
     ioapp.router.add_post('/api/images', post_resource)
+    ioapp.router.add_post('/api/images/bulk', post_bulk)
+    ioapp.router.add_put('/api/images/bulk', put_bulk)
+    ioapp['updates'] = []
     client = await aiohttp_client(ioapp, raise_for_status=True)
     mocker.patch('web.app.app.session', client)
     mocker.patch('web.app.API_URL', '/api')
@@ -82,6 +115,14 @@ async def client():
     return app.app.test_client()
 
 
+@pytest.fixture(autouse=True)
+def reference_caches():
+    for name in ['cameras', 'product_types']:
+        app.reference_caches[name].invalidate()
+    app.api_responses.clear()
+    app.catalog.clear()
+
+
 async def test_index(mocker, client, cli):
     render_template = mocker.patch('web.app.render_template', autospec=True)
 
@@ -135,6 +176,17 @@ async def test_get_cameras(client, cli):
     assert await resp.get_json() == {'data': CAMERAS}
 
 
+async def test_get_cameras_cached(client, cli, mocker):
+    mock_get = mocker.spy(cli, 'get')
+    for _ in range(3):
+        resp = await client.get('/services/cameras')
+        assert await resp.get_json() == {'data': CAMERAS}
+    assert mock_get.call_count == 1
+    await client.post('/services/cameras', json={'name': 'image'})
+    await client.get('/services/cameras')
+    assert mock_get.call_count == 2
+
+
 async def test_get_cameras_error(client, error_cli):
     resp = await client.get('/services/cameras')
     assert resp.status_code == 404
@@ -163,18 +215,130 @@ async def test_register_image(client, cli):
     assert await resp.get_json() == {'data': expected}
 
 
+async def test_register_images(client, cli, mocker):
+    mock_post = mocker.spy(cli, 'post')
+    data = [
+        {
+            'url': f'path/image{sol}.img',
+            'sol': sol,
+            'detatched': False,
+            'productType': 1,
+            'camera': 2,
+        }
+        for sol in [41, 42]
+    ]
+    resp = await client.post('/services/images/batch', json=data)
+    assert resp.status_code == 201
+    assert await resp.get_json() == {'data': {'created': 2, 'errors': []}}
+    assert mock_post.call_count == 1
+    new_images = mock_post.call_args[1]['json']
+    assert [image['Name'] for image in new_images] == [
+        'image41.img',
+        'image42.img',
+    ]
+
+    # Errors of the api
+    data[1]['sol'] = -1
+    resp = await client.post('/services/images/batch', json=data)
+    assert resp.status_code == 400
+    assert await resp.get_json() == {
+        'data': {
+            'created': 0,
+            'errors': [{'index': 1, 'error': 'negative sol'}],
+        }
+    }
+
+    # Errors of the request
+    del data[0]['sol']
+    resp = await client.post('/services/images/batch', json=data)
+    assert resp.status_code == 400
+    errors = (await resp.get_json())['data']['errors']
+    assert [error['index'] for error in errors] == [0]
+    assert mock_post.call_count == 2
+
+
 async def test_get_images(client, cli, mocker, rcache):
     mock_get = mocker.spy(cli, 'get')
     resp = await client.get('/services/images')
     mock_get.assert_called_once_with(
         '/api/images',
-        params={'Active': 'true'}
+        params={'fields': 'ID,Name,URL,Sol,Active,Updated'},
     )
     assert resp.status_code == 200
     c1, c2 = copy.deepcopy(IMAGES)
     c1['cached'] = False
     c2['cached'] = False
-    assert await resp.get_json() == {'data': [c2, c1]}
+    assert await resp.get_json() == {'data': [c2, c1], 'next': None}
+
+    # Only the changes are asked for once the catalog is synced
+    resp = await client.get('/services/images')
+    assert mock_get.call_args == mocker.call(
+        '/api/images',
+        params={
+            'fields': 'ID,Name,URL,Sol,Active,Updated',
+            'since': '2019-03-02T09:59:55',
+        },
+    )
+    assert await resp.get_json() == {'data': [c2, c1], 'next': None}
+
+
+async def test_get_images_changes(client, cli, mocker, rcache):
+    images = copy.deepcopy(IMAGES)
+    changes = [
+        [images[0], images[1]],
+        [
+            dict(images[0], Active=False, Updated='2019-03-03T10:00:00'),
+            {
+                'ID': 3,
+                'Name': 'im3',
+                'Active': True,
+                'Updated': '2019-03-03T10:00:01',
+            },
+        ],
+    ]
+
+    async def fetch(params):
+        return changes.pop(0)
+
+    mocker.patch.object(app.catalog, '_fetch', fetch)
+    resp = await client.get('/services/images')
+    data = (await resp.get_json())['data']
+    assert [im['ID'] for im in data] == [2, 1]
+    resp = await client.get('/services/images')
+    data = (await resp.get_json())['data']
+    assert [im['ID'] for im in data] == [3, 2]
+
+
+async def test_get_images_by_name(client, cli, rcache):
+    resp = await client.get('/services/images?name=im2')
+    data = (await resp.get_json())['data']
+    assert [im['Name'] for im in data] == ['im2']
+
+
+async def test_get_images_pages(client, cli, rcache, mocker):
+    c1, c2 = copy.deepcopy(IMAGES)
+    c1['cached'] = False
+    c2['cached'] = False
+    resp = await client.get('/services/images?limit=1')
+    assert await resp.get_json() == {'data': [c2], 'next': '2'}
+    resp = await client.get('/services/images?limit=1&cursor=2')
+    assert await resp.get_json() == {'data': [c1], 'next': None}
+    for limit in [0, -1]:
+        resp = await client.get(f'/services/images?limit={limit}')
+        assert resp.status_code == 400
+    # Limits over the maximum get the largest page
+    mocker.patch.dict(app.app.config, {'IMAGES_PAGE_MAX': 1})
+    resp = await client.get('/services/images?limit=5')
+    assert await resp.get_json() == {'data': [c2], 'next': '2'}
+
+
+async def test_get_images_error(client, error_cli, rcache):
+    resp = await client.get('/services/images')
+    assert resp.status_code == 404
+    assert await resp.get_json() == {'data': [], 'next': None}
+
+    resp = await client.get('/services/images?cursor=two')
+    assert resp.status_code == 400
 
 
 async def test_display_image(client, rcache, image, mocker, cli):
@@ -190,3 +354,214 @@ async def test_display_image(client, rcache, image, mocker, cli):
     assert r.headers['Content-Type'] == 'image/png'
     assert (await image.get_png_output()).getvalue() == await r.get_data()
     assert time_stamp != await image_cache.get_time('image.img')
+
+
+async def test_cache_image(client, rcache, image, mocker):
+    workers = ingest.IngestWorkers(ingest.LocalJobQueue(), None)
+    mocker.patch('web.app.app.ingest', workers)
+    data = {'url': 'http://pds/image.img', 'name': 'image.img'}
+    resp = await client.post('/services/cache_image', json=data)
+    assert resp.status_code == 202
+    assert await resp.get_json() == {
+        'data': {'job': 'image.img', 'status': 'queued'}
+    }
+    job = await workers.queue.get()
+    assert job.ID == 'image.img'
+    assert job.name == 'image.img'
+    assert job.url == data['url']
+    assert job.lease is not None
+
+    # The image is leased to the first job so no other job is queued
+    resp = await client.post('/services/cache_image', json=data)
+    assert resp.status_code == 202
+    assert await resp.get_json() == {
+        'data': {'job': 'image.img', 'status': 'in_progress'}
+    }
+    assert workers.queue._queue.empty()
+
+    resp = await client.post(
+        '/services/cache_image',
+        json=dict(data, priority='now'),
+    )
+    assert resp.status_code == 400
+
+    await ImageCache(rcache).set('image.img', image)
+    resp = await client.post('/services/cache_image', json=data)
+    assert resp.status_code == 200
+    assert await resp.get_json() == {'data': 'finished'}
+
+
+async def test_ingest_image(rcache, image, mocker, cli):
+
+    async def from_url(*args, **kwargs):
+        await asyncio.sleep(0.01)
+        return image
+    from_url = mocker.patch(
+        'web.app.PDSImage.from_url',
+        side_effect=from_url,
+    )
+    lease = Lease(rcache, 'image.img')
+    assert await lease.acquire()
+    job = ingest.IngestJob(
+        ID='image.img',
+        url='http://pds/image.img',
+        name='image.img',
+        lease=lease.token,
+    )
+    # Concurrent fills of the same image share a single download
+    await asyncio.gather(app.ingest_image(job), app.ingest_image(job))
+    from_url.assert_called_once()
+    image_cache = ImageCache(rcache)
+    assert await image_cache.exists('image.img')
+    assert await Lease(rcache, 'image.img').acquire()
+    # The values of the label are stored with the image in the API
+    assert cli.server.app['updates'] == [
+        ({'Name': 'image.img'}, await image.metadata),
+    ]
+
+    # Cached images are not downloaded again
+    await app.ingest_image(job._replace(lease=None))
+    from_url.assert_called_once()
+
+
+async def test_ingest_image_metadata_error(rcache, image, mocker,
+                                           error_cli):
+
+    async def from_url(*args, **kwargs):
+        return image
+    mocker.patch('web.app.PDSImage.from_url', side_effect=from_url)
+    job = ingest.IngestJob(
+        ID='image.img',
+        url='http://pds/image.img',
+        name='image.img',
+    )
+    # The image stays cached when the API fails to store its label values
+    await app.ingest_image(job)
+    assert await ImageCache(rcache).exists('image.img')
+
+
+async def test_ingest_image_failed(rcache, mocker, cli):
+
+    async def from_url(*args, **kwargs):
+        raise aiohttp.ClientError('connection reset')
+    mocker.patch('web.app.PDSImage.from_url', side_effect=from_url)
+    job = ingest.IngestJob(
+        ID='image.img',
+        url='http://pds/image.img',
+        name='image.img',
+    )
+    with pytest.raises(aiohttp.ClientError):
+        await app.ingest_image(job)
+    record = await ProgressCache(rcache).get_record('image.img')
+    assert record.failed
+    assert not record.finished
+    assert not await ImageCache(rcache).exists('image.img')
+
+
+async def test_ingest_image_cancelled(rcache, mocker, cli):
+    started = asyncio.Event()
+
+    async def from_url(*args, **kwargs):
+        started.set()
+        await asyncio.sleep(10)
+    mocker.patch('web.app.PDSImage.from_url', side_effect=from_url)
+    lease = Lease(rcache, 'image.img')
+    assert await lease.acquire()
+    job = ingest.IngestJob(
+        ID='image.img',
+        url='http://pds/image.img',
+        name='image.img',
+        lease=lease.token,
+    )
+    task = asyncio.ensure_future(app.ingest_image(job))
+    await asyncio.wait_for(started.wait(), 1)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    # The job is queued again so it still holds the lease
+    assert not await Lease(rcache, 'image.img').acquire()
+    assert await lease.release()
+
+
+async def test_get_metrics(client):
+    metrics.clear()
+    metrics.CACHE_LOOKUPS.inc(('ImageCache', 'hit'))
+    resp = await client.get('/services/metrics')
+    assert resp.status_code == 200
+    assert resp.headers['Content-Type'] == metrics.CONTENT_TYPE
+    text = (await resp.get_data()).decode()
+    sample = 'opportunity_cache_lookups_total{cache="ImageCache",result="hit"}'
+    assert f'{sample} 1' in text
+
+
+async def test_stream_progress(client, rcache, mocker):
+    mocker.patch('web.app.SSE_KEEPALIVE', 0.01)
+    backend = await app.get_backend()
+    progress_cache = ProgressCache(backend)
+    await progress_cache.start('a', 10)
+    await progress_cache.progress('a', 10)
+    await progress_cache.finish('a')
+
+    async def download():
+        await asyncio.sleep(0.05)
+        await progress_cache.start('b', 10)
+        await progress_cache.progress('b', 5)
+        await progress_cache.progress('b', 5)
+        await progress_cache.finish('b')
+
+    task = asyncio.ensure_future(download())
+    resp = await client.get('/services/progress/stream?id=a&id=b')
+    await task
+    assert resp.status_code == 200
+    assert resp.headers['Content-Type'] == 'text/event-stream'
+    body = (await resp.get_data()).decode()
+    events = []
+    for event in body.split('\n\n'):
+        if event.startswith('event'):
+            name, data = event.split('\n')
+            events.append((name, json.loads(data[len('data: '):])))
+    progress = [
+        (data['ID'], data['progress'], data['received'], data['finished'])
+        for name, data in events if name == 'event: progress'
+    ]
+    assert progress == [
+        ('a', 1.0, 10, True),
+        ('b', 0.0, 0, False),
+        ('b', 0.5, 5, False),
+        ('b', 1.0, 10, False),
+        ('b', 1.0, 10, True),
+    ]
+    assert events[-1] == ('event: done', ['a', 'b'])
+    assert ': keepalive' in body
+    resp = await client.get('/services/progress/stream')
+    assert resp.status_code == 400
+    await backends.close_shared_subscriptions()
+
+
+async def test_stream_progress_failed(client, rcache, mocker):
+    mocker.patch('web.app.SSE_KEEPALIVE', 0.01)
+    progress_cache = ProgressCache(await app.get_backend())
+    await progress_cache.finish('a', failed=True)
+
+    async def download():
+        await asyncio.sleep(0.05)
+        await progress_cache.start('b', 10)
+        await progress_cache.finish('b', failed=True)
+
+    task = asyncio.ensure_future(download())
+    resp = await client.get('/services/progress/stream?id=a&id=b')
+    await task
+    body = (await resp.get_data()).decode()
+    # The stream ends although neither download finished
+    events = [
+        event.split('\n')[0] for event in body.split('\n\n')
+        if event.startswith('event')
+    ]
+    assert events == [
+        'event: progress', 'event: failed',
+        'event: progress',
+        'event: progress', 'event: failed',
+        'event: done',
+    ]
+    assert 'data: {"ID": "b"}' in body
+    await backends.close_shared_subscriptions()
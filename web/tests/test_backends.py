@@ -0,0 +1,312 @@
+import time
+import asyncio
+
+import pytest
+import numpy as np
+
+from web import backends, redis_cache, pdsimage
+
+
+@pytest.fixture(params=['memory', 'filesystem'])
+async def backend(request, tmp_path):
+    if request.param == 'memory':
+        return backends.MemoryBackend()
+    else:
+        return backends.FilesystemBackend(str(tmp_path))
+
+
+@pytest.mark.asyncio
+async def test_hash(backend):
+    assert not await backend.exists('testing')
+    assert not await backend.hexists('testing', 'foo')
+    assert await backend.hget('testing', 'foo') is None
+    await backend.hset('testing', 'foo', 'bar')
+    await backend.hmset_dict('testing', {'foo:baz': b'spam', 'life': 42})
+    assert await backend.exists('testing')
+    assert await backend.hexists('testing', 'foo')
+    assert await backend.hget('testing', 'foo') == b'bar'
+    assert await backend.hmget('testing', 'foo:baz', 'life', 'nope') == [
+        b'spam', b'42', None,
+    ]
+    assert sorted(await backend.hkeys('testing')) == [
+        b'foo', b'foo:baz', b'life',
+    ]
+    await backend.hdel('testing', 'foo', 'life')
+    assert await backend.hkeys('testing') == [b'foo:baz']
+    await backend.delete('testing')
+    assert not await backend.exists('testing')
+    assert await backend.hkeys('testing') == []
+
+
+@pytest.mark.asyncio
+async def test_hincrby(backend):
+    assert await backend.hgetall('testing') == {}
+    await asyncio.gather(
+        *[backend.hincrby('testing', 'count', 2) for _ in range(10)]
+    )
+    assert await backend.hincrby('testing', 'count', -5) == 15
+    await backend.hset('testing', 'foo', 'bar')
+    assert await backend.hgetall('testing') == {
+        b'count': b'15', b'foo': b'bar',
+    }
+
+
+@pytest.mark.asyncio
+async def test_hupdate(backend):
+    assert await backend.hupdate('testing', {'foo': 'bar'}, {'count': 2},
+                                 create=False) is None
+    assert not await backend.exists('testing')
+    assert await backend.hupdate('testing', {'foo': 'bar'}, {'count': 2},
+                                 expire=60) == {
+        b'foo': b'bar', b'count': b'2',
+    }
+    await asyncio.gather(*[
+        backend.hupdate('testing', {}, {'count': 1}, create=False)
+        for _ in range(10)
+    ])
+    assert await backend.hupdate('testing', {'foo': 1}, {}) == {
+        b'foo': b'1', b'count': b'12',
+    }
+
+
+@pytest.mark.asyncio
+async def test_expire(backend, mocker):
+    await backend.hset('testing', 'foo', 'bar')
+    await backend.set('foo', 'spam')
+    await backend.expire('testing', 5)
+    await backend.expire('foo', 5)
+    assert await backend.exists('testing')
+    assert await backend.get('foo') == b'spam'
+    time = mocker.patch('web.backends.time.time')
+    time.return_value = 10 ** 10
+    assert not await backend.exists('testing')
+    assert await backend.hgetall('testing') == {}
+    assert await backend.get('foo') is None
+    # Hashes set again after expiring start empty without expiring
+    await backend.hincrby('testing', 'count')
+    assert await backend.hgetall('testing') == {b'count': b'1'}
+
+
+@pytest.mark.asyncio
+async def test_keys(backend, mocker):
+    assert await backend.get('foo') is None
+    await backend.set('foo', 0.5)
+    await backend.set('bar', 'spam', expire=5)
+    assert await backend.exists('foo')
+    assert await backend.get('foo') == b'0.5'
+    assert await backend.get('bar') == b'spam'
+    time = mocker.patch('web.backends.time.time')
+    time.return_value = 10 ** 10
+    assert await backend.get('foo') == b'0.5'
+    assert await backend.get('bar') is None
+    assert not await backend.exists('bar')
+    await backend.delete('foo')
+    assert not await backend.exists('foo')
+
+
+@pytest.mark.asyncio
+async def test_set_if_not_exists(backend, mocker):
+    assert await backend.set_if_not_exists('foo', 'bar', expire=5)
+    assert not await backend.set_if_not_exists('foo', 'baz')
+    assert await backend.get('foo') == b'bar'
+    assert not await backend.delete_if_equals('foo', 'baz')
+    assert await backend.delete_if_equals('foo', 'bar')
+    assert not await backend.exists('foo')
+    assert await backend.set_if_not_exists('foo', 'baz', expire=5)
+    time = mocker.patch('web.backends.time.time')
+    time.return_value = 10 ** 10
+    assert await backend.set_if_not_exists('foo', 'spam')
+    assert await backend.get('foo') == b'spam'
+
+
+@pytest.mark.asyncio
+async def test_set_if_not_exists_concurrent(backend):
+    tokens = [str(n) for n in range(20)]
+    acquired = await asyncio.gather(
+        *[backend.set_if_not_exists('foo', token) for token in tokens]
+    )
+    assert acquired.count(True) == 1
+    released = await asyncio.gather(
+        *[backend.delete_if_equals('foo', token) for token in tokens]
+    )
+    assert released == acquired
+    assert not await backend.exists('foo')
+
+
+@pytest.mark.asyncio
+async def test_arrays(backend):
+    data = np.arange(24, dtype='>i2').reshape((3, 2, 4))
+    await backend.set_arrays('testing', {'foo:data': data})
+    assert await backend.hexists('testing', 'foo:data')
+    assert await backend.hget('testing', 'foo:data') == data.tobytes()
+    array, missing = await backend.get_arrays(
+        'testing',
+        ['foo:data', 'bar:data'],
+        data.dtype,
+        [data.shape, data.shape],
+    )
+    np.testing.assert_array_equal(array, data)
+    assert array.dtype == data.dtype
+    assert missing is None
+
+
+@pytest.mark.asyncio
+async def test_concurrent_writes(backend):
+    # Writers of the same field never share a temporary file
+    values = [bytes([n]) * 100000 for n in range(8)]
+    await asyncio.gather(
+        *[backend.hset('testing', 'foo', value) for value in values]
+    )
+    assert await backend.hget('testing', 'foo') in values
+    assert await backend.hkeys('testing') == [b'foo']
+    arrays = [np.full((64, 64), n, dtype='>i2') for n in range(8)]
+    await asyncio.gather(
+        *[backend.set_arrays('testing', {'bar': a}) for a in arrays]
+    )
+    array, = await backend.get_arrays('testing', ['bar'], '>i2', [(64, 64)])
+    assert len(np.unique(array)) == 1
+
+
+@pytest.mark.asyncio
+async def test_pubsub(backend):
+    first = await backend.open_subscription()
+    second = await backend.open_subscription()
+    await first.subscribe('foo', 'bar')
+    await second.subscribe('foo')
+    await backend.publish('foo', 0.5)
+    await backend.publish('bar', b'spam')
+    await backend.publish('baz', 'nobody')
+    assert await first.get() == ('foo', b'0.5')
+    assert await first.get() == ('bar', b'spam')
+    assert await second.get() == ('foo', b'0.5')
+    await first.unsubscribe('foo')
+    await backend.publish('foo', 1)
+    await backend.publish('bar', 2)
+    assert await first.get() == ('bar', b'2')
+    assert await second.get() == ('foo', b'1')
+    await first.close()
+    await second.close()
+
+
+@pytest.mark.asyncio
+async def test_progress_cache_publishes(backend):
+    progress_cache = redis_cache.ProgressCache(backend)
+    subscription = await backend.open_subscription()
+    await subscription.subscribe(progress_cache.channel('foo'))
+    await progress_cache.start('foo', 200)
+    await progress_cache.progress('foo', 100)
+    for expected in [0.0, 0.5]:
+        channel, message = await subscription.get()
+        assert channel == 'progress:foo'
+        assert redis_cache.Progress.loads(message).progress == expected
+    await subscription.close()
+
+
+@pytest.mark.asyncio
+async def test_progress_cache_throttles(backend, mocker):
+    publish = mocker.spy(backend, 'publish')
+    progress_cache = redis_cache.ProgressCache(backend)
+    await progress_cache.start('foo', 1000)
+    # Small steps close together are only published once in a while
+    for _ in range(5):
+        await progress_cache.progress('foo', 1)
+    assert publish.call_count == 1
+    await progress_cache.progress('foo', 100)
+    assert publish.call_count == 2
+    await progress_cache.progress('foo', 1)
+    mocker.patch('time.time', return_value=time.time() + 1)
+    await progress_cache.progress('foo', 1)
+    assert publish.call_count == 3
+    record = await progress_cache.finish('foo')
+    assert publish.call_count == 4
+    assert (record.received, record.total) == (107, 1000)
+    assert redis_cache.Progress.loads(publish.call_args[0][1]) == record
+
+
+@pytest.mark.asyncio
+async def test_progress_cache_concurrent(backend):
+    progress_cache = redis_cache.ProgressCache(backend)
+    await progress_cache.start('foo')
+    # Concurrent updates are all counted
+    await asyncio.gather(
+        *[progress_cache.expect('foo', 100) for _ in range(10)],
+        *[progress_cache.progress('foo', 10) for _ in range(50)],
+    )
+    record = await progress_cache.get_record('foo')
+    assert (record.received, record.total) == (500, 1000)
+
+
+@pytest.mark.asyncio
+async def test_shared_subscription(backend, mocker):
+    open_subscription = mocker.spy(backend, 'open_subscription')
+    shared = await backend.shared_subscription()
+    assert await backend.shared_subscription() is shared
+    first, second = asyncio.Queue(), asyncio.Queue()
+    await shared.add(first, 'foo', 'bar')
+    await shared.add(second, 'foo')
+    await backend.publish('foo', 'spam')
+    await backend.publish('bar', 'eggs')
+    assert await first.get() == ('foo', b'spam')
+    assert await first.get() == ('bar', b'eggs')
+    assert await second.get() == ('foo', b'spam')
+    await shared.remove(first, 'foo', 'bar')
+    await backend.publish('foo', 'ham')
+    assert await second.get() == ('foo', b'ham')
+    assert first.empty()
+    assert open_subscription.call_count == 1
+    await backends.close_shared_subscriptions()
+
+
+@pytest.mark.asyncio
+async def test_progress_cache_subscribe(backend):
+    progress_cache = redis_cache.ProgressCache(backend)
+    async with progress_cache.subscribe(['foo', 'bar']) as updates:
+        await progress_cache.start('foo', 200)
+        await progress_cache.start('baz', 200)
+        await progress_cache.start('bar', 200)
+        await progress_cache.progress('foo', 200)
+        received = [await updates.get()]
+        async for ID, record in updates:
+            received.append((ID, record))
+            if len(received) == 3:
+                break
+    assert [(ID, r.progress) for ID, r in received] == [
+        ('foo', 0.0), ('bar', 0.0), ('foo', 1.0),
+    ]
+    assert received[-1][1].received == 200
+    await backends.close_shared_subscriptions()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('block_lines', [None, 1])
+async def test_image_cache(backend, image, block_lines):
+    image_cache = redis_cache.ImageCache(backend, block_lines=block_lines)
+    assert not await image_cache.exists('foo')
+    await image_cache.set('foo', image)
+    assert await image_cache.exists('foo')
+    assert await image_cache.keys() == ['foo']
+    cached_image = await image_cache.get('foo')
+    assert isinstance(cached_image, pdsimage.PDSImage)
+    np.testing.assert_array_equal(await image.data, await cached_image.data)
+    np.testing.assert_array_equal(
+        await image_cache.get_lines('foo', 1),
+        (await image.data)[:, 1:, :],
+    )
+
+
+@pytest.mark.asyncio
+async def test_get_backend(mocker, tmp_path):
+    mocker.patch('web.redis_cache._LOCAL_BACKENDS', {})
+    mocker.patch('web.redis_cache.CACHE_DIR', str(tmp_path))
+    mocker.patch('web.redis_cache.CACHE_BACKEND', 'memory')
+    backend = await redis_cache.get_backend()
+    assert isinstance(backend, backends.MemoryBackend)
+    assert await redis_cache.get_backend('data') is backend
+    mocker.patch('web.redis_cache.CACHE_BACKEND', 'filesystem')
+    assert isinstance(
+        await redis_cache.get_backend(),
+        backends.FilesystemBackend,
+    )
+    mocker.patch('web.redis_cache.CACHE_BACKEND', 'foo')
+    with pytest.raises(ValueError):
+        await redis_cache.get_backend()
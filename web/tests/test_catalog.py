@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+
+from web.catalog import Catalog
+
+
+def _item(ID, updated, active=True, name=None):
+    return {
+        'ID': ID,
+        'Name': name or f'im{ID}',
+        'Active': active,
+        'Updated': updated,
+    }
+
+
+class Fetcher:
+
+    def __init__(self, *changes):
+        self.changes = list(changes)
+        self.params = []
+
+    async def __call__(self, params):
+        self.params.append(params)
+        await asyncio.sleep(0)
+        return self.changes.pop(0)
+
+
+def test_params():
+    catalog = Catalog(None, ('Name', 'ID'), overlap=5)
+    assert catalog.params() == {'fields': 'ID,Name,Active,Updated'}
+    catalog.apply([
+        _item(2, '2019-03-02T10:00:00'),
+        _item(1, '2019-03-01T10:00:00'),
+    ])
+    assert catalog.params() == {
+        'fields': 'ID,Name,Active,Updated',
+        'since': '2019-03-02T09:59:55',
+    }
+
+
+def test_apply():
+    catalog = Catalog(None, ('Name',))
+    catalog.apply([_item(n, '2019-03-01T10:00:00') for n in range(1, 4)])
+    assert len(catalog) == 3
+    catalog.apply([
+        _item(2, '2019-03-02T10:00:00', active=False),
+        _item(3, '2019-03-02T10:00:00', name='moved'),
+        # Changes seen again are applied again
+        _item(2, '2019-03-02T10:00:00', active=False),
+    ])
+    items, _ = catalog.page(10)
+    assert [item['Name'] for item in items] == ['moved', 'im1']
+
+
+def test_page():
+    catalog = Catalog(None, ('Name',))
+    catalog.apply([
+        _item(ID, '2019-03-01T10:00:00', name=name)
+        for ID, name in [(1, '1P1'), (2, '2P1'), (3, '1P2'), (5, '1P3')]
+    ])
+    items, cursor = catalog.page(2)
+    assert [item['ID'] for item in items] == [5, 3]
+    assert cursor == 3
+    items, cursor = catalog.page(2, cursor)
+    assert [item['ID'] for item in items] == [2, 1]
+    assert cursor is None
+    items, cursor = catalog.page(2, 4)
+    assert [item['ID'] for item in items] == [3, 2]
+    assert cursor == 2
+
+    items, cursor = catalog.page(2, name='1P')
+    assert [item['ID'] for item in items] == [5, 3]
+    assert cursor == 3
+    items, cursor = catalog.page(2, cursor, name='1P')
+    assert [item['ID'] for item in items] == [1]
+    assert cursor is None
+
+    for limit in [0, -1]:
+        with pytest.raises(ValueError):
+            catalog.page(limit)
+
+
+@pytest.mark.asyncio
+async def test_sync():
+    fetch = Fetcher(
+        [_item(1, '2019-03-01T10:00:00')],
+        [_item(2, '2019-03-02T10:00:00')],
+    )
+    catalog = Catalog(fetch, ('Name',), overlap=0)
+    # Concurrent syncs share the same request
+    await asyncio.gather(catalog.sync(), catalog.sync())
+    assert len(fetch.params) == 1
+    assert len(catalog) == 1
+
+    await catalog.sync()
+    assert fetch.params[1]['since'] == '2019-03-01T10:00:00'
+    assert len(catalog) == 2
+
+    catalog.clear()
+    assert len(catalog) == 0
+    assert 'since' not in catalog.params()
+
+
+@pytest.mark.asyncio
+async def test_sync_error():
+    fetch = Fetcher()
+    catalog = Catalog(fetch, ('Name',))
+    with pytest.raises(IndexError):
+        await catalog.sync()
+    fetch.changes.append([_item(1, '2019-03-01T10:00:00')])
+    await catalog.sync()
+    assert len(catalog) == 1
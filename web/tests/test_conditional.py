@@ -0,0 +1,98 @@
+import pytest
+import aiohttp
+
+from web import metrics
+from web.conditional import ETagCache
+
+ITEMS = [{'ID': 1}, {'ID': 2}]
+
+
+@pytest.fixture
+async def cli(loop, aiohttp_client):
+    etags = {'items': 'W/"2"', 'untagged': None}
+
+    async def get_items(request):
+        name = request.match_info['name']
+        etag = etags[name]
+        if etag is not None and request.headers.get('If-None-Match') == etag:
+            return aiohttp.web.Response(status=304)
+        headers = {'Link': '</api/items?cursor=2>; rel="next"'}
+        if etag is not None:
+            headers['ETag'] = etag
+        return aiohttp.web.json_response(ITEMS, headers=headers)
+
+    ioapp = aiohttp.web.Application()
+    ioapp.router.add_get('/api/{name}', get_items)
+    client = await aiohttp_client(ioapp, raise_for_status=True)
+    client.etags = etags
+    return client
+
+
+@pytest.fixture(autouse=True)
+def clear_metrics():
+    metrics.clear()
+
+
+async def test_get_json(cli, mocker):
+    cache = ETagCache()
+    get = mocker.spy(cli, 'get')
+    first = await cache.get_json(cli, '/api/items', params={'a': '1'})
+    assert first == ITEMS
+    get.assert_called_with('/api/items', params={'a': '1'}, headers={})
+
+    second = await cache.get_json(cli, '/api/items', params={'a': '1'})
+    assert second is first
+    get.assert_called_with(
+        '/api/items',
+        params={'a': '1'},
+        headers={'If-None-Match': 'W/"2"'},
+    )
+    assert metrics.CACHE_LOOKUPS.get(('ETagCache', 'miss')) == 1
+    assert metrics.CACHE_LOOKUPS.get(('ETagCache', 'hit')) == 1
+
+    # Other parameters are another response
+    await cache.get_json(cli, '/api/items', params={'a': '2'})
+    assert metrics.CACHE_LOOKUPS.get(('ETagCache', 'miss')) == 2
+    assert len(cache) == 2
+
+
+async def test_get_links(cli):
+    cache = ETagCache()
+    first = await cache.get(cli, '/api/items')
+    assert first.etag == 'W/"2"'
+    assert first.links['next'].endswith('/api/items?cursor=2')
+    second = await cache.get(cli, '/api/items')
+    assert second == first
+
+
+async def test_get_json_changed(cli):
+    cache = ETagCache()
+    first = await cache.get_json(cli, '/api/items')
+    cli.etags['items'] = 'W/"3"'
+    second = await cache.get_json(cli, '/api/items')
+    assert second == first
+    assert second is not first
+    assert metrics.CACHE_LOOKUPS.get(('ETagCache', 'miss')) == 2
+
+
+async def test_get_json_untagged(cli):
+    cache = ETagCache()
+    assert await cache.get_json(cli, '/api/untagged') == ITEMS
+    assert len(cache) == 0
+
+
+async def test_maxsize(cli):
+    cache = ETagCache(maxsize=2)
+    await cache.get_json(cli, '/api/items', params={'a': '1'})
+    await cache.get_json(cli, '/api/items', params={'a': '2'})
+    # Using the first response makes the second the least recently used
+    await cache.get_json(cli, '/api/items', params={'a': '1'})
+    await cache.get_json(cli, '/api/items', params={'a': '3'})
+    assert len(cache) == 2
+    await cache.get_json(cli, '/api/items', params={'a': '1'})
+    assert metrics.CACHE_LOOKUPS.get(('ETagCache', 'hit')) == 2
+    await cache.get_json(cli, '/api/items', params={'a': '2'})
+    assert metrics.CACHE_LOOKUPS.get(('ETagCache', 'miss')) == 4
+
+    cache.clear()
+    assert len(cache) == 0
@@ -0,0 +1,151 @@
+import asyncio
+
+import pytest
+
+from web import ingest
+
+
+def make_job(ID, priority='normal', host='pds.nasa.gov'):
+    return ingest.IngestJob(
+        ID=ID,
+        url=f'http://{host}/{ID}.img',
+        name=ID,
+        priority=priority,
+    )
+
+
+def test_job():
+    job = make_job('foo', 'high')
+    assert job.host == 'pds.nasa.gov'
+    assert ingest.IngestJob.loads(job.dumps().encode()) == job
+
+
+@pytest.mark.asyncio
+async def test_local_job_queue():
+    queue = ingest.LocalJobQueue()
+    with pytest.raises(ValueError):
+        await queue.put(make_job('foo', 'urgent'))
+    for ID, priority in [('a', 'low'), ('b', 'normal'), ('c', 'high'),
+                         ('d', 'normal')]:
+        await queue.put(make_job(ID, priority))
+    assert [(await queue.get()).ID for _ in range(4)] == ['c', 'b', 'd', 'a']
+
+
+@pytest.mark.asyncio
+async def test_redis_job_queue(rcache):
+    first = ingest.RedisJobQueue(rcache, worker='first')
+    await first.start()
+    with pytest.raises(ValueError):
+        await first.put(make_job('foo', 'urgent'))
+    for ID, priority in [('a', 'low'), ('b', 'normal'), ('c', 'high'),
+                         ('d', 'normal')]:
+        await first.put(make_job(ID, priority))
+    jobs = [await first.get() for _ in range(4)]
+    assert [job.ID for job in jobs] == ['c', 'b', 'd', 'a']
+    await first.done(jobs[0])
+    processing = 'ingest:processing:first'
+    assert len(await rcache.lrange(processing, 0, -1)) == 3
+
+    # The jobs of a worker that died are queued again by the next one
+    first._heartbeat.cancel()
+    await rcache.delete('ingest:worker:first')
+    second = ingest.RedisJobQueue(rcache, worker='second')
+    await second.start()
+    assert not await rcache.exists(processing)
+    assert [(await second.get()).ID for _ in range(3)] == ['b', 'd', 'a']
+
+    # Stopping gives back the jobs that are not done
+    await second.stop()
+    assert not await rcache.exists('ingest:processing:second')
+    assert not await rcache.smembers('ingest:workers')
+    assert [(await first.get()).ID for _ in range(3)] == ['b', 'd', 'a']
+
+    # Idle workers block until a job is queued
+    getter = asyncio.ensure_future(first.get())
+    await asyncio.sleep(0.1)
+    assert not getter.done()
+    await first.put(make_job('e', 'low'))
+    assert (await asyncio.wait_for(getter, 1)).ID == 'e'
+
+
+@pytest.mark.asyncio
+async def test_get_job_queue(mocker):
+    mocker.patch('web.redis_cache.CACHE_BACKEND', 'memory')
+    assert isinstance(await ingest.get_job_queue(), ingest.LocalJobQueue)
+
+
+@pytest.mark.asyncio
+async def test_ingest_workers(mocker):
+    running = {'total': 0, 'slow': 0}
+    peak = {'total': 0, 'slow': 0}
+    processed = []
+
+    async def handler(job):
+        running['total'] += 1
+        running[job.host] = running.get(job.host, 0) + 1
+        for key in peak:
+            peak[key] = max(peak[key], running.get(key, 0))
+        await asyncio.sleep(0.01)
+        running['total'] -= 1
+        running[job.host] -= 1
+        if job.ID == 'bad':
+            raise ValueError('Failed download')
+        processed.append(job.ID)
+
+    queue = ingest.LocalJobQueue()
+    done = mocker.spy(queue, 'done')
+    workers = ingest.IngestWorkers(
+        queue,
+        handler,
+        workers=3,
+        host_limit=1,
+    )
+    await workers.put(make_job('bad'))
+    for n in range(4):
+        await workers.put(make_job(f'slow{n}', host='slow'))
+        await workers.put(make_job(f'fast{n}', host=f'fast{n}'))
+    await workers.start()
+    for _ in range(100):
+        if len(processed) == 8:
+            break
+        await asyncio.sleep(0.01)
+    await workers.stop()
+    assert sorted(processed) == sorted(
+        [f'slow{n}' for n in range(4)] + [f'fast{n}' for n in range(4)]
+    )
+    assert peak['total'] == 3
+    assert peak['slow'] == 1
+    assert not workers._hosts
+    # Failed jobs are done too, they are not retried
+    assert done.call_count == 9
+
+
+@pytest.mark.asyncio
+async def test_ingest_workers_busy_host():
+    release = asyncio.Event()
+    processed = []
+
+    async def handler(job):
+        if job.host == 'slow':
+            await release.wait()
+        processed.append(job.ID)
+
+    queue = ingest.LocalJobQueue()
+    workers = ingest.IngestWorkers(queue, handler, workers=2, host_limit=1)
+    for n in range(3):
+        await workers.put(make_job(f'slow{n}', host='slow'))
+    await workers.put(make_job('fast', host='fast'))
+    await workers.start()
+    # The jobs waiting for the slow host leave a slot to the other hosts
+    for _ in range(100):
+        if processed:
+            break
+        await asyncio.sleep(0.01)
+    assert processed == ['fast']
+    release.set()
+    for _ in range(100):
+        if len(processed) == 4:
+            break
+        await asyncio.sleep(0.01)
+    await workers.stop()
+    assert processed == ['fast', 'slow0', 'slow1', 'slow2']
@@ -0,0 +1,65 @@
+import datetime
+
+import pvl
+import pytest
+
+from web import labels
+
+LABEL = b"""PDS_VERSION_ID = PDS3
+RECORD_BYTES = 512
+^IMAGE = (\"1P129069032ESF0224P2812L2C1.IMG\", 3 <BYTES>)
+START_TIME = 2004-02-04T13:45:12.345Z
+STOP_TIME = 2004-035T13:45:12
+RELEASE_DATE = 2004-02-04
+LOCAL_TIME = 13:45:12
+EXPOSURE_DURATION = 12.5 <ms>
+FILTER_NAME = {"L2", "R2"}
+MODEL_COMPONENT_1 = (1.1, 2, "x")
+MISSING = NULL
+OBJECT = IMAGE
+  LINES = 1024
+  LINE_SAMPLES = 1024
+  SAMPLE_TYPE = MSB_INTEGER
+  SAMPLE_BITS = 16
+END_OBJECT = IMAGE
+GROUP = INSTRUMENT_STATE
+  FLAG = TRUE
+  FLAG = FALSE
+END_GROUP = INSTRUMENT_STATE
+END
+"""
+
+
+@pytest.fixture
+def pds_label():
+    return pvl.loads(LABEL)
+
+
+def test_dumps(pds_label):
+    content = labels.dumps(pds_label)
+    assert content.startswith(labels.MAGIC)
+    assert b'INSTRUMENT_STATE' in content
+
+
+def test_round_trip(pds_label, label):
+    for original in [pds_label, label]:
+        decoded = labels.loads(labels.dumps(original))
+        assert decoded == original
+        assert isinstance(decoded, pvl.PVLModule)
+    decoded = labels.loads(labels.dumps(pds_label))
+    assert isinstance(decoded['IMAGE'], pvl.PVLObject)
+    assert isinstance(decoded['INSTRUMENT_STATE'], pvl.PVLGroup)
+    assert decoded['EXPOSURE_DURATION'] == pvl.Units(12.5, 'ms')
+    assert decoded['START_TIME'] == pds_label['START_TIME']
+    assert isinstance(decoded['RELEASE_DATE'], datetime.date)
+    assert decoded['FILTER_NAME'] == {'L2', 'R2'}
+    assert decoded['INSTRUMENT_STATE'].getlist('FLAG') == [True, False]
+
+
+def test_loads_pvl(pds_label):
+    assert labels.loads(pvl.dumps(pds_label)) == pds_label
+
+
+def test_dumps_unknown_type():
+    with pytest.raises(TypeError):
+        labels.dumps(pvl.PVLModule({'FOO': object()}))
@@ -0,0 +1,113 @@
+import pytest
+import aiohttp
+
+from web import metrics, backends, redis_cache
+
+
+@pytest.fixture(autouse=True)
+def clear_metrics():
+    metrics.clear()
+    yield
+    metrics.clear()
+
+
+def test_counter():
+    counter = metrics.Counter('test_total', 'Test counter', ('cache',))
+    counter.inc(('image',))
+    counter.inc(('image',), 2)
+    counter.inc(('pro"gress',))
+    assert counter.get(('image',)) == 3
+    assert counter.get(('missing',)) == 0
+    assert counter.render() == '\n'.join([
+        '# HELP test_total Test counter',
+        '# TYPE test_total counter',
+        'test_total{cache="image"} 3',
+        'test_total{cache="pro\\"gress"} 1',
+    ])
+    counter.clear()
+    assert counter.get(('image',)) == 0
+
+
+def test_histogram():
+    histogram = metrics.Histogram(
+        'test_seconds', 'Test histogram', ('operation',), buckets=(0.1, 1),
+    )
+    histogram.observe(('get',), 0.05)
+    histogram.observe(('get',), 0.5)
+    histogram.observe(('get',), 5)
+    assert histogram.count(('get',)) == 3
+    assert histogram.render() == '\n'.join([
+        '# HELP test_seconds Test histogram',
+        '# TYPE test_seconds histogram',
+        'test_seconds_bucket{operation="get",le="0.1"} 1',
+        'test_seconds_bucket{operation="get",le="1"} 2',
+        'test_seconds_bucket{operation="get",le="+Inf"} 3',
+        'test_seconds_sum{operation="get"} 5.55',
+        'test_seconds_count{operation="get"} 3',
+    ])
+
+
+@pytest.mark.asyncio
+async def test_instrumented_backend():
+    backend = backends.InstrumentedBackend(backends.MemoryBackend(), 'test')
+    await backend.hset('hash', 'foo', b'bar')
+    await backend.set('key', 'spam')
+    assert await backend.hget('hash', 'foo') == b'bar'
+    assert await backend.get('key') == b'spam'
+    assert await backend.get('missing') is None
+    assert metrics.CACHE_BYTES.get(('test', 'written')) == 7
+    assert metrics.CACHE_BYTES.get(('test', 'read')) == 7
+    assert metrics.CACHE_SECONDS.count(('test', 'get')) == 2
+    assert metrics.CACHE_SECONDS.count(('test', 'hset')) == 1
+
+
+@pytest.mark.asyncio
+async def test_cache_lookups(image):
+    cache = redis_cache.ImageCache(backends.MemoryBackend())
+    assert isinstance(cache._backend, backends.InstrumentedBackend)
+    assert not await cache.exists('image.img')
+    with pytest.raises(KeyError):
+        await cache.get('image.img')
+    await cache.set('image.img', image)
+    assert await cache.exists('image.img')
+    await cache.get('image.img')
+    assert metrics.CACHE_LOOKUPS.get(('ImageCache', 'hit')) == 2
+    assert metrics.CACHE_LOOKUPS.get(('ImageCache', 'miss')) == 2
+    data = await image.data
+    written = metrics.CACHE_BYTES.get(('ImageCache', 'written'))
+    assert written > data.nbytes
+    await cache.delete('image.img')
+    assert metrics.CACHE_EVICTIONS.get(('ImageCache',)) == 1
+
+    progress = redis_cache.ProgressCache(backends.MemoryBackend())
+    assert await progress.get('1') == -1
+    await progress.start('1', 10)
+    assert await progress.get('1') == 0
+    assert metrics.CACHE_LOOKUPS.get(('ProgressCache', 'hit')) == 1
+    assert metrics.CACHE_LOOKUPS.get(('ProgressCache', 'miss')) == 1
+
+
+async def test_http_trace_config(aiohttp_server):
+
+    async def handler(request):
+        status = int(request.match_info['status'])
+        return aiohttp.web.Response(body=b'x' * 10, status=status)
+
+    ioapp = aiohttp.web.Application()
+    ioapp.router.add_get('/{status}', handler)
+    server = await aiohttp_server(ioapp)
+    host = f'{server.host}:{server.port}'
+    async with aiohttp.ClientSession(
+        raise_for_status=True,
+        trace_configs=[metrics.http_trace_config()],
+    ) as session:
+        async with session.get(server.make_url('/200')) as resp:
+            await resp.read()
+        with pytest.raises(aiohttp.ClientResponseError):
+            await session.get(server.make_url('/404'))
+    assert metrics.HTTP_REQUESTS.get((host, '200')) == 1
+    assert metrics.HTTP_REQUESTS.get((host, '404')) == 1
+    assert metrics.HTTP_BYTES.get((host,)) == 10
+    assert metrics.HTTP_SECONDS.count((host,)) == 2
+    text = metrics.render()
+    assert '# TYPE opportunity_http_client_request_seconds histogram' in text
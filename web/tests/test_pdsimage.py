@@ -24,10 +24,10 @@ async def test_get_shape(label):
 async def test_from_url(aiohttp_client, image, rcache):
     progress_cache = redis_cache.ProgressCache(rcache)
 
+    data = await image.data
+    body = pvl.dumps(await image.label) + b'\r\n' + data.tobytes()
+
     async def download_image(request):
-        data = await image.data
-        label = await image.label
-        body = pvl.dumps(label) + b'\r\n' + data.tobytes()
         return aiohttp.web.Response(body=body)
     app = aiohttp.web.Application()
     url = '/image.img'
@@ -39,6 +39,9 @@ async def test_from_url(aiohttp_client, image, rcache):
         progress=(progress_cache, 'image.img'),
     )
     np.testing.assert_array_equal(await im.data, await image.data)
+    record = await progress_cache.get_record('image.img')
+    assert record.finished
+    assert record.received == record.total == len(body)
 
     # Test detatched
     async def download_image(request):
@@ -60,6 +63,31 @@ async def test_from_url(aiohttp_client, image, rcache):
     progress = (progress_cache, 'image.img')
     im = await pdsimage.PDSImage.from_url(url, client, progress, True)
     np.testing.assert_array_equal(await im.data, await image.data)
+    # The progress covers both parts without restarting for the label
+    record = await progress_cache.get_record('image.img')
+    assert record.finished
+    expected = len(data.tobytes()) + len(pvl.dumps(await image.label))
+    assert record.received == record.total == expected
+
+
+async def test_from_url_failed(aiohttp_client, rcache):
+    progress_cache = redis_cache.ProgressCache(rcache)
+
+    async def download_image(request):
+        return aiohttp.web.Response(body=b'not a label')
+    app = aiohttp.web.Application()
+    app.router.add_get('/image.img', download_image)
+    client = await aiohttp_client(app)
+    with pytest.raises(Exception):
+        await pdsimage.PDSImage.from_url(
+            url='/image.img',
+            session=client,
+            progress=(progress_cache, 'image.img'),
+        )
+    # The download is not reported finished when its label is bad
+    record = await progress_cache.get_record('image.img')
+    assert record.failed
+    assert not record.finished
 
 
 @pytest.mark.asyncio
@@ -79,6 +107,55 @@ async def test_label(image):
     assert await image.label == image._label
 
 
+def test_get_metadata():
+    label = pvl.loads(
+        'START_TIME = 2004-01-26T03:17:43.880Z\n'
+        'SPACECRAFT_CLOCK_START_COUNT = "128287538.108"\n'
+        'GROUP = INSTRUMENT_STATE_PARMS\n'
+        '  EXPOSURE_DURATION = 149.76 <ms>\n'
+        '  FILTER_NAME = "L2_753NM"\n'
+        'END_GROUP = INSTRUMENT_STATE_PARMS\n'
+        'OBJECT = IMAGE_HEADER\n'
+        '  LINES = 7\n'
+        'END_OBJECT = IMAGE_HEADER\n'
+        'OBJECT = IMAGE\n'
+        '  LINES = 1024\n'
+        '  LINE_SAMPLES = 512\n'
+        '  BANDS = 1\n'
+        '  SAMPLE_TYPE = MSB_INTEGER\n'
+        'END_OBJECT = IMAGE\n'
+        'END\n'
+    )
+    assert pdsimage.get_metadata(label) == {
+        'StartTime': '2004-01-26T03:17:43.880000',
+        'SpacecraftClockStart': 128287538.108,
+        'ExposureDuration': 149.76,
+        'FilterName': 'L2_753NM',
+        'Lines': 1024,
+        'LineSamples': 512,
+        'Bands': 1,
+        'SampleType': 'MSB_INTEGER',
+    }
+
+    label['INSTRUMENT_STATE_PARMS']['EXPOSURE_DURATION'] = pvl.Units(2, 's')
+    label['SPACECRAFT_CLOCK_START_COUNT'] = 'UNK'
+    del label['START_TIME']
+    metadata = pdsimage.get_metadata(label)
+    assert metadata['ExposureDuration'] == 2000
+    assert 'SpacecraftClockStart' not in metadata
+    assert 'StartTime' not in metadata
+
+
+@pytest.mark.asyncio
+async def test_metadata(image):
+    assert await image.metadata == {
+        'Lines': 2,
+        'LineSamples': 4,
+        'Bands': 3,
+        'SampleType': 'MSB_INTEGER',
+    }
+
+
 @pytest.mark.asyncio
 async def test_bands(image, gray_image):
     assert await image.bands == 3
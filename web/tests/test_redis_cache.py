@@ -1,11 +1,12 @@
 from datetime import datetime
 from unittest.mock import patch
 
+import pvl
 import aioredis
 import pytest
 import numpy as np
 
-from web import redis_cache, pdsimage
+from web import redis_cache, pdsimage, labels
 
 
 @pytest.fixture
@@ -29,6 +30,48 @@ async def test_get_rcache(rcache):
     assert isinstance(rcache, aioredis.Redis)
 
 
+@pytest.mark.asyncio
+async def test_get_rcache_pools(rcache):
+    data_rcache = await redis_cache.get_rcache('data')
+    assert isinstance(data_rcache, aioredis.Redis)
+    assert data_rcache is not rcache
+    assert await redis_cache.get_rcache('data') is data_rcache
+    with pytest.raises(ValueError):
+        await redis_cache.get_rcache('foo')
+
+
+@pytest.mark.asyncio
+async def test_get_rcache_shared(mocker):
+
+    async def create_redis_pool(*args, **kwargs):
+        return mocker.Mock()
+    create = mocker.patch(
+        'web.redis_cache.aioredis.create_redis_pool',
+        side_effect=create_redis_pool,
+    )
+    mocker.patch.object(redis_cache, '_OPEN_POOLS', [])
+    redis_cache._get_rcache.cache_clear()
+    try:
+        # The default pool is the same however it is named
+        rcache = await redis_cache.get_rcache()
+        assert await redis_cache.get_rcache('control') is rcache
+        assert await redis_cache.get_rcache(pool='control') is rcache
+        assert create.call_count == 1
+        assert redis_cache._OPEN_POOLS == [rcache]
+    finally:
+        redis_cache._get_rcache.cache_clear()
+
+
+@pytest.mark.asyncio
+async def test_close_rcache(docker_container):
+    rcache = await redis_cache.get_rcache()
+    await redis_cache.close_rcache()
+    assert rcache.closed
+    new_rcache = await redis_cache.get_rcache()
+    assert new_rcache is not rcache
+    assert not new_rcache.closed
+
+
 @pytest.mark.asyncio
 async def test_HashCache(rcache):
 
@@ -160,3 +203,161 @@ class TestImageCache:
         # Set item without internal entries
         await image_cache.set_time('bar')
         assert not await image_cache.exists('bar')
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('label_format', ['json', 'pvl'])
+    async def test_label_format(self, rcache, image, label_format):
+        image_cache = redis_cache.ImageCache(
+            rcache,
+            label_format=label_format,
+        )
+        await image_cache.set('foo', image)
+        content = await redis_cache.HashCache.get(image_cache, 'foo:label')
+        assert content.startswith(labels.MAGIC) == (label_format == 'json')
+        cached_image = await image_cache.get('foo')
+        expected = await image.label
+        if label_format == 'pvl':
+            expected = pvl.loads(pvl.dumps(expected))
+        assert await cached_image.label == expected
+        with pytest.raises(ValueError):
+            redis_cache.ImageCache(rcache, label_format='xml')
+
+    @pytest.mark.asyncio
+    async def test_get_without_label(self, image, image_cache, mocker):
+        loads = mocker.spy(labels, 'loads')
+        await image_cache.set('foo', image)
+        cached_image = await image_cache.get('foo', label=False)
+        assert not loads.called
+        assert await cached_image.label == pvl.PVLModule()
+        np.testing.assert_array_equal(
+            await image.data,
+            await cached_image.data,
+        )
+
+    @pytest.mark.asyncio
+    async def test_block_lines(self, rcache):
+        with pytest.raises(ValueError):
+            redis_cache.ImageCache(rcache, block_lines=0)
+
+    @pytest.mark.asyncio
+    async def test_set_blocks(self, rcache, image):
+        image_cache = redis_cache.ImageCache(rcache, block_lines=1)
+        await image_cache.set('foo', image)
+        assert await image_cache.exists('foo')
+        assert await image_cache.exists('foo:blocks')
+        assert await image_cache.exists('foo:data:0')
+        assert await image_cache.exists('foo:data:1')
+        assert not await image_cache.exists('foo:data')
+        assert await image_cache.keys() == ['foo']
+        cached_image = await image_cache.get('foo')
+        np.testing.assert_array_equal(
+            await image.data,
+            await cached_image.data,
+        )
+
+        # Larger blocks leave no blocks of the previous layout behind
+        await redis_cache.ImageCache(rcache, block_lines=2).set('foo', image)
+        assert await image_cache.exists('foo:data:0')
+        assert not await image_cache.exists('foo:data:1')
+        cached_image = await image_cache.get('foo')
+        np.testing.assert_array_equal(
+            await image.data,
+            await cached_image.data,
+        )
+
+        # Switching back to a single field removes the block layout
+        await redis_cache.ImageCache(rcache).set('foo', image)
+        assert await image_cache.exists('foo:data')
+        assert not await image_cache.exists('foo:blocks')
+        assert not await image_cache.exists('foo:data:0')
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('block_lines', [None, 1, 2, 64])
+    async def test_get_lines(self, rcache, image, block_lines):
+        image_cache = redis_cache.ImageCache(rcache, block_lines=block_lines)
+        await image_cache.set('foo', image)
+        data = await image.data
+        for start, stop in [(0, None), (0, 1), (1, 2), (1, None), (2, 2)]:
+            np.testing.assert_array_equal(
+                await image_cache.get_lines('foo', start, stop),
+                data[..., start:stop, :],
+            )
+
+
+class TestProgressCache:
+
+    @pytest.fixture
+    def clock(self, mocker):
+        time = mocker.patch('web.redis_cache.time.time')
+        time.return_value = 100.0
+        return time
+
+    @pytest.mark.asyncio
+    async def test_progress(self, rcache, clock):
+        progress_cache = redis_cache.ProgressCache(rcache)
+        assert await progress_cache.get('foo') == -1
+        assert await progress_cache.get_record('foo') is None
+        assert await progress_cache.progress('foo', 10) is None
+        await progress_cache.start('foo', 1000)
+        assert await progress_cache.get('foo') == 0
+
+        clock.return_value = 102.0
+        record = await progress_cache.progress('foo', 200)
+        assert record.received == 200
+        assert record.rate == 100
+        assert record.eta == 8
+        assert await progress_cache.get('foo') == 0.2
+
+        # The rate moves toward the new transfer rate
+        clock.return_value = 103.0
+        record = await progress_cache.progress('foo', 300)
+        assert 100 < record.rate < 300
+        assert record == await progress_cache.get_record('foo')
+
+        # Only the bytes received in the window count toward the rate
+        clock.return_value = 110.0
+        record = await progress_cache.progress('foo', 100)
+        assert record.rate == 20
+        assert await progress_cache.get('foo') == 0.6
+
+        record = await progress_cache.finish('foo')
+        assert record.finished
+        assert record.progress == 1
+        assert record.eta == 0
+
+    @pytest.mark.asyncio
+    async def test_parts(self, rcache, clock):
+        progress_cache = redis_cache.ProgressCache(rcache)
+        await progress_cache.start('foo')
+        await progress_cache.progress('foo', 50)
+        assert await progress_cache.get('foo') == 0
+        await progress_cache.expect('foo', 100)
+        await progress_cache.expect('foo', 100)
+        assert await progress_cache.get('foo') == 0.25
+        record = await progress_cache.finish('foo')
+        assert (record.received, record.total) == (50, 200)
+        await progress_cache.expect('bar', 100)
+        assert (await progress_cache.get_record('bar')).total == 100
+
+    @pytest.mark.asyncio
+    async def test_failed(self, rcache, clock):
+        progress_cache = redis_cache.ProgressCache(rcache)
+        await progress_cache.start('foo', 1000)
+        await progress_cache.progress('foo', 200)
+        record = await progress_cache.finish('foo', failed=True)
+        assert record.failed
+        assert not record.finished
+        assert record.received == 200
+        assert record.eta is None
+        # Downloads failing before they start still get a record
+        record = await progress_cache.finish('bar', failed=True)
+        assert record == await progress_cache.get_record('bar')
+        assert record.failed
+
+    def test_record(self):
+        record = redis_cache.Progress(received=5, total=10, rate=1.0)
+        assert redis_cache.Progress.loads(record.dumps()) == record
+        assert record.to_dict()['progress'] == 0.5
+        assert record.to_dict()['eta'] == 5
+        assert redis_cache.Progress(received=5).progress == 0
+        assert redis_cache.Progress(received=5).eta is None
@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+from web import backends
+from web.reference import ReferenceCache, ReferenceCaches
+
+
+class Fetcher:
+
+    def __init__(self):
+        self.calls = 0
+        self.error = None
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(0)
+        if self.error is not None:
+            raise self.error
+        return self.calls
+
+
+@pytest.fixture
+def clock(mocker):
+    monotonic = mocker.patch('web.reference.monotonic')
+    monotonic.return_value = 0.0
+    return monotonic
+
+
+@pytest.mark.asyncio
+async def test_get(clock):
+    fetch = Fetcher()
+    cache = ReferenceCache(fetch, ttl=10, max_stale=20)
+    assert cache.age is None
+    assert await asyncio.gather(cache.get(), cache.get()) == [1, 1]
+    assert fetch.calls == 1
+
+    # Fresh values are served from the cache
+    clock.return_value = 5.0
+    assert await cache.get() == 1
+    assert fetch.calls == 1
+
+    # Stale values are served while refreshing in the background
+    clock.return_value = 15.0
+    assert await cache.get() == 1
+    await asyncio.sleep(0.01)
+    assert fetch.calls == 2
+    assert await cache.get() == 2
+
+    # Values that are too old are refreshed before returning
+    clock.return_value = 50.0
+    assert await cache.get() == 3
+
+
+@pytest.mark.asyncio
+async def test_errors(clock):
+    fetch = Fetcher()
+    cache = ReferenceCache(fetch, ttl=10, max_stale=20)
+    fetch.error = ValueError('down')
+    with pytest.raises(ValueError):
+        await cache.get()
+    fetch.error = None
+    assert await cache.get() == 2
+
+    # A failed background refresh keeps serving the stale value
+    fetch.error = ValueError('down')
+    clock.return_value = 15.0
+    assert await cache.get() == 2
+    await asyncio.sleep(0.01)
+    assert await cache.get() == 2
+
+
+@pytest.mark.asyncio
+async def test_invalidate(clock):
+    fetch = Fetcher()
+    cache = ReferenceCache(fetch, ttl=10, max_stale=20)
+    assert await cache.get() == 1
+    cache.invalidate()
+    assert cache.age is None
+    assert await cache.get() == 2
+
+    # A fetch started before the invalidation is not kept
+    clock.return_value = 15.0
+    assert await cache.get() == 2
+    cache.invalidate()
+    await asyncio.sleep(0.01)
+    assert cache.age is None
+    assert await cache.get() == 4
+
+
+@pytest.mark.asyncio
+async def test_reference_caches(clock):
+    backend = backends.MemoryBackend()
+    first, second = ReferenceCaches(), ReferenceCaches()
+    for caches in [first, second]:
+        caches.add('cameras', ReferenceCache(Fetcher()))
+        await caches.start(backend)
+    assert 'cameras' in first
+    assert await first['cameras'].get() == 1
+    assert await second['cameras'].get() == 1
+
+    # Invalidations reach the other workers
+    await first.invalidate('cameras')
+    assert first['cameras'].age is None
+    await asyncio.sleep(0.01)
+    assert second['cameras'].age is None
+    assert await second['cameras'].get() == 2
+
+    await first.stop()
+    await second.stop()
+    await backends.close_shared_subscriptions()
@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from web import backends
+from web.singleflight import Lease, SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_single_flight():
+    calls = []
+    single_flight = SingleFlight()
+
+    async def func(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        return value
+
+    results = await asyncio.gather(
+        single_flight.do('foo', lambda: func(1)),
+        single_flight.do('foo', lambda: func(2)),
+        single_flight.do('bar', lambda: func(3)),
+    )
+    assert results == [1, 1, 3]
+    assert calls == [1, 3]
+    assert 'foo' not in single_flight
+    assert await single_flight.do('foo', lambda: func(4)) == 4
+
+
+@pytest.mark.asyncio
+async def test_single_flight_error():
+    single_flight = SingleFlight()
+
+    async def func():
+        await asyncio.sleep(0.01)
+        raise ValueError('Failed')
+
+    results = await asyncio.gather(
+        single_flight.do('foo', func),
+        single_flight.do('foo', func),
+        return_exceptions=True,
+    )
+    assert all(isinstance(result, ValueError) for result in results)
+    assert 'foo' not in single_flight
+
+
+@pytest.mark.asyncio
+async def test_single_flight_cancel():
+    single_flight = SingleFlight()
+
+    async def func():
+        await asyncio.sleep(0.01)
+        return 'done'
+
+    first = asyncio.ensure_future(single_flight.do('foo', func))
+    second = asyncio.ensure_future(single_flight.do('foo', func))
+    await asyncio.sleep(0)
+    first.cancel()
+    assert await second == 'done'
+
+
+@pytest.mark.asyncio
+async def test_lease():
+    backend = backends.MemoryBackend()
+    lease = Lease(backend, 'foo', expire=60)
+    assert await lease.acquire()
+    assert not await lease.acquire()
+    other = Lease(backend, 'foo')
+    assert not await other.acquire()
+    assert not await other.release()
+    assert await Lease(backend, 'foo', token=lease.token).release()
+    assert not await lease.release()
+    assert await other.acquire()
+
+
+@pytest.mark.asyncio
+async def test_lease_redis(rcache):
+    lease = Lease(rcache, 'foo', expire=60)
+    assert await lease.acquire()
+    assert not await Lease(rcache, 'foo').acquire()
+    assert await lease.release()
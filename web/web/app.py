@@ -1,7 +1,8 @@
 import json
 import asyncio
 import posixpath
-from typing import Tuple, List, Any
+from functools import partial
+from typing import Tuple, List, Any, Dict, Iterator, AsyncIterator
 
 import logging
 import aiohttp
@@ -17,9 +18,26 @@ from quart import (
     render_template,
 )
 
+from web import config, metrics
 from web.constants import DSN
+from web.catalog import Catalog
 from web.pdsimage import PDSImage
-from web.redis_cache import ImageCache, get_rcache, ProgressCache
+from web.conditional import ETagCache
+from web.singleflight import Lease, SingleFlight
+from web.reference import ReferenceCache, ReferenceCaches
+from web.ingest import (
+    PRIORITIES,
+    IngestJob,
+    IngestWorkers,
+    get_job_queue,
+)
+from web.redis_cache import (
+    Progress,
+    ImageCache,
+    get_backend,
+    close_rcache,
+    ProgressCache,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +47,7 @@ class SessionQuart(Quart):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.session: aiohttp.ClientSession = None
+        self.ingest: IngestWorkers = None
 
 
 sentry_sdk.init(
@@ -38,21 +57,44 @@ sentry_sdk.init(
 
 
 app = SessionQuart(__name__)
+app.config.from_object(config.DevelopmentConfig)
 
 services = Blueprint('services', __name__)
 
 API_URL = 'http://opp-app:80/api'
 
+image_fills = SingleFlight()
+
+# Last responses of the API, sent again when it answers 304 Not Modified
+api_responses = ETagCache()
+
+# Seconds between comments sent on idle event streams to keep them open
+SSE_KEEPALIVE = 15
+
 
 @app.before_serving
 async def before_serving():
-    session = aiohttp.ClientSession(raise_for_status=True)
+    session = aiohttp.ClientSession(
+        raise_for_status=True,
+        trace_configs=[metrics.http_trace_config()],
+    )
     app.session = session
+    app.ingest = IngestWorkers(
+        queue=await get_job_queue(),
+        handler=ingest_image,
+        workers=app.config['INGEST_WORKERS'],
+        host_limit=app.config['INGEST_HOST_LIMIT'],
+    )
+    await app.ingest.start()
+    await reference_caches.start(await get_backend())
 
 
 @app.after_serving
 async def after_serving():
+    await reference_caches.stop()
+    await app.ingest.stop()
     await app.session.close()
+    await close_rcache()
 
 
 @app.route('/')
@@ -62,6 +104,15 @@ async def index() -> str:
     return await render_template('index.html', DSN=DSN)
 
 
+async def get_image_cache(pool: str = 'control') -> ImageCache:
+    backend = await get_backend(pool)
+    return ImageCache(
+        backend,
+        block_lines=app.config['IMAGE_BLOCK_LINES'],
+        label_format=app.config['IMAGE_LABEL_FORMAT'],
+    )
+
+
 async def _create_resource(resource_name: str,
                            is_upper: bool) -> Tuple[dict, int]:
     url = f'{API_URL}/{resource_name}'
@@ -81,21 +132,34 @@ async def _create_resource(resource_name: str,
     except aiohttp.ClientResponseError as err:
         logger.exception(f'Error creating resource {resource_name}')
         return {'error': str(err)}, err.status
+    if resource_name in reference_caches:
+        await reference_caches.invalidate(resource_name)
     return data, resp.status
 
 
-async def _get_resources(resource_name: str) -> Tuple[List[Any], int]:
+async def _fetch_resources(resource_name: str) -> List[Any]:
     url = f'{API_URL}/{resource_name}'
-    params = {'Active': 'true'}
+    params = {'Active': 'true', 'fields': 'ID,Name'}
     logger.info(f'GET {url}')
+    return await api_responses.get_json(app.session, url, params=params)
+
+
+reference_caches = ReferenceCaches()
+for _name in ['cameras', 'product_types']:
+    reference_caches.add(_name, ReferenceCache(
+        partial(_fetch_resources, _name),
+        ttl=app.config['REFERENCE_TTL'],
+        max_stale=app.config['REFERENCE_MAX_STALE'],
+    ))
+
+
+async def _get_resources(resource_name: str) -> Tuple[List[Any], int]:
     try:
-        async with app.session.get(url, params=params) as resp:
-            resources = await resp.json()
-            status_code = resp.status
+        resources = await reference_caches[resource_name].get()
     except aiohttp.ClientResponseError as err:
         logger.exception(f'Failed getting resource {resource_name}')
         return [], err.status
-    return resources, status_code
+    return resources, 200
 
 
 @services.route('/product_types', methods=['POST'])
@@ -122,23 +186,22 @@ async def get_cameras() -> Tuple[Response, int]:
     return jsonify(data=cameras), status_code
 
 
-@services.route('/images', methods=['POST'])
-async def register_image() -> Tuple[Response, int]:
-    data = await request.get_json()
-    sol = int(data['sol'])
+def _new_image(data: dict) -> dict:
     url = str(data['url'])
-    name = posixpath.basename(url)
-    detatched = bool(data['detatched'])
-    product_type_id = int(data['productType'])
-    camera_id = int(data['camera'])
-    new_image = {
-        'Name': name,
+    return {
+        'Name': posixpath.basename(url),
         'URL': url,
-        'Sol': sol,
-        'DetatchedLabel': detatched,
-        'CameraID': camera_id,
-        'ProductTypeID': product_type_id,
+        'Sol': int(data['sol']),
+        'DetatchedLabel': bool(data['detatched']),
+        'CameraID': int(data['camera']),
+        'ProductTypeID': int(data['productType']),
     }
+
+
+@services.route('/images', methods=['POST'])
+async def register_image() -> Tuple[Response, int]:
+    data = await request.get_json()
+    new_image = _new_image(data)
     api_url = f'{API_URL}/images'
     logger.info(f'POST {api_url} - data: {json.dumps(new_image)}')
     try:
@@ -152,55 +215,171 @@ async def register_image() -> Tuple[Response, int]:
     return jsonify(data=data), status_code
 
 
+@services.route('/images/batch', methods=['POST'])
+async def register_images() -> Tuple[Response, int]:
+    data = await request.get_json()
+    new_images = []
+    errors = []
+    for index, item in enumerate(data):
+        try:
+            new_images.append(_new_image(item))
+        except (KeyError, TypeError, ValueError) as err:
+            errors.append({'index': index, 'error': f'{err!r}'})
+    if errors:
+        logger.error(f'{len(errors)} invalid images, none registered')
+        return jsonify(data={'created': 0, 'errors': errors}), 400
+    api_url = f'{API_URL}/images/bulk'
+    logger.info(f'POST {api_url} - {len(new_images)} images')
+    # The API reports invalid images in the body of its error response
+    async with app.session.post(api_url, json=new_images,
+                                raise_for_status=False) as resp:
+        if resp.content_type == 'application/json':
+            data = await resp.json()
+        else:
+            data = {'error': await resp.text()}
+        status_code = resp.status
+    if status_code >= 400:
+        logger.error(f'Failed registering images: {data}')
+    return jsonify(data=data), status_code
+
+
+async def _fetch_images(params: Dict[str, str]) -> List[Any]:
+    url = f'{API_URL}/images'
+    logger.info(f'GET {url} - params: {params}')
+    async with app.session.get(url, params=params) as resp:
+        return await resp.json()
+
+
+# The active images with what the pages show, synced with the changes to
+# the images of the API
+catalog = Catalog(
+    _fetch_images,
+    ('Name', 'URL', 'Sol'),
+    overlap=app.config['CATALOG_OVERLAP'],
+)
+
+
 @services.route('/images', methods=['GET'])
 async def get_images() -> Tuple[Response, int]:
-    params = {'Active': 'true'}
-    rcache = await get_rcache()
-    image_cache = ImageCache(rcache)
+    try:
+        limit = int(request.args.get('limit', app.config['IMAGES_PAGE']))
+        cursor = request.args.get('cursor')
+        after = None if cursor is None else int(cursor)
+    except ValueError:
+        logger.exception('Invalid limit or cursor')
+        return jsonify(data=[], next=None), 400
+    if limit < 1:
+        logger.error(f'Invalid limit {limit}')
+        return jsonify(data=[], next=None), 400
+    # Larger pages are cut short, the cursor gets the rest
+    limit = min(limit, app.config['IMAGES_PAGE_MAX'])
+    image_cache = await get_image_cache()
 
     async def is_cached(im):
-        im['cached'] = await image_cache.exists(im['Name'])
-        return im
+        # The catalog's images are shared so the image is copied
+        return dict(im, cached=await image_cache.exists(im['Name']))
 
-    api_url = f'{API_URL}/images'
-    logger.info('GET api_url')
-    async with app.session.get(api_url, params=params) as resp:
-        data = await resp.json()
-        data = await asyncio.gather(*[is_cached(im) for im in data])
-        data = list(sorted(data, key=lambda im: im['ID'], reverse=True))
-        status_code = resp.status
-    return jsonify(data=data), status_code
+    try:
+        await catalog.sync()
+    except aiohttp.ClientResponseError as err:
+        logger.exception('Failed getting images')
+        return jsonify(data=[], next=None), err.status
+    # Newest images first, a page at a time. Product IDs start with the sol,
+    # camera and sequence so a name prefix finds related images
+    images, next_ID = catalog.page(limit, after, request.args.get('name'))
+    data = await asyncio.gather(*[is_cached(im) for im in images])
+    next_cursor = None if next_ID is None else str(next_ID)
+    return jsonify(data=data, next=next_cursor), 200
+
+
+async def _fill_image(job: IngestJob) -> None:
+    image_cache = await get_image_cache()
+    if await image_cache.exists(job.name):
+        return
+    logger.info(f'Cacheing Image: {job.name}')
+    progress_cache = ProgressCache(await get_backend())
+    try:
+        image = await PDSImage.from_url(
+            url=job.url,
+            session=app.session,
+            progress=(progress_cache, job.ID),
+        )
+        image_cache = await get_image_cache('data')
+        await image_cache.set(job.name, image)
+    except Exception:
+        # Watchers of the progress stop waiting for an image never cached
+        await progress_cache.finish(job.ID, failed=True)
+        raise
+    await _store_metadata(job.name, await image.metadata)
+
+
+async def _store_metadata(name: str, metadata: Dict[str, Any]) -> None:
+    # The image stays cached if the API cannot store the values of its label
+    if not metadata:
+        return
+    url = f'{API_URL}/images/bulk'
+    logger.info(f'PUT {url} - {name}: {json.dumps(metadata)}')
+    try:
+        async with app.session.put(url, params={'Name': name},
+                                   json=metadata) as resp:
+            await resp.read()
+    except aiohttp.ClientError:
+        logger.exception(f'Failed storing the label metadata of {name}')
+
+
+async def ingest_image(job: IngestJob) -> None:
+    requeued = False
+    try:
+        await image_fills.do(job.name, partial(_fill_image, job))
+    except asyncio.CancelledError:
+        # Cancelled jobs go back to the queue so they keep their lease for
+        # the worker that finishes them
+        requeued = True
+        raise
+    finally:
+        if job.lease is not None and not requeued:
+            backend = await get_backend()
+            await Lease(backend, job.name, token=job.lease).release()
 
 
 @services.route('/cache_image', methods=['POST'])
 async def cache_image() -> Tuple[Response, int]:
-    rcache = await get_rcache()
-    image_cache = ImageCache(rcache)
+    image_cache = await get_image_cache()
     data = await request.get_json()
     url = data['url']
     name = data['name']
+    priority = data.get('priority', 'normal')
+    if priority not in PRIORITIES:
+        return jsonify({'error': f'priority must be one of {PRIORITIES}'}), 400
     if await image_cache.exists(name):
         return jsonify({'data': 'finished'}), 200
-    else:
-        logger.info(f'Cacheing Image: {name}')
-        progress_cache = ProgressCache(rcache)
-        image = await PDSImage.from_url(
-            url=url,
-            session=app.session,
-            progress=(progress_cache, name),
-        )
-        await image_cache.set(name, image)
-        return jsonify({'data': 'finished'}), 200
+    lease = Lease(await get_backend(), name, app.config['INGEST_LEASE'])
+    if not await lease.acquire():
+        # Another request is already caching the image, follow its progress
+        return jsonify({'data': {'job': name, 'status': 'in_progress'}}), 202
+    # Progress is reported under the job ID
+    job = IngestJob(
+        ID=name,
+        url=url,
+        name=name,
+        priority=priority,
+        lease=lease.token,
+    )
+    try:
+        await app.ingest.put(job)
+    except Exception:
+        await lease.release()
+        raise
+    return jsonify({'data': {'job': job.ID, 'status': 'queued'}}), 202
 
 
 @services.route('/display_image', methods=['GET'])
 async def display_image() -> Response:
-    rcache = await get_rcache()
-    image_cache = ImageCache(rcache)
+    image_cache = await get_image_cache('data')
     url = request.args['url']
     name = posixpath.basename(url)
     logger.info(f'Displaying Image: {name}')
-    image = await image_cache.get(name)
+    image = await image_cache.get(name, label=False)
     cache_future = image_cache.set_time(name)
     png_output = await image.get_png_output()
     response = await make_response(png_output.getvalue())
@@ -211,13 +390,78 @@ async def display_image() -> Response:
 
 @services.route('/progress', methods=['POST'])
 async def get_progress():
-    rcache = await get_rcache()
+    backend = await get_backend()
     data = await request.get_json()
     ID = data['ID']
-    progress_cache = ProgressCache(rcache)
+    progress_cache = ProgressCache(backend)
     progress = await progress_cache.get(str(ID))
     logger.info(f'Progress: {ID}: {progress * 100}%')
     return jsonify({'data': progress})
 
 
+def _sse(event: str, data: Any) -> bytes:
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'.encode()
+
+
+def _progress_event(ID: str, record: Progress) -> bytes:
+    return _sse('progress', dict(record.to_dict(), ID=ID))
+
+
+async def _progress_events(IDs: List[str]) -> AsyncIterator[bytes]:
+    progress_cache = ProgressCache(await get_backend())
+    done = set()
+
+    def events(ID: str, record: Progress) -> Iterator[bytes]:
+        yield _progress_event(ID, record)
+        # Failed downloads never finish so they end their part of the stream
+        if record.failed:
+            yield _sse('failed', {'ID': ID})
+        if record.finished or record.failed:
+            done.add(ID)
+
+    # Subscribe before reading the current progress so no update is lost
+    async with progress_cache.subscribe(IDs) as updates:
+        records = await asyncio.gather(
+            *[progress_cache.get_record(ID) for ID in IDs]
+        )
+        for ID, record in zip(IDs, records):
+            if record is None:
+                continue
+            for event in events(ID, record):
+                yield event
+        while len(done) < len(IDs):
+            try:
+                ID, record = await asyncio.wait_for(
+                    updates.get(),
+                    SSE_KEEPALIVE,
+                )
+            except asyncio.TimeoutError:
+                yield b': keepalive\n\n'
+                continue
+            for event in events(ID, record):
+                yield event
+        yield _sse('done', IDs)
+
+
+@services.route('/progress/stream', methods=['GET'])
+async def stream_progress() -> Tuple[Response, int]:
+    IDs = list(dict.fromkeys(request.args.getlist('id')))
+    if not IDs:
+        return jsonify({'error': 'at least one id is required'}), 400
+    response = await make_response(_progress_events(IDs))
+    response.headers['Content-Type'] = 'text/event-stream'
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    # The stream stays open until every download finishes or fails
+    response.timeout = None
+    return response, 200
+
+
+@services.route('/metrics', methods=['GET'])
+async def get_metrics() -> Response:
+    response = await make_response(metrics.render())
+    response.headers['Content-Type'] = metrics.CONTENT_TYPE
+    return response
+
+
 app.register_blueprint(services, url_prefix='/services')
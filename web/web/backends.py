@@ -0,0 +1,1216 @@
+import os
+import abc
+import time
+import fcntl
+import shutil
+import struct
+import asyncio
+import logging
+import tempfile
+import contextlib
+from functools import partial
+from urllib.parse import quote, unquote
+from typing import (
+    Any,
+    Set,
+    Dict,
+    List,
+    Tuple,
+    Union,
+    Callable,
+    Iterator,
+    ContextManager,
+    Optional,
+    Awaitable,
+)
+
+import aioredis
+import numpy as np  # type: ignore
+from aioredis.pubsub import Receiver  # type: ignore
+
+from web import metrics
+
+logger = logging.getLogger(__name__)
+
+Value = Union[bytes, str, int, float]
+Shape = Tuple[int, ...]
+
+
+def _to_bytes(value: Value) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode()
+
+
+class Subscription(abc.ABC):
+    """Messages published on a set of channels
+
+    Get one from :meth:`CacheBackend.open_subscription` and call
+    :meth:`close` when done with it.
+    """
+
+    @abc.abstractmethod
+    async def subscribe(self, *channels: str) -> None:
+        """Start receiving the messages published on the channels"""
+
+    @abc.abstractmethod
+    async def unsubscribe(self, *channels: str) -> None:
+        """Stop receiving the messages published on the channels"""
+
+    @abc.abstractmethod
+    async def get(self) -> Tuple[str, bytes]:
+        """Wait for the next message as a ``(channel, message)`` pair"""
+
+    @abc.abstractmethod
+    async def close(self) -> None:
+        """Unsubscribe from every channel and release the subscription"""
+
+
+class RedisSubscription(Subscription):
+    """Subscription to redis channels
+
+    Parameters
+    ----------
+    rcache : :class:`aioredis.Redis`
+        A connection used only for this subscription. It is closed with the
+        subscription
+    """
+
+    def __init__(self, rcache: aioredis.Redis):
+        self.rcache = rcache
+        self._receiver = Receiver(on_close=self._on_close)
+
+    def _on_close(self, channel: Any, exc: Optional[Exception] = None) -> None:
+        # Channels are closed when unsubscribed, only stop receiving when
+        # the connection is lost
+        if exc is not None:
+            self._receiver.stop()
+
+    async def subscribe(self, *channels: str) -> None:
+        if channels:
+            await self.rcache.subscribe(
+                *[self._receiver.channel(c) for c in channels]
+            )
+
+    async def unsubscribe(self, *channels: str) -> None:
+        if channels:
+            await self.rcache.unsubscribe(*channels)
+
+    async def get(self) -> Tuple[str, bytes]:
+        try:
+            item = await self._receiver.get()
+        except aioredis.ChannelClosedError:
+            item = None
+        if item is None:
+            raise ConnectionError('The redis subscription was closed')
+        channel, message = item
+        return channel.name.decode(), message
+
+    async def close(self) -> None:
+        self._receiver.stop()
+        self.rcache.close()
+        await self.rcache.wait_closed()
+
+
+class LocalSubscription(Subscription):
+    """Subscription to channels of a :class:`LocalPubSub`"""
+
+    def __init__(self, pubsub: 'LocalPubSub'):
+        self._pubsub = pubsub
+        self._channels: Set[str] = set()
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+    def put(self, channel: str, message: bytes) -> None:
+        self._queue.put_nowait((channel, message))
+
+    async def subscribe(self, *channels: str) -> None:
+        for channel in channels:
+            self._pubsub.subscribers.setdefault(channel, set()).add(self)
+            self._channels.add(channel)
+
+    async def unsubscribe(self, *channels: str) -> None:
+        for channel in channels:
+            subscribers = self._pubsub.subscribers.get(channel, set())
+            subscribers.discard(self)
+            if not subscribers:
+                self._pubsub.subscribers.pop(channel, None)
+            self._channels.discard(channel)
+
+    async def get(self) -> Tuple[str, bytes]:
+        return await self._queue.get()
+
+    async def close(self) -> None:
+        await self.unsubscribe(*list(self._channels))
+
+
+class LocalPubSub:
+    """Publish and subscribe within the current process"""
+
+    def __init__(self):
+        self.subscribers: Dict[str, Set[LocalSubscription]] = {}
+
+    async def publish(self, channel: str, message: Value) -> None:
+        message = _to_bytes(message)
+        for subscription in list(self.subscribers.get(channel, ())):
+            subscription.put(channel, message)
+
+    async def open_subscription(self) -> Subscription:
+        return LocalSubscription(self)
+
+
+class SharedSubscription:
+    """A single subscription fanned out to any number of watchers
+
+    Watchers register a queue for the channels they want and the messages
+    are copied into every queue watching their channel. Redis only sees one
+    subscription however many watchers there are. If the subscription fails
+    a new one is opened for the channels still watched.
+
+    Parameters
+    ----------
+    backend : :class:`CacheBackend`
+        The backend to open the subscription with
+    """
+
+    RETRY = 1
+
+    def __init__(self, backend: 'CacheBackend'):
+        self._backend = backend
+        self._subscription: Optional[Subscription] = None
+        self._watchers: Dict[str, Set[asyncio.Queue]] = {}
+        self._reader: Optional[asyncio.Future] = None
+        self._lock = asyncio.Lock()
+
+    async def _open(self) -> Subscription:
+        if self._subscription is None:
+            self._subscription = await self._backend.open_subscription()
+            self._reader = asyncio.ensure_future(self._read())
+        return self._subscription
+
+    async def add(self, queue: asyncio.Queue, *channels: str) -> None:
+        """Put the messages published on the channels in a queue
+
+        Parameters
+        ----------
+        queue : :class:`asyncio.Queue`
+            Receives ``(channel, message)`` pairs
+        channels : :obj:`str`
+            The channels to watch
+        """
+        async with self._lock:
+            subscription = await self._open()
+            new = [c for c in channels if c not in self._watchers]
+            for channel in channels:
+                self._watchers.setdefault(channel, set()).add(queue)
+            await subscription.subscribe(*new)
+
+    async def remove(self, queue: asyncio.Queue, *channels: str) -> None:
+        """Stop putting the messages published on the channels in a queue
+
+        Parameters
+        ----------
+        queue : :class:`asyncio.Queue`
+            The queue passed to :meth:`add`
+        channels : :obj:`str`
+            The channels to stop watching
+        """
+        async with self._lock:
+            unused = []
+            for channel in channels:
+                watchers = self._watchers.get(channel, set())
+                watchers.discard(queue)
+                if not watchers and channel in self._watchers:
+                    del self._watchers[channel]
+                    unused.append(channel)
+            if self._subscription is not None:
+                await self._subscription.unsubscribe(*unused)
+
+    async def _read(self) -> None:
+        while True:
+            try:
+                channel, message = await self._subscription.get()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Lost the shared subscription, reopening')
+                await self._reopen()
+                continue
+            for queue in self._watchers.get(channel, ()):
+                queue.put_nowait((channel, message))
+
+    async def _reopen(self) -> None:
+        async with self._lock:
+            try:
+                await self._subscription.close()
+            except Exception:
+                logger.exception('Failed closing the shared subscription')
+            while True:
+                await asyncio.sleep(self.RETRY)
+                try:
+                    subscription = await self._backend.open_subscription()
+                    await subscription.subscribe(*self._watchers)
+                except Exception:
+                    logger.exception('Failed reopening the subscription')
+                    continue
+                self._subscription = subscription
+                return
+
+    async def close(self) -> None:
+        """Stop reading messages and close the subscription"""
+        async with self._lock:
+            if self._reader is not None:
+                self._reader.cancel()
+                await asyncio.gather(self._reader, return_exceptions=True)
+                self._reader = None
+            if self._subscription is not None:
+                await self._subscription.close()
+                self._subscription = None
+            self._watchers.clear()
+
+
+_SHARED_SUBSCRIPTIONS: Dict[Any, SharedSubscription] = {}
+
+
+async def close_shared_subscriptions() -> None:
+    """Close the subscriptions shared by the backends"""
+    while _SHARED_SUBSCRIPTIONS:
+        _, shared = _SHARED_SUBSCRIPTIONS.popitem()
+        await shared.close()
+
+
+class CacheBackend(abc.ABC):
+    """Storage used by the cache interfaces in :mod:`web.redis_cache`
+
+    The methods mirror the subset of redis commands the caches need so the
+    redis backend is a thin wrapper. Arrays get their own methods so a
+    backend can store them in a native format.
+    """
+
+    @abc.abstractmethod
+    async def hexists(self, name: str, field: str) -> bool:
+        """Determine if a field exists in a hash"""
+
+    @abc.abstractmethod
+    async def hkeys(self, name: str) -> List[bytes]:
+        """Get the fields in a hash"""
+
+    @abc.abstractmethod
+    async def hget(self, name: str, field: str) -> Optional[bytes]:
+        """Get the value of a field in a hash, ``None`` if it is missing"""
+
+    async def hmget(self, name: str, *fields: str) -> List[Optional[bytes]]:
+        """Get the values of several fields in a hash"""
+        return list(
+            await asyncio.gather(*[self.hget(name, f) for f in fields])
+        )
+
+    @abc.abstractmethod
+    async def hset(self, name: str, field: str, value: Value) -> None:
+        """Set the value of a field in a hash"""
+
+    async def hmset_dict(self, name: str, values: Dict[str, Value]) -> None:
+        """Set the values of several fields in a hash"""
+        await asyncio.gather(
+            *[self.hset(name, f, v) for f, v in values.items()]
+        )
+
+    @abc.abstractmethod
+    async def hincrby(self, name: str, field: str, amount: int = 1) -> int:
+        """Add to the integer value of a field in a hash atomically
+
+        A missing field counts as ``0``. Returns the new value
+        """
+
+    @abc.abstractmethod
+    async def hupdate(self, name: str, values: Dict[str, Value],
+                      increments: Dict[str, int], expire: int = 0,
+                      create: bool = True) -> Optional[Dict[bytes, bytes]]:
+        """Update a hash atomically and get every field of it
+
+        The ``increments`` are added to integer fields like :meth:`hincrby`
+        and the ``values`` are set. The hash expires after ``expire`` seconds
+        if given. A missing hash is left alone when ``create`` is false and
+        ``None`` is returned
+        """
+
+    async def hgetall(self, name: str) -> Dict[bytes, bytes]:
+        """Get every field of a hash with its value"""
+        fields = await self.hkeys(name)
+        if not fields:
+            return {}
+        values = await self.hmget(name, *[f.decode() for f in fields])
+        return {
+            field: value
+            for field, value in zip(fields, values)
+            if value is not None
+        }
+
+    @abc.abstractmethod
+    async def hdel(self, name: str, *fields: str) -> None:
+        """Delete fields from a hash"""
+
+    @abc.abstractmethod
+    async def delete(self, key: str) -> None:
+        """Delete a key or a whole hash"""
+
+    @abc.abstractmethod
+    async def get(self, key: str) -> Optional[bytes]:
+        """Get the value of a key, ``None`` if it is missing or expired"""
+
+    @abc.abstractmethod
+    async def set(self, key: str, value: Value, expire: int = 0) -> None:
+        """Set the value of a key that expires after ``expire`` seconds"""
+
+    @abc.abstractmethod
+    async def exists(self, key: str) -> bool:
+        """Determine if a key or hash exists"""
+
+    @abc.abstractmethod
+    async def expire(self, key: str, seconds: int) -> None:
+        """Delete a key or a whole hash after ``seconds``"""
+
+    @abc.abstractmethod
+    async def set_if_not_exists(self, key: str, value: Value,
+                                expire: int = 0) -> bool:
+        """Set the value of a key only if it does not exist
+
+        Returns whether or not the key was set
+        """
+
+    @abc.abstractmethod
+    async def delete_if_equals(self, key: str, value: Value) -> bool:
+        """Delete a key only if it has the given value
+
+        Returns whether or not the key was deleted
+        """
+
+    async def set_arrays(self, name: str,
+                         arrays: Dict[str, np.ndarray]) -> None:
+        """Store arrays as fields in a hash
+
+        The dtype and shape are not stored and must be passed back to
+        :meth:`get_arrays`
+        """
+        await self.hmset_dict(
+            name,
+            {field: array.tobytes() for field, array in arrays.items()},
+        )
+
+    async def get_arrays(self, name: str, fields: List[str],
+                         dtype: np.dtype,
+                         shapes: List[Shape]) -> List[Optional[np.ndarray]]:
+        """Get arrays stored with :meth:`set_arrays`
+
+        The arrays may be read only views, copy them before modifying
+        """
+        arrays: List[Optional[np.ndarray]] = []
+        buffers = await self.hmget(name, *fields)
+        for buffer, shape in zip(buffers, shapes):
+            if buffer is None:
+                arrays.append(None)
+            else:
+                arrays.append(np.frombuffer(buffer, dtype).reshape(shape))
+        return arrays
+
+    @abc.abstractmethod
+    async def publish(self, channel: str, message: Value) -> None:
+        """Send a message to the subscribers of a channel"""
+
+    @abc.abstractmethod
+    async def open_subscription(self) -> Subscription:
+        """Get a new subscription to receive published messages"""
+
+    def _shared_key(self) -> Any:
+        return self
+
+    async def shared_subscription(self) -> SharedSubscription:
+        """Get the subscription shared by every watcher in this process
+
+        Backends storing in the same place share the same subscription
+        """
+        key = self._shared_key()
+        if key not in _SHARED_SUBSCRIPTIONS:
+            _SHARED_SUBSCRIPTIONS[key] = SharedSubscription(self)
+        return _SHARED_SUBSCRIPTIONS[key]
+
+    async def close(self) -> None:
+        """Release any resources held by the backend"""
+
+
+class RedisBackend(CacheBackend):
+    """Backend storing everything in redis
+
+    Parameters
+    ----------
+    rcache : :class:`aioredis.Redis`
+        Connected redis instance
+    """
+
+    _DELETE_IF_EQUALS = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+    # ARGV is create, expire, the number of increments, then the increments
+    # and the values as field and value pairs
+    _HUPDATE = """
+if ARGV[1] == '0' and redis.call('exists', KEYS[1]) == 0 then
+    return false
+end
+local increments = 4 + 2 * tonumber(ARGV[3])
+for i = 4, increments - 1, 2 do
+    redis.call('hincrby', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+for i = increments, #ARGV, 2 do
+    redis.call('hset', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+if ARGV[2] ~= '0' then
+    redis.call('expire', KEYS[1], ARGV[2])
+end
+return redis.call('hgetall', KEYS[1])
+"""
+
+    def __init__(self, rcache: aioredis.Redis):
+        self.rcache = rcache
+
+    async def hexists(self, name: str, field: str) -> bool:
+        return bool(await self.rcache.hexists(name, field))
+
+    async def hkeys(self, name: str) -> List[bytes]:
+        return await self.rcache.hkeys(name)
+
+    async def hget(self, name: str, field: str) -> Optional[bytes]:
+        return await self.rcache.hget(name, field)
+
+    async def hmget(self, name: str, *fields: str) -> List[Optional[bytes]]:
+        return await self.rcache.hmget(name, *fields)
+
+    async def hset(self, name: str, field: str, value: Value) -> None:
+        await self.rcache.hset(name, field, value)
+
+    async def hmset_dict(self, name: str, values: Dict[str, Value]) -> None:
+        await self.rcache.hmset_dict(name, values)
+
+    async def hincrby(self, name: str, field: str, amount: int = 1) -> int:
+        return await self.rcache.hincrby(name, field, amount)
+
+    async def hupdate(self, name: str, values: Dict[str, Value],
+                      increments: Dict[str, int], expire: int = 0,
+                      create: bool = True) -> Optional[Dict[bytes, bytes]]:
+        args: List[Value] = [int(create), expire, len(increments)]
+        for items in (increments, values):
+            for field, value in items.items():
+                args.extend([field, value])
+        fields = await self.rcache.eval(
+            self._HUPDATE,
+            keys=[name],
+            args=args,
+        )
+        if fields is None:
+            return None
+        return dict(zip(fields[::2], fields[1::2]))
+
+    async def hgetall(self, name: str) -> Dict[bytes, bytes]:
+        return await self.rcache.hgetall(name)
+
+    async def hdel(self, name: str, *fields: str) -> None:
+        await self.rcache.hdel(name, *fields)
+
+    async def delete(self, key: str) -> None:
+        await self.rcache.delete(key)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.rcache.get(key)
+
+    async def set(self, key: str, value: Value, expire: int = 0) -> None:
+        await self.rcache.set(key, value, expire=expire)
+
+    async def exists(self, key: str) -> bool:
+        return bool(await self.rcache.exists(key))
+
+    async def expire(self, key: str, seconds: int) -> None:
+        await self.rcache.expire(key, seconds)
+
+    async def set_if_not_exists(self, key: str, value: Value,
+                                expire: int = 0) -> bool:
+        return bool(
+            await self.rcache.set(
+                key,
+                value,
+                expire=expire,
+                exist=self.rcache.SET_IF_NOT_EXIST,
+            )
+        )
+
+    async def delete_if_equals(self, key: str, value: Value) -> bool:
+        deleted = await self.rcache.eval(
+            self._DELETE_IF_EQUALS,
+            keys=[key],
+            args=[value],
+        )
+        return bool(deleted)
+
+    async def publish(self, channel: str, message: Value) -> None:
+        await self.rcache.publish(channel, message)
+
+    async def open_subscription(self) -> Subscription:
+        # A subscribed connection cannot run other commands so it must not
+        # come from a pool
+        rcache = await aioredis.create_redis(self.rcache.address)
+        return RedisSubscription(rcache)
+
+    def _shared_key(self) -> Any:
+        return ('redis', self.rcache.address)
+
+
+class MemoryBackend(CacheBackend):
+    """Backend storing everything in the memory of the current process
+
+    Useful for tests and single process deployments. Nothing is shared
+    between workers.
+    """
+
+    def __init__(self):
+        self._hashes: Dict[str, Dict[str, Any]] = {}
+        self._expires: Dict[str, float] = {}
+        self._keys: Dict[str, Tuple[bytes, float]] = {}
+        self._pubsub = LocalPubSub()
+
+    def _hash(self, name: str, create: bool = False) -> Dict[str, Any]:
+        # Expired hashes are removed when they are next used
+        expires = self._expires.get(name)
+        if expires is not None and expires < time.time():
+            self._hashes.pop(name, None)
+            del self._expires[name]
+        if create:
+            return self._hashes.setdefault(name, {})
+        return self._hashes.get(name, {})
+
+    async def hexists(self, name: str, field: str) -> bool:
+        return field in self._hash(name)
+
+    async def hkeys(self, name: str) -> List[bytes]:
+        return [field.encode() for field in self._hash(name)]
+
+    async def hget(self, name: str, field: str) -> Optional[bytes]:
+        value = self._hash(name).get(field)
+        if isinstance(value, np.ndarray):
+            return value.tobytes()
+        return value
+
+    async def hset(self, name: str, field: str, value: Value) -> None:
+        self._hash(name, create=True)[field] = _to_bytes(value)
+
+    async def hincrby(self, name: str, field: str, amount: int = 1) -> int:
+        hash_ = self._hash(name, create=True)
+        value = int(hash_.get(field, 0)) + amount
+        hash_[field] = _to_bytes(value)
+        return value
+
+    async def hupdate(self, name: str, values: Dict[str, Value],
+                      increments: Dict[str, int], expire: int = 0,
+                      create: bool = True) -> Optional[Dict[bytes, bytes]]:
+        if not create and not self._hash(name):
+            return None
+        hash_ = self._hash(name, create=True)
+        for field, amount in increments.items():
+            hash_[field] = _to_bytes(int(hash_.get(field, 0)) + amount)
+        for field, value in values.items():
+            hash_[field] = _to_bytes(value)
+        if expire:
+            self._expires[name] = time.time() + expire
+        return {
+            field.encode(): value.tobytes()
+            if isinstance(value, np.ndarray) else value
+            for field, value in hash_.items()
+        }
+
+    async def hdel(self, name: str, *fields: str) -> None:
+        hash_ = self._hash(name)
+        for field in fields:
+            hash_.pop(field, None)
+        if not hash_:
+            self._hashes.pop(name, None)
+            self._expires.pop(name, None)
+
+    async def delete(self, key: str) -> None:
+        self._hashes.pop(key, None)
+        self._expires.pop(key, None)
+        self._keys.pop(key, None)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        value, expires = self._keys.get(key, (None, 0.0))
+        if expires and expires < time.time():
+            del self._keys[key]
+            return None
+        return value
+
+    async def set(self, key: str, value: Value, expire: int = 0) -> None:
+        expires = time.time() + expire if expire else 0.0
+        self._keys[key] = (_to_bytes(value), expires)
+
+    async def exists(self, key: str) -> bool:
+        return bool(self._hash(key)) or await self.get(key) is not None
+
+    async def expire(self, key: str, seconds: int) -> None:
+        expires = time.time() + seconds
+        if self._hash(key):
+            self._expires[key] = expires
+        else:
+            value = await self.get(key)
+            if value is not None:
+                self._keys[key] = (value, expires)
+
+    async def set_if_not_exists(self, key: str, value: Value,
+                                expire: int = 0) -> bool:
+        if await self.get(key) is not None:
+            return False
+        await self.set(key, value, expire)
+        return True
+
+    async def delete_if_equals(self, key: str, value: Value) -> bool:
+        if await self.get(key) != _to_bytes(value):
+            return False
+        del self._keys[key]
+        return True
+
+    async def set_arrays(self, name: str,
+                         arrays: Dict[str, np.ndarray]) -> None:
+        hash_ = self._hash(name, create=True)
+        for field, array in arrays.items():
+            array = array.copy()
+            array.flags.writeable = False
+            hash_[field] = array
+
+    async def get_arrays(self, name: str, fields: List[str],
+                         dtype: np.dtype,
+                         shapes: List[Shape]) -> List[Optional[np.ndarray]]:
+        hash_ = self._hash(name)
+        arrays: List[Optional[np.ndarray]] = []
+        for field, shape in zip(fields, shapes):
+            value = hash_.get(field)
+            if isinstance(value, bytes):
+                value = np.frombuffer(value, dtype).reshape(shape)
+            arrays.append(value)
+        return arrays
+
+    async def publish(self, channel: str, message: Value) -> None:
+        await self._pubsub.publish(channel, message)
+
+    async def open_subscription(self) -> Subscription:
+        return await self._pubsub.open_subscription()
+
+
+class FilesystemBackend(CacheBackend):
+    """Backend storing everything as files in a local directory
+
+    Each hash is a directory with a file per field. Arrays are written as
+    ``.npy`` files and read back with memory mapping so only the parts of
+    an image that are used are read from disk. Every file operation runs in
+    the executor so the event loop is never blocked. Increments lock the
+    hash directory and the updates of keys that depend on their current
+    value share a lock file, so they are atomic across processes. Published
+    messages only reach subscribers in the current process.
+
+    Parameters
+    ----------
+    root : :obj:`str`
+        The directory to store the cache in. Created if it does not exist
+    """
+
+    _BYTES = '.bin'
+    _ARRAY = '.npy'
+    _KEYS = '_keys'
+    _EXPIRES = struct.Struct('>d')
+    # Files in a hash directory that are not fields
+    _HASH_EXPIRES = '.expires'
+    _HASH_LOCK = '.lock'
+    # Lock of the keys for the updates that depend on their current value
+    _KEYS_LOCK = '_keys.lock'
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(os.path.join(root, self._KEYS), exist_ok=True)
+        self._pubsub = LocalPubSub()
+
+    async def _run(self, func: Callable[..., Any], *args: Any) -> Any:
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, partial(func, *args))
+
+    def _hash_dir(self, name: str) -> str:
+        return os.path.join(self.root, quote(name, safe=''))
+
+    def _path(self, name: str, field: str, suffix: str) -> str:
+        return os.path.join(
+            self._hash_dir(name),
+            quote(field, safe='') + suffix,
+        )
+
+    def _key_path(self, key: str) -> str:
+        return os.path.join(self.root, self._KEYS, quote(key, safe=''))
+
+    @staticmethod
+    def _temp_file(path: str) -> Tuple[int, str]:
+        # Unique to each write, so concurrent writers of the same path in
+        # one process never share a temporary file
+        return tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+
+    @classmethod
+    def _write(cls, path: str, content: bytes) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so readers never see partial data
+        fd, tmp_path = cls._temp_file(path)
+        with os.fdopen(fd, 'wb') as stream:
+            stream.write(content)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _read(path: str) -> Optional[bytes]:
+        try:
+            with open(path, 'rb') as stream:
+                return stream.read()
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _load(path: str) -> Optional[np.ndarray]:
+        try:
+            return np.load(path, mmap_mode='r')
+        except FileNotFoundError:
+            return None
+
+    @classmethod
+    def _read_array(cls, path: str) -> Optional[bytes]:
+        array = cls._load(path)
+        return None if array is None else array.tobytes()
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    @contextlib.contextmanager
+    def _lock_file(self, path: str) -> Iterator[None]:
+        with open(path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _lock(self, name: str) -> ContextManager[None]:
+        os.makedirs(self._hash_dir(name), exist_ok=True)
+        return self._lock_file(
+            os.path.join(self._hash_dir(name), self._HASH_LOCK)
+        )
+
+    def _lock_keys(self) -> ContextManager[None]:
+        return self._lock_file(os.path.join(self.root, self._KEYS_LOCK))
+
+    # The methods below are blocking and only run in the executor
+
+    def _purge(self, name: str) -> None:
+        # Expired hashes are removed when they are next used
+        content = self._read(
+            os.path.join(self._hash_dir(name), self._HASH_EXPIRES)
+        )
+        if content is not None:
+            expires, = self._EXPIRES.unpack(content)
+            if expires < time.time():
+                shutil.rmtree(self._hash_dir(name), ignore_errors=True)
+
+    def _has_field(self, name: str, field: str) -> bool:
+        self._purge(name)
+        return any(
+            os.path.exists(self._path(name, field, suffix))
+            for suffix in (self._BYTES, self._ARRAY)
+        )
+
+    def _fields(self, name: str) -> List[bytes]:
+        self._purge(name)
+        try:
+            files = os.listdir(self._hash_dir(name))
+        except FileNotFoundError:
+            return []
+        keys = []
+        for filename in files:
+            field, suffix = os.path.splitext(filename)
+            if suffix in (self._BYTES, self._ARRAY):
+                keys.append(unquote(field).encode())
+        return keys
+
+    def _get_field(self, name: str, field: str) -> Optional[bytes]:
+        self._purge(name)
+        value = self._read(self._path(name, field, self._BYTES))
+        if value is None:
+            value = self._read_array(self._path(name, field, self._ARRAY))
+        return value
+
+    def _set_field(self, name: str, field: str, content: bytes) -> None:
+        self._purge(name)
+        self._write(self._path(name, field, self._BYTES), content)
+        self._remove(self._path(name, field, self._ARRAY))
+
+    def _increment(self, name: str, field: str, amount: int) -> int:
+        self._purge(name)
+        path = self._path(name, field, self._BYTES)
+        with self._lock(name):
+            value = int(self._read(path) or 0) + amount
+            self._write(path, _to_bytes(value))
+        return value
+
+    def _read_hash(self, name: str) -> Dict[bytes, bytes]:
+        self._purge(name)
+        try:
+            files = os.listdir(self._hash_dir(name))
+        except FileNotFoundError:
+            return {}
+        fields = {}
+        for filename in files:
+            field, suffix = os.path.splitext(filename)
+            path = os.path.join(self._hash_dir(name), filename)
+            if suffix == self._BYTES:
+                value = self._read(path)
+            elif suffix == self._ARRAY:
+                value = self._read_array(path)
+            else:
+                continue
+            if value is not None:
+                fields[unquote(field).encode()] = value
+        return fields
+
+    def _update(self, name: str, values: Dict[str, Value],
+                increments: Dict[str, int], expire: int,
+                create: bool) -> Optional[Dict[bytes, bytes]]:
+        self._purge(name)
+        if not create and not os.path.isdir(self._hash_dir(name)):
+            return None
+        with self._lock(name):
+            for field, amount in increments.items():
+                path = self._path(name, field, self._BYTES)
+                value = int(self._read(path) or 0) + amount
+                self._write(path, _to_bytes(value))
+            for field, value in values.items():
+                self._write(self._path(name, field, self._BYTES),
+                            _to_bytes(value))
+                self._remove(self._path(name, field, self._ARRAY))
+            if expire:
+                self._write(
+                    os.path.join(self._hash_dir(name), self._HASH_EXPIRES),
+                    self._EXPIRES.pack(time.time() + expire),
+                )
+            return self._read_hash(name)
+
+    def _delete_fields(self, name: str, fields: Tuple[str, ...]) -> None:
+        for field in fields:
+            for suffix in (self._BYTES, self._ARRAY):
+                self._remove(self._path(name, field, suffix))
+
+    def _delete(self, key: str) -> None:
+        shutil.rmtree(self._hash_dir(key), ignore_errors=True)
+        self._remove(self._key_path(key))
+
+    def _read_key(self, key: str) -> Tuple[Optional[bytes], bool]:
+        # The value of a key and whether it is an expired key left on disk
+        content = self._read(self._key_path(key))
+        if content is None:
+            return None, False
+        expires, = self._EXPIRES.unpack_from(content)
+        if expires and expires < time.time():
+            return None, True
+        return content[self._EXPIRES.size:], False
+
+    def _get_key(self, key: str) -> Optional[bytes]:
+        value, expired = self._read_key(key)
+        if expired:
+            with self._lock_keys():
+                # The key may have been set again since it was read
+                if self._read_key(key)[1]:
+                    self._remove(self._key_path(key))
+        return value
+
+    def _set_key(self, key: str, content: bytes) -> None:
+        with self._lock_keys():
+            self._write(self._key_path(key), content)
+
+    def _exists(self, key: str) -> bool:
+        self._purge(key)
+        if os.path.isdir(self._hash_dir(key)):
+            return True
+        return self._read_key(key)[0] is not None
+
+    def _expire(self, key: str, seconds: int) -> None:
+        expires = self._EXPIRES.pack(time.time() + seconds)
+        self._purge(key)
+        if os.path.isdir(self._hash_dir(key)):
+            path = os.path.join(self._hash_dir(key), self._HASH_EXPIRES)
+            self._write(path, expires)
+            return
+        with self._lock_keys():
+            value, _ = self._read_key(key)
+            if value is not None:
+                self._write(self._key_path(key), expires + value)
+
+    def _set_key_if_not_exists(self, key: str, content: bytes) -> bool:
+        with self._lock_keys():
+            if self._read_key(key)[0] is not None:
+                return False
+            self._write(self._key_path(key), content)
+            return True
+
+    def _delete_key_if_equals(self, key: str, value: bytes) -> bool:
+        with self._lock_keys():
+            if self._read_key(key)[0] != value:
+                return False
+            self._remove(self._key_path(key))
+            return True
+
+    def _save(self, path: str, array: np.ndarray) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = self._temp_file(path)
+        with os.fdopen(fd, 'wb') as stream:
+            np.save(stream, array)
+        os.replace(tmp_path, path)
+
+    def _save_arrays(self, name: str, arrays: Dict[str, np.ndarray]) -> None:
+        self._purge(name)
+        for field, array in arrays.items():
+            self._save(self._path(name, field, self._ARRAY), array)
+            self._remove(self._path(name, field, self._BYTES))
+
+    def _load_arrays(self, name: str,
+                     fields: List[str]) -> List[Optional[np.ndarray]]:
+        self._purge(name)
+        return [
+            self._load(self._path(name, field, self._ARRAY))
+            for field in fields
+        ]
+
+    async def hexists(self, name: str, field: str) -> bool:
+        return await self._run(self._has_field, name, field)
+
+    async def hkeys(self, name: str) -> List[bytes]:
+        return await self._run(self._fields, name)
+
+    async def hget(self, name: str, field: str) -> Optional[bytes]:
+        return await self._run(self._get_field, name, field)
+
+    async def hset(self, name: str, field: str, value: Value) -> None:
+        await self._run(self._set_field, name, field, _to_bytes(value))
+
+    async def hincrby(self, name: str, field: str, amount: int = 1) -> int:
+        return await self._run(self._increment, name, field, amount)
+
+    async def hupdate(self, name: str, values: Dict[str, Value],
+                      increments: Dict[str, int], expire: int = 0,
+                      create: bool = True) -> Optional[Dict[bytes, bytes]]:
+        return await self._run(
+            self._update, name, values, increments, expire, create,
+        )
+
+    async def hgetall(self, name: str) -> Dict[bytes, bytes]:
+        return await self._run(self._read_hash, name)
+
+    async def hdel(self, name: str, *fields: str) -> None:
+        await self._run(self._delete_fields, name, fields)
+
+    async def delete(self, key: str) -> None:
+        await self._run(self._delete, key)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self._run(self._get_key, key)
+
+    async def set(self, key: str, value: Value, expire: int = 0) -> None:
+        expires = time.time() + expire if expire else 0.0
+        content = self._EXPIRES.pack(expires) + _to_bytes(value)
+        await self._run(self._set_key, key, content)
+
+    async def exists(self, key: str) -> bool:
+        return await self._run(self._exists, key)
+
+    async def expire(self, key: str, seconds: int) -> None:
+        await self._run(self._expire, key, seconds)
+
+    async def set_if_not_exists(self, key: str, value: Value,
+                                expire: int = 0) -> bool:
+        expires = time.time() + expire if expire else 0.0
+        content = self._EXPIRES.pack(expires) + _to_bytes(value)
+        return await self._run(self._set_key_if_not_exists, key, content)
+
+    async def delete_if_equals(self, key: str, value: Value) -> bool:
+        return await self._run(
+            self._delete_key_if_equals, key, _to_bytes(value),
+        )
+
+    async def set_arrays(self, name: str,
+                         arrays: Dict[str, np.ndarray]) -> None:
+        await self._run(self._save_arrays, name, arrays)
+
+    async def get_arrays(self, name: str, fields: List[str],
+                         dtype: np.dtype,
+                         shapes: List[Shape]) -> List[Optional[np.ndarray]]:
+        return await self._run(self._load_arrays, name, fields)
+
+    async def publish(self, channel: str, message: Value) -> None:
+        await self._pubsub.publish(channel, message)
+
+    async def open_subscription(self) -> Subscription:
+        return await self._pubsub.open_subscription()
+
+
+def _size(value: Any) -> int:
+    if value is None:
+        return 0
+    elif isinstance(value, np.ndarray):
+        return value.nbytes
+    elif isinstance(value, bytes):
+        return len(value)
+    return len(str(value))
+
+
+class InstrumentedBackend(CacheBackend):
+    """Backend recording metrics for the operations of another backend
+
+    The latency of every operation and the bytes read and written are
+    recorded in :mod:`web.metrics` under the name of the cache.
+
+    Parameters
+    ----------
+    backend : :class:`CacheBackend`
+        The backend doing the work
+    cache : :obj:`str`
+        The name of the cache the metrics are recorded for
+    """
+
+    def __init__(self, backend: CacheBackend, cache: str):
+        self.backend = backend
+        self.cache = cache
+        self._read = (cache, 'read')
+        self._written = (cache, 'written')
+
+    async def _timed(self, operation: str, awaitable: Awaitable) -> Any:
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            metrics.CACHE_SECONDS.observe(
+                (self.cache, operation),
+                time.perf_counter() - start,
+            )
+
+    def _count(self, labels: Tuple[str, str], *values: Any) -> None:
+        size = sum(_size(value) for value in values)
+        if size:
+            metrics.CACHE_BYTES.inc(labels, size)
+
+    async def hexists(self, name: str, field: str) -> bool:
+        return await self._timed('hexists', self.backend.hexists(name, field))
+
+    async def hkeys(self, name: str) -> List[bytes]:
+        return await self._timed('hkeys', self.backend.hkeys(name))
+
+    async def hget(self, name: str, field: str) -> Optional[bytes]:
+        value = await self._timed('hget', self.backend.hget(name, field))
+        self._count(self._read, value)
+        return value
+
+    async def hmget(self, name: str, *fields: str) -> List[Optional[bytes]]:
+        values = await self._timed('hmget', self.backend.hmget(name, *fields))
+        self._count(self._read, *values)
+        return values
+
+    async def hset(self, name: str, field: str, value: Value) -> None:
+        await self._timed('hset', self.backend.hset(name, field, value))
+        self._count(self._written, value)
+
+    async def hmset_dict(self, name: str, values: Dict[str, Value]) -> None:
+        await self._timed('hmset', self.backend.hmset_dict(name, values))
+        self._count(self._written, *values.values())
+
+    async def hincrby(self, name: str, field: str, amount: int = 1) -> int:
+        return await self._timed(
+            'hincrby',
+            self.backend.hincrby(name, field, amount),
+        )
+
+    async def hupdate(self, name: str, values: Dict[str, Value],
+                      increments: Dict[str, int], expire: int = 0,
+                      create: bool = True) -> Optional[Dict[bytes, bytes]]:
+        fields = await self._timed(
+            'hupdate',
+            self.backend.hupdate(name, values, increments, expire, create),
+        )
+        self._count(self._written, *values.values())
+        if fields is not None:
+            self._count(self._read, *fields.values())
+        return fields
+
+    async def hgetall(self, name: str) -> Dict[bytes, bytes]:
+        values = await self._timed('hgetall', self.backend.hgetall(name))
+        self._count(self._read, *values.values())
+        return values
+
+    async def hdel(self, name: str, *fields: str) -> None:
+        await self._timed('hdel', self.backend.hdel(name, *fields))
+
+    async def delete(self, key: str) -> None:
+        await self._timed('delete', self.backend.delete(key))
+
+    async def get(self, key: str) -> Optional[bytes]:
+        value = await self._timed('get', self.backend.get(key))
+        self._count(self._read, value)
+        return value
+
+    async def set(self, key: str, value: Value, expire: int = 0) -> None:
+        await self._timed('set', self.backend.set(key, value, expire))
+        self._count(self._written, value)
+
+    async def exists(self, key: str) -> bool:
+        return await self._timed('exists', self.backend.exists(key))
+
+    async def expire(self, key: str, seconds: int) -> None:
+        await self._timed('expire', self.backend.expire(key, seconds))
+
+    async def set_if_not_exists(self, key: str, value: Value,
+                                expire: int = 0) -> bool:
+        created = await self._timed(
+            'set_if_not_exists',
+            self.backend.set_if_not_exists(key, value, expire),
+        )
+        if created:
+            self._count(self._written, value)
+        return created
+
+    async def delete_if_equals(self, key: str, value: Value) -> bool:
+        return await self._timed(
+            'delete_if_equals',
+            self.backend.delete_if_equals(key, value),
+        )
+
+    async def set_arrays(self, name: str,
+                         arrays: Dict[str, np.ndarray]) -> None:
+        await self._timed('set_arrays', self.backend.set_arrays(name, arrays))
+        self._count(self._written, *arrays.values())
+
+    async def get_arrays(self, name: str, fields: List[str],
+                         dtype: np.dtype,
+                         shapes: List[Shape]) -> List[Optional[np.ndarray]]:
+        arrays = await self._timed(
+            'get_arrays',
+            self.backend.get_arrays(name, fields, dtype, shapes),
+        )
+        self._count(self._read, *arrays)
+        return arrays
+
+    async def publish(self, channel: str, message: Value) -> None:
+        await self._timed('publish', self.backend.publish(channel, message))
+
+    async def open_subscription(self) -> Subscription:
+        return await self.backend.open_subscription()
+
+    async def shared_subscription(self) -> SharedSubscription:
+        return await self.backend.shared_subscription()
+
+    async def close(self) -> None:
+        await self.backend.close()
@@ -0,0 +1,155 @@
+"""Local copy of the image catalog kept in sync with the API
+
+Instead of listing the images through the API on every request, each web
+worker keeps the active images in memory and only gets the images created,
+updated or deleted since its last sync through the ``since`` parameter.
+"""
+import bisect
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import (
+    Any,
+    Dict,
+    List,
+    Tuple,
+    Callable,
+    Optional,
+    Sequence,
+    Awaitable,
+)
+
+logger = logging.getLogger(__name__)
+
+Fetch = Callable[[Dict[str, str]], Awaitable[List[dict]]]
+
+
+class Catalog:
+    """Active items of a collection of the API, synced with its changes
+
+    Items are replaced by their ID so getting a change twice is harmless.
+    Each sync asks for the changes since the latest ``Updated`` time seen
+    minus an overlap, which catches changes committed after a later one.
+
+    Parameters
+    ----------
+    fetch : :obj:`callable`
+        Coroutine function getting the items of the collection with the
+        query string parameters it is called with
+    fields : :obj:`list` of :obj:`str`
+        The fields of the items to keep. The ``ID``, ``Active`` and
+        ``Updated`` fields are always kept to apply the changes
+    overlap : :obj:`float`
+        Seconds of changes asked for again on each sync
+    """
+
+    def __init__(self, fetch: Fetch, fields: Sequence[str],
+                 overlap: float = 5):
+        self._fetch = fetch
+        self.fields = tuple(
+            dict.fromkeys(['ID', *fields, 'Active', 'Updated'])
+        )
+        self.overlap = timedelta(seconds=overlap)
+        self._items: Dict[int, dict] = {}
+        # IDs of the items in ascending order, sorted again after a change
+        self._IDs: Optional[List[int]] = None
+        self._latest: Optional[datetime] = None
+        self._sync: Optional[asyncio.Future] = None
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def params(self) -> Dict[str, str]:
+        """Get the query string parameters of the next sync"""
+        params = {'fields': ','.join(self.fields)}
+        if self._latest is not None:
+            params['since'] = (self._latest - self.overlap).isoformat()
+        return params
+
+    def apply(self, changes: List[dict]) -> None:
+        """Apply items created, updated or deleted in the collection
+
+        Parameters
+        ----------
+        changes : :obj:`list` of :obj:`dict`
+            The changed items, with their ``ID``, ``Active`` and ``Updated``
+            fields
+        """
+        for item in changes:
+            if item['Active']:
+                self._items[item['ID']] = item
+            else:
+                self._items.pop(item['ID'], None)
+            updated = datetime.fromisoformat(item['Updated'])
+            if self._latest is None or updated > self._latest:
+                self._latest = updated
+        if changes:
+            self._IDs = None
+
+    async def _load(self) -> None:
+        changes = await self._fetch(self.params())
+        logger.info(f'Applying {len(changes)} changes to the catalog')
+        self.apply(changes)
+
+    def _sync_done(self, future: asyncio.Future) -> None:
+        if self._sync is future:
+            self._sync = None
+
+    async def sync(self) -> None:
+        """Get and apply the changes since the last sync
+
+        Concurrent callers share the same sync.
+        """
+        if self._sync is None:
+            self._sync = asyncio.ensure_future(self._load())
+            self._sync.add_done_callback(self._sync_done)
+        await asyncio.shield(self._sync)
+
+    def page(self, limit: int, cursor: Optional[int] = None,
+             name: Optional[str] = None) -> Tuple[List[dict], Optional[int]]:
+        """Get a page of the items, newest first
+
+        Parameters
+        ----------
+        limit : :obj:`int`
+            The most items of the page
+        cursor : :obj:`int`, optional
+            Only get the items with an ID lower than the cursor
+        name : :obj:`str`, optional
+            Only get the items with a ``Name`` starting with it
+
+        Returns
+        -------
+        items : :obj:`list` of :obj:`dict`
+            The items of the page. They are shared and must not be modified
+        cursor : :obj:`int` or :obj:`None`
+            The cursor of the next page or :obj:`None` if this is the last
+
+        Raises
+        ------
+        ValueError
+            If the limit is lower than 1
+        """
+        if limit < 1:
+            raise ValueError(f'limit must be at least 1, got {limit}')
+        if self._IDs is None:
+            self._IDs = sorted(self._items)
+        end = len(self._IDs)
+        if cursor is not None:
+            end = bisect.bisect_left(self._IDs, cursor)
+        items: List[Any] = []
+        for index in range(end - 1, -1, -1):
+            item = self._items[self._IDs[index]]
+            if name is not None and not item['Name'].startswith(name):
+                continue
+            if len(items) == limit:
+                return items, items[-1]['ID']
+            items.append(item)
+        return items, None
+
+    def clear(self) -> None:
+        """Drop every item so the next sync gets the whole collection"""
+        self._items.clear()
+        self._IDs = None
+        self._latest = None
+        self._sync = None
@@ -0,0 +1,111 @@
+"""Reuse API responses that did not change
+
+The API tags its collection responses with an ETag. :class:`ETagCache` keeps
+the last body of each request and sends its tag back in ``If-None-Match`` so
+an unchanged collection is answered with an empty ``304 Not Modified``.
+"""
+from typing import Any, Dict, Tuple, Mapping, Optional, NamedTuple
+
+import aiohttp
+
+from web import metrics
+
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+class CachedResponse(NamedTuple):
+    """The parts of a response kept by :class:`ETagCache`"""
+
+    etag: Optional[str]
+    data: Any
+    # Urls of the Link header by relation, such as the next page
+    links: Dict[str, str] = {}
+
+
+class ETagCache:
+    """Last JSON body and ETag of GET requests in the memory of the process
+
+    Bodies are shared between callers and must not be modified.
+
+    Parameters
+    ----------
+    maxsize : :obj:`int`
+        Maximum number of responses kept. The least recently used are
+        dropped first
+    """
+
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        # Dicts keep insertion order, most recently used last
+        self._entries: Dict[Key, CachedResponse] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _key(url: str, params: Optional[Mapping[str, str]]) -> Key:
+        return str(url), tuple(sorted((params or {}).items()))
+
+    def _store(self, key: Key, response: CachedResponse) -> None:
+        self._entries.pop(key, None)
+        if response.etag is None:
+            return
+        self._entries[key] = response
+        while len(self._entries) > self.maxsize:
+            del self._entries[next(iter(self._entries))]
+
+    async def get(self, session: aiohttp.ClientSession, url: str,
+                  params: Optional[Mapping[str, str]] = None
+                  ) -> CachedResponse:
+        """GET a JSON response, reusing the last one if it did not change
+
+        Parameters
+        ----------
+        session : :class:`aiohttp.ClientSession`
+            The session to make the request with
+        url : :obj:`str`
+            The url to get
+        params : :obj:`dict`, optional
+            The query string parameters
+
+        Returns
+        -------
+        response : :class:`CachedResponse`
+            The ETag, decoded JSON body and links of the response
+        """
+        key = self._key(url, params)
+        entry = self._entries.get(key)
+        headers = {}
+        if entry is not None:
+            headers['If-None-Match'] = entry.etag
+        async with session.get(url, params=params, headers=headers) as resp:
+            if resp.status == 304 and entry is not None:
+                metrics.CACHE_LOOKUPS.inc(('ETagCache', 'hit'))
+                self._store(key, entry)
+                return entry
+            metrics.CACHE_LOOKUPS.inc(('ETagCache', 'miss'))
+            response = CachedResponse(
+                etag=resp.headers.get('ETag'),
+                data=await resp.json(),
+                links={
+                    str(rel): str(link['url'])
+                    for rel, link in resp.links.items()
+                },
+            )
+        self._store(key, response)
+        return response
+
+    async def get_json(self, session: aiohttp.ClientSession, url: str,
+                       params: Optional[Mapping[str, str]] = None) -> Any:
+        """GET the body of a JSON response with :meth:`get`
+
+        Returns
+        -------
+        data : :obj:`object`
+            The decoded JSON body
+        """
+        return (await self.get(session, url, params)).data
+
+    def clear(self) -> None:
+        """Drop every response"""
+        self._entries.clear()
@@ -0,0 +1,73 @@
+import os
+
+from web.constants import DOCKER_HOST
+
+
+class Config(object):
+    DEBUG = False
+    TESTING = False
+    ENV = 'dev'
+    # Default for dockertoolbox. Set DOCKER_IP to 127.0.0.1 if not on toolbox
+    REDIS_HOST = os.environ.get('REDIS_HOST', DOCKER_HOST)
+    REDIS_PORT = int(os.environ.get('REDIS_PORT', 6379))
+    # Connection pools for the redis cache. Image payloads go through the
+    # ``data`` pool so they cannot block the small ``control`` requests such
+    # as progress reads and existence checks.
+    REDIS_POOLS = {
+        'control': {
+            'minsize': 1,
+            'maxsize': int(os.environ.get('REDIS_CONTROL_MAXSIZE', 10)),
+            'timeout': 5,
+        },
+        'data': {
+            'minsize': 1,
+            'maxsize': int(os.environ.get('REDIS_DATA_MAXSIZE', 4)),
+            'timeout': 30,
+        },
+        # The ingest queue. Idle workers block a connection waiting for a
+        # job so the other commands of the queue get the second one
+        'queue': {
+            'minsize': 1,
+            'maxsize': 2,
+            'timeout': 5,
+        },
+    }
+    # Storage for the caches: 'redis', 'filesystem' or 'memory'
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'redis')
+    # Directory used by the 'filesystem' backend
+    CACHE_DIR = os.environ.get('CACHE_DIR', '/tmp/opportunity_cache')
+    # Number of lines per hash field when caching images
+    IMAGE_BLOCK_LINES = 64
+    # Format of cached labels: 'json' (fast) or 'pvl' (the label's text)
+    IMAGE_LABEL_FORMAT = os.environ.get('IMAGE_LABEL_FORMAT', 'json')
+    # Images downloaded at the same time by each web worker, in total and
+    # from a single host
+    INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', 4))
+    INGEST_HOST_LIMIT = int(os.environ.get('INGEST_HOST_LIMIT', 2))
+    # Seconds an image stays leased to the worker caching it
+    INGEST_LEASE = int(os.environ.get('INGEST_LEASE', 600))
+    # Seconds cameras and product types are served from the web worker
+    # before being refreshed, and then served stale while refreshing
+    REFERENCE_TTL = int(os.environ.get('REFERENCE_TTL', 60))
+    REFERENCE_MAX_STALE = int(os.environ.get('REFERENCE_MAX_STALE', 600))
+    # Images listed per page unless the request sets a limit
+    IMAGES_PAGE = int(os.environ.get('IMAGES_PAGE', 50))
+    # Most images listed per page, larger limits get this many
+    IMAGES_PAGE_MAX = int(os.environ.get('IMAGES_PAGE_MAX', 1000))
+    # Seconds of changes to the images synced again by the catalog, for the
+    # changes committed after a later one
+    CATALOG_OVERLAP = float(os.environ.get('CATALOG_OVERLAP', 5))
+
+
+class ProductionConfig(Config):
+    DEBUG = False
+    ENV = 'production'
+
+
+class DevelopmentConfig(Config):
+    DEVELOPMENT = True
+    DEBUG = True
+
+
+class TestingConfig(Config):
+    TESTING = True
@@ -0,0 +1,358 @@
+import abc
+import json
+import uuid
+import asyncio
+import logging
+import itertools
+from urllib.parse import urlsplit
+from typing import (
+    Any,
+    Set,
+    Dict,
+    Tuple,
+    Callable,
+    Optional,
+    Awaitable,
+    NamedTuple,
+)
+
+import aioredis
+
+from web import redis_cache
+
+logger = logging.getLogger(__name__)
+
+PRIORITIES = ('high', 'normal', 'low')
+
+
+class IngestJob(NamedTuple):
+    """A request to download an image into the cache
+
+    The ID is also the ID the download's progress is reported under. The
+    lease is the token of the :class:`web.singleflight.Lease` taken for the
+    image when the job was queued.
+    """
+
+    ID: str
+    url: str
+    name: str
+    priority: str = 'normal'
+    lease: Optional[str] = None
+
+    @property
+    def host(self) -> str:
+        """:obj:`str` : The host the image is downloaded from"""
+        return urlsplit(self.url).netloc
+
+    def dumps(self) -> str:
+        return json.dumps(self._asdict())
+
+    @classmethod
+    def loads(cls, data: bytes) -> 'IngestJob':
+        return cls(**json.loads(data))
+
+
+class JobQueue(abc.ABC):
+    """Queue of :class:`IngestJob` ordered by priority"""
+
+    @staticmethod
+    def _check_priority(job: IngestJob) -> None:
+        if job.priority not in PRIORITIES:
+            raise ValueError(
+                f'priority must be one of {PRIORITIES}, got {job.priority}'
+            )
+
+    @abc.abstractmethod
+    async def put(self, job: IngestJob) -> None:
+        """Add a job to the queue"""
+
+    @abc.abstractmethod
+    async def get(self) -> IngestJob:
+        """Wait for the next job with the highest priority"""
+
+    async def done(self, job: IngestJob) -> None:
+        """Forget a job taken with :meth:`get` once it was processed"""
+
+    async def start(self) -> None:
+        """Prepare the queue before jobs are taken from it"""
+
+    async def stop(self) -> None:
+        """Give back the jobs taken but not done"""
+
+
+class RedisJobQueue(JobQueue):
+    """Job queue shared by every worker through redis lists
+
+    There is a list per priority. Taking a job moves it to a processing
+    list of the worker until :meth:`done` so a job is never lost when the
+    worker dies. Workers keep a key alive while they run and the processing
+    lists of workers whose key expired are queued again on :meth:`start`.
+    Every job queued also adds a token to a wake list that idle workers
+    block on, so they do not poll the lists while the queue is empty.
+
+    Parameters
+    ----------
+    rcache : :class:`aioredis.Redis`
+        Connected redis instance
+    worker : :obj:`str`
+        The ID of the worker, a new one by default
+    """
+
+    PREFIX = 'ingest'
+    #: Seconds an idle worker blocks on the wake list before checking the
+    #: lists again, which bounds the delay of a missed token
+    WAIT = 5
+    #: Most tokens kept in the wake list. Extra tokens only cost an idle
+    #: worker another check of the empty lists
+    WAKE_TOKENS = 100
+    #: Seconds a worker is considered alive without a heartbeat
+    WORKER_TTL = 30
+
+    # Queues a job and wakes up a worker blocked on the wake list
+    _PUT = """
+redis.call('lpush', KEYS[1], ARGV[1])
+redis.call('lpush', KEYS[2], 1)
+redis.call('ltrim', KEYS[2], 0, tonumber(ARGV[2]) - 1)
+"""
+
+    # Moves the last job of the first list with one to the processing list.
+    # Redis can only block on a single list while moving so workers block on
+    # the wake list and then take the job with this script
+    _TAKE = """
+local processing = table.remove(KEYS)
+for _, key in ipairs(KEYS) do
+    local data = redis.call('rpoplpush', key, processing)
+    if data then
+        return data
+    end
+end
+return false
+"""
+
+    # Moves every job of a processing list back to the front of its queue
+    # and wakes up a worker for each
+    _REQUEUE = """
+local count = 0
+local data = redis.call('lpop', KEYS[1])
+while data do
+    local job = cjson.decode(data)
+    redis.call('rpush', ARGV[1] .. ':' .. job['priority'], data)
+    redis.call('lpush', KEYS[2], 1)
+    count = count + 1
+    data = redis.call('lpop', KEYS[1])
+end
+redis.call('ltrim', KEYS[2], 0, tonumber(ARGV[2]) - 1)
+return count
+"""
+
+    def __init__(self, rcache: aioredis.Redis, worker: Optional[str] = None):
+        self._rcache = rcache
+        self._keys = [f'{self.PREFIX}:{p}' for p in PRIORITIES]
+        self._wake = f'{self.PREFIX}:wake'
+        self.worker = worker or uuid.uuid4().hex
+        self._heartbeat: Optional[asyncio.Future] = None
+
+    def _processing(self, worker: str) -> str:
+        return f'{self.PREFIX}:processing:{worker}'
+
+    def _alive(self, worker: str) -> str:
+        return f'{self.PREFIX}:worker:{worker}'
+
+    async def put(self, job: IngestJob) -> None:
+        self._check_priority(job)
+        # Jobs are taken from the right so they come out in order
+        await self._rcache.eval(
+            self._PUT,
+            keys=[f'{self.PREFIX}:{job.priority}', self._wake],
+            args=[job.dumps(), self.WAKE_TOKENS],
+        )
+
+    async def get(self) -> IngestJob:
+        while True:
+            data = await self._rcache.eval(
+                self._TAKE,
+                keys=self._keys + [self._processing(self.worker)],
+            )
+            if data is not None:
+                return IngestJob.loads(data)
+            # The blocking read gets a connection of its own so the other
+            # commands of the pool are not queued behind it
+            with await self._rcache as conn:
+                await conn.brpop(self._wake, timeout=self.WAIT)
+
+    async def done(self, job: IngestJob) -> None:
+        await self._rcache.lrem(self._processing(self.worker), 1, job.dumps())
+
+    async def _requeue(self, worker: str) -> None:
+        count = await self._rcache.eval(
+            self._REQUEUE,
+            keys=[self._processing(worker), self._wake],
+            args=[self.PREFIX, self.WAKE_TOKENS],
+        )
+        if count:
+            logger.info(f'Queued {count} jobs of worker {worker} again')
+
+    async def _beat(self) -> None:
+        while True:
+            await self._rcache.set(
+                self._alive(self.worker),
+                '1',
+                expire=self.WORKER_TTL,
+            )
+            await asyncio.sleep(self.WORKER_TTL / 3)
+
+    async def start(self) -> None:
+        workers = f'{self.PREFIX}:workers'
+        for worker in await self._rcache.smembers(workers, encoding='utf-8'):
+            if not await self._rcache.exists(self._alive(worker)):
+                await self._requeue(worker)
+                await self._rcache.srem(workers, worker)
+        await self._rcache.sadd(workers, self.worker)
+        self._heartbeat = asyncio.ensure_future(self._beat())
+
+    async def stop(self) -> None:
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            await asyncio.gather(self._heartbeat, return_exceptions=True)
+            self._heartbeat = None
+        await self._requeue(self.worker)
+        await self._rcache.delete(self._alive(self.worker))
+        await self._rcache.srem(f'{self.PREFIX}:workers', self.worker)
+
+
+class LocalJobQueue(JobQueue):
+    """Job queue in the memory of the current process"""
+
+    def __init__(self):
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._count = itertools.count()
+
+    async def put(self, job: IngestJob) -> None:
+        self._check_priority(job)
+        # The count keeps jobs with the same priority first in first out
+        rank = PRIORITIES.index(job.priority)
+        await self._queue.put((rank, next(self._count), job))
+
+    async def get(self) -> IngestJob:
+        _, _, job = await self._queue.get()
+        return job
+
+
+async def get_job_queue() -> JobQueue:
+    """Get the job queue for the configured cache backend
+
+    The redis backend shares the queue between every worker through the
+    ``queue`` redis pool. The other backends fall back to a queue local to
+    the process.
+
+    Returns
+    -------
+    queue : :class:`JobQueue`
+        The queue of ingest jobs
+    """
+    if redis_cache.CACHE_BACKEND == 'redis':
+        return RedisJobQueue(await redis_cache.get_rcache('queue'))
+    else:
+        return LocalJobQueue()
+
+
+Handler = Callable[[IngestJob], Awaitable[Any]]
+
+
+class IngestWorkers:
+    """Pool of async workers processing jobs from a :class:`JobQueue`
+
+    Parameters
+    ----------
+    queue : :class:`JobQueue`
+        The queue to take jobs from
+    handler : :obj:`callable`
+        Coroutine function called with each job
+    workers : :obj:`int`
+        Maximum number of jobs processed at the same time. As many jobs
+        again can be taken from the queue to wait for a busy host
+    host_limit : :obj:`int`
+        Maximum number of jobs processed at the same time for a single host
+    """
+
+    RETRY = 1
+
+    def __init__(self, queue: JobQueue, handler: Handler, workers: int = 4,
+                 host_limit: int = 2):
+        self.queue = queue
+        self._handler = handler
+        self._slots = asyncio.Semaphore(workers)
+        # Jobs taken from the queue, running or waiting for their host
+        self._taken = asyncio.Semaphore(2 * workers)
+        self._host_limit = host_limit
+        self._hosts: Dict[str, Tuple[asyncio.Semaphore, int]] = {}
+        self._tasks: Set[asyncio.Future] = set()
+        self._dispatcher: Optional[asyncio.Future] = None
+
+    async def put(self, job: IngestJob) -> None:
+        """Add a job to the queue"""
+        logger.info(f'Queueing {job.ID} ({job.priority})')
+        await self.queue.put(job)
+
+    async def start(self) -> None:
+        """Start taking jobs from the queue"""
+        await self.queue.start()
+        self._dispatcher = asyncio.ensure_future(self._dispatch())
+
+    async def stop(self) -> None:
+        """Stop taking jobs and cancel the jobs in progress"""
+        tasks = list(self._tasks)
+        if self._dispatcher is not None:
+            tasks.append(self._dispatcher)
+            self._dispatcher = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.queue.stop()
+
+    async def _dispatch(self) -> None:
+        while True:
+            await self._taken.acquire()
+            try:
+                job = await self.queue.get()
+            except asyncio.CancelledError:
+                self._taken.release()
+                raise
+            except Exception:
+                self._taken.release()
+                logger.exception('Failed getting the next ingest job')
+                await asyncio.sleep(self.RETRY)
+                continue
+            task = asyncio.ensure_future(self._process(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _process(self, job: IngestJob) -> None:
+        host = job.host
+        semaphore, users = self._hosts.get(
+            host,
+            (asyncio.Semaphore(self._host_limit), 0),
+        )
+        self._hosts[host] = (semaphore, users + 1)
+        try:
+            # The host comes first so the jobs of a busy host do not hold
+            # slots that the jobs of the other hosts could use
+            async with semaphore, self._slots:
+                logger.info(f'Processing {job.ID}')
+                await self._handler(job)
+        except asyncio.CancelledError:
+            # Cancelled jobs are not done so the queue gives them back
+            raise
+        except Exception:
+            logger.exception(f'Failed processing {job.ID}')
+        finally:
+            semaphore, users = self._hosts[host]
+            if users == 1:
+                del self._hosts[host]
+            else:
+                self._hosts[host] = (semaphore, users - 1)
+            self._taken.release()
+        try:
+            await self.queue.done(job)
+        except Exception:
+            logger.exception(f'Failed marking {job.ID} done')
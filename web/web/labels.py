@@ -0,0 +1,120 @@
+"""Fast serialization of PDS labels for the cache
+
+:func:`pvl.dumps` and :func:`pvl.loads` are pure python and slow. Labels are
+instead stored as JSON, which is (de)serialized in C, with the pvl types that
+JSON does not have stored as tagged objects. Decoding gives back a
+:class:`pvl.PVLModule` equal to the one encoded.
+"""
+import json
+import datetime
+from typing import Any, Dict, Callable
+
+import pvl
+from pvl.decoder import EmptyValueAtLine  # type: ignore
+
+# Prefix of JSON encoded labels. PVL text cannot contain a null byte so it
+# tells the two formats apart
+MAGIC = b'\x00json\n'
+
+_TAG = '__pvl__'
+
+_MAPPINGS = {
+    'module': pvl.PVLModule,
+    'group': pvl.PVLGroup,
+    'object': pvl.PVLObject,
+    'dict': dict,
+}
+
+_DATETIMES = {
+    'datetime': datetime.datetime,
+    'date': datetime.date,
+    'time': datetime.time,
+}
+
+
+def _encode(value: Any) -> Any:
+    # Check subclasses before their bases: datetime is a date, Units is a
+    # tuple and EmptyValueAtLine is a str
+    if isinstance(value, EmptyValueAtLine):
+        return {_TAG: 'empty', 'lineno': value.lineno}
+    elif isinstance(value, (str, int, float)) or value is None:
+        return value
+    elif isinstance(value, pvl.Units):
+        return {
+            _TAG: 'units',
+            'value': _encode(value.value),
+            'units': value.units,
+        }
+    elif isinstance(value, (list, tuple)):
+        return [_encode(item) for item in value]
+    elif isinstance(value, (set, frozenset)):
+        return {_TAG: 'set', 'items': [_encode(item) for item in value]}
+    for tag, cls in _MAPPINGS.items():
+        if type(value) is cls:
+            items = [[key, _encode(item)] for key, item in value.items()]
+            return {_TAG: tag, 'items': items}
+    for tag, cls in _DATETIMES.items():
+        if type(value) is cls:
+            return {_TAG: tag, 'value': value.isoformat()}
+    raise TypeError(f'Cannot encode {type(value).__name__} in a label')
+
+
+def _decode_mapping(cls: type) -> Callable[[Dict[str, Any]], Any]:
+    return lambda obj: cls(obj['items'])
+
+
+def _decode_datetime(cls: Any) -> Callable[[Dict[str, Any]], Any]:
+    return lambda obj: cls.fromisoformat(obj['value'])
+
+
+_DECODERS: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+    'empty': lambda obj: EmptyValueAtLine(obj['lineno']),
+    'units': lambda obj: pvl.Units(obj['value'], obj['units']),
+    'set': lambda obj: set(obj['items']),
+}
+_DECODERS.update({tag: _decode_mapping(c) for tag, c in _MAPPINGS.items()})
+_DECODERS.update({tag: _decode_datetime(c) for tag, c in _DATETIMES.items()})
+
+
+def _object_hook(obj: Dict[str, Any]) -> Any:
+    tag = obj.get(_TAG)
+    if tag is None:
+        return obj
+    return _DECODERS[tag](obj)
+
+
+def dumps(label: pvl.PVLModule) -> bytes:
+    """Encode a label for the cache
+
+    Parameters
+    ----------
+    label : :class:`pvl.PVLModule`
+        The label to encode
+
+    Returns
+    -------
+    content : :obj:`bytes`
+        The encoded label
+    """
+    content = json.dumps(_encode(label), separators=(',', ':'))
+    return MAGIC + content.encode()
+
+
+def loads(content: bytes) -> pvl.PVLModule:
+    """Decode a label from the cache
+
+    Labels stored as PVL text are parsed with :func:`pvl.loads`
+
+    Parameters
+    ----------
+    content : :obj:`bytes`
+        The label encoded with :func:`dumps` or as PVL text
+
+    Returns
+    -------
+    label : :class:`pvl.PVLModule`
+        The decoded label
+    """
+    if not content.startswith(MAGIC):
+        return pvl.loads(content)
+    return json.loads(content[len(MAGIC):], object_hook=_object_hook)
@@ -0,0 +1,242 @@
+"""Low overhead metrics for the caches and the http session
+
+Metrics are kept in the memory of each worker process and rendered in the
+Prometheus text format by :func:`render`.
+"""
+import time
+import bisect
+from typing import Any, Dict, List, Tuple, Sequence
+from urllib.parse import urlsplit
+
+import aiohttp
+
+Labels = Tuple[str, ...]
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds, from a fast redis hit up to a slow image download
+BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+    2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', r'\\').replace('"', r'\"')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class Metric:
+    """Base class for metrics
+
+    Parameters
+    ----------
+    name : :obj:`str`
+        The name of the metric
+    description : :obj:`str`
+        Help text for the metric
+    labels : :obj:`tuple` of :obj:`str`
+        Names of the labels. Values are passed positionally when recording
+    """
+
+    TYPE = ''
+
+    def __init__(self, name: str, description: str,
+                 labels: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+
+    def clear(self) -> None:
+        raise NotImplementedError('clear not implemented')
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError('samples not implemented')
+
+    def render(self) -> str:
+        lines = [
+            f'# HELP {self.name} {self.description}',
+            f'# TYPE {self.name} {self.TYPE}',
+        ]
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """Value that only goes up"""
+
+    TYPE = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, labels: Labels, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, labels: Labels) -> float:
+        return self._values.get(labels, 0)
+
+    def clear(self) -> None:
+        self._values.clear()
+
+    def samples(self) -> List[str]:
+        return [
+            f'{self.name}{_format_labels(self.labels, labels)} {value}'
+            for labels, value in sorted(self._values.items())
+        ]
+
+
+class Histogram(Metric):
+    """Distribution of values counted in buckets"""
+
+    TYPE = 'histogram'
+
+    def __init__(self, *args, buckets: Sequence[float] = BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # Per labels: count in each bucket (not cumulative), sum and count
+        self._values: Dict[Labels, List[Any]] = {}
+
+    def observe(self, labels: Labels, value: float) -> None:
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            self._values[labels] = entry
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def count(self, labels: Labels) -> int:
+        return self._values.get(labels, [None, 0.0, 0])[2]
+
+    def clear(self) -> None:
+        self._values.clear()
+
+    def samples(self) -> List[str]:
+        lines = []
+        bucket_labels = self.labels + ('le',)
+        for labels, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                label_str = _format_labels(bucket_labels, labels + (bound,))
+                lines.append(f'{self.name}_bucket{label_str} {cumulative}')
+            label_str = _format_labels(self.labels, labels)
+            lines.append(f'{self.name}_sum{label_str} {total}')
+            lines.append(f'{self.name}_count{label_str} {count}')
+        return lines
+
+
+CACHE_LOOKUPS = Counter(
+    'opportunity_cache_lookups_total',
+    'Cache lookups by result (hit or miss)',
+    ('cache', 'result'),
+)
+CACHE_BYTES = Counter(
+    'opportunity_cache_bytes_total',
+    'Bytes read from and written to the cache backend',
+    ('cache', 'direction'),
+)
+CACHE_EVICTIONS = Counter(
+    'opportunity_cache_evictions_total',
+    'Entries deleted from the cache',
+    ('cache',),
+)
+CACHE_SECONDS = Histogram(
+    'opportunity_cache_operation_seconds',
+    'Latency of cache backend operations',
+    ('cache', 'operation'),
+)
+HTTP_REQUESTS = Counter(
+    'opportunity_http_client_requests_total',
+    'Requests made by the http session by response status',
+    ('host', 'status'),
+)
+HTTP_BYTES = Counter(
+    'opportunity_http_client_received_bytes_total',
+    'Response bytes received by the http session',
+    ('host',),
+)
+HTTP_SECONDS = Histogram(
+    'opportunity_http_client_request_seconds',
+    'Latency of requests made by the http session until the headers arrive',
+    ('host',),
+)
+
+METRICS: List[Metric] = [
+    CACHE_LOOKUPS,
+    CACHE_BYTES,
+    CACHE_EVICTIONS,
+    CACHE_SECONDS,
+    HTTP_REQUESTS,
+    HTTP_BYTES,
+    HTTP_SECONDS,
+]
+
+
+def render() -> str:
+    """Render every metric in the Prometheus text format
+
+    Returns
+    -------
+    text : :obj:`str`
+        The metrics of this process
+    """
+    return '\n'.join(metric.render() for metric in METRICS) + '\n'
+
+
+def clear() -> None:
+    """Reset every metric"""
+    for metric in METRICS:
+        metric.clear()
+
+
+async def _on_request_start(session, context, params) -> None:
+    context.start = time.perf_counter()
+    context.host = urlsplit(str(params.url)).netloc
+
+
+async def _on_request_end(session, context, params) -> None:
+    HTTP_SECONDS.observe((context.host,), time.perf_counter() - context.start)
+    HTTP_REQUESTS.inc((context.host, str(params.response.status)))
+
+
+async def _on_request_exception(session, context, params) -> None:
+    # Sessions created with raise_for_status report error responses here
+    error = params.exception
+    if isinstance(error, aiohttp.ClientResponseError):
+        HTTP_SECONDS.observe(
+            (context.host,),
+            time.perf_counter() - context.start,
+        )
+        HTTP_REQUESTS.inc((context.host, str(error.status)))
+    else:
+        HTTP_REQUESTS.inc((context.host, 'error'))
+
+
+async def _on_response_chunk_received(session, context, params) -> None:
+    HTTP_BYTES.inc((context.host,), len(params.chunk))
+
+
+def http_trace_config() -> aiohttp.TraceConfig:
+    """Get a trace config recording the requests of a client session
+
+    Returns
+    -------
+    trace_config : :class:`aiohttp.TraceConfig`
+        Pass in ``trace_configs`` when creating the session
+    """
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(_on_request_start)
+    trace_config.on_request_end.append(_on_request_end)
+    trace_config.on_request_exception.append(_on_request_exception)
+    trace_config.on_response_chunk_received.append(
+        _on_response_chunk_received,
+    )
+    return trace_config
@@ -1,10 +1,13 @@
 import asyncio
 import logging
+import contextlib
 from io import BytesIO
-from typing import Tuple, Union, Any
+from datetime import datetime, timezone
+from typing import Tuple, Union, Any, Dict, Callable
 
 import pvl
 import aiohttp
+from pvl.decoder import EmptyValueAtLine  # type: ignore
 import numpy as np  # type: ignore
 from matplotlib.figure import Figure  # type: ignore
 from matplotlib.backends.backend_agg import (  # type: ignore
@@ -14,6 +17,97 @@ from matplotlib.backends.backend_agg import (  # type: ignore
 logger = logging.getLogger(__name__)
 
 
+def _find_keyword(label: dict, keyword: str) -> Any:
+    if keyword in label:
+        return label[keyword]
+    # The image object is searched first for the dimensions of the image
+    groups = [label['IMAGE']] if isinstance(label.get('IMAGE'), dict) else []
+    groups.extend(value for value in label.values() if isinstance(value, dict))
+    for group in groups:
+        if keyword in group:
+            return group[keyword]
+    raise KeyError(keyword)
+
+
+def _text(value: Any) -> str:
+    if not isinstance(value, str) or isinstance(value, EmptyValueAtLine):
+        raise ValueError(f'{value!r} is not text')
+    return str(value)
+
+
+def _utc_time(value: Any) -> str:
+    if not isinstance(value, datetime):
+        raise ValueError(f'{value!r} is not a time')
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.isoformat()
+
+
+def _milliseconds(value: Any) -> float:
+    if isinstance(value, pvl.Units):
+        units = value.units.lower()
+        value = value.value
+        if units in ('s', 'sec', 'seconds'):
+            value *= 1000
+    return float(value)
+
+
+def _number(value: Any) -> float:
+    if isinstance(value, EmptyValueAtLine):
+        raise ValueError('The value is empty')
+    # Clock counts are quoted to keep their precision
+    return float(value.strip('"') if isinstance(value, str) else value)
+
+
+def _integer(value: Any) -> int:
+    if isinstance(value, bool):
+        raise ValueError(f'{value!r} is not an integer')
+    return int(value)
+
+
+# Columns of the images in the API set from the label, with the keyword they
+# are set from and its conversion to JSON
+METADATA_KEYWORDS: Dict[str, Tuple[str, Callable[[Any], Any]]] = {
+    'StartTime': ('START_TIME', _utc_time),
+    'SpacecraftClockStart': ('SPACECRAFT_CLOCK_START_COUNT', _number),
+    'ExposureDuration': ('EXPOSURE_DURATION', _milliseconds),
+    'FilterName': ('FILTER_NAME', _text),
+    'Lines': ('LINES', _integer),
+    'LineSamples': ('LINE_SAMPLES', _integer),
+    'Bands': ('BANDS', _integer),
+    'SampleType': ('SAMPLE_TYPE', _text),
+}
+
+
+def get_metadata(label: pvl.PVLModule) -> Dict[str, Any]:
+    """Get the values of the label's keywords stored with the image
+
+    Keywords are looked up at the top of the label, then in the ``IMAGE``
+    object and then in the other groups and objects. Missing keywords and
+    values that cannot be converted, such as ``UNK``, are left out.
+
+    Parameters
+    ----------
+    label : :class:`pvl.PVLModule`
+        The label of the image
+
+    Returns
+    -------
+    metadata : :obj:`dict`
+        The JSON values by the columns of the image, see
+        :data:`METADATA_KEYWORDS`
+    """
+    metadata = {}
+    for column, (keyword, convert) in METADATA_KEYWORDS.items():
+        try:
+            metadata[column] = convert(_find_keyword(label, keyword))
+        except KeyError:
+            continue
+        except (TypeError, ValueError) as err:
+            logger.warning(f'Ignoring {keyword} of the label: {err}')
+    return metadata
+
+
 class PDSImage:
     """A PDS Image that can download and display images
 
@@ -155,6 +249,10 @@ class PDSImage:
             The url to the image in the pds imaging node
         session : :class:`aiohttp.ClientSession`
             Open client session for making requests asynchronously
+        progress : :obj:`tuple`
+            The :class:`web.redis_cache.ProgressCache` and the ID to report
+            the bytes received under. The image and detached label count as
+            one download
         detached : :obj:`bool`
             Whether or not the label is detached. ``False`` by default
 
@@ -163,36 +261,44 @@ class PDSImage:
         image : :class:`PDSImage`
             The image from the url
         """
-        chunks = 100
         progress_cache, progress_id = progress
-        content = b''
+        try:
+            image = await cls._download(url, session, progress, detached)
+        except Exception:
+            # Watchers of the progress stop waiting for the image
+            await progress_cache.finish(progress_id, failed=True)
+            raise
+        await progress_cache.finish(progress_id)
+        return image
+
+    @classmethod
+    async def _download(cls, url: str, session: aiohttp.ClientSession,
+                        progress: Tuple[Any, str],
+                        detached: bool) -> 'PDSImage':
+        progress_cache, progress_id = progress
         logger.info(f'Downloading {url}')
-        async with session.get(url) as resp:
-            size = resp.headers['Content-Length']
-            start_awaited = False
-            start_fut = progress_cache.start(progress_id, size)
-            async for cont_chunk in resp.content.iter_chunked(chunks):
-                content += cont_chunk
-                if not start_awaited:
-                    await start_fut
-                    start_awaited = True
-                await progress_cache.progress(progress_id, chunks)
-
-        if detached:
-            lbl_content = b''
-            logger.info('Downloading Label')
-            async with session.get(url.replace('.img', '.lbl')) as resp:
-                size = resp.headers['Content-Length']
-                start_awaited = False
-                start_fut = progress_cache.start(progress_id, size)
-                async for cont_chunk in resp.content.iter_chunked(chunks):
-                    lbl_content += cont_chunk
-                    if not start_awaited:
-                        await start_fut
-                        start_awaited = True
-                    await progress_cache.progress(progress_id, chunks)
-        else:
-            lbl_content = content
+        async with contextlib.AsyncExitStack() as stack:
+            # Open every part first so the total size is known up front
+            urls = [url]
+            if detached:
+                urls.append(url.replace('.img', '.lbl'))
+            responses = [
+                await stack.enter_async_context(session.get(part))
+                for part in urls
+            ]
+            sizes = [resp.content_length for resp in responses]
+            total = None if None in sizes else sum(sizes)
+            await progress_cache.start(progress_id, total)
+            parts = []
+            for resp in responses:
+                chunks = []
+                async for chunk in resp.content.iter_any():
+                    chunks.append(chunk)
+                    await progress_cache.progress(progress_id, len(chunk))
+                parts.append(b''.join(chunks))
+
+        content = parts[0]
+        lbl_content = parts[-1]
         label = pvl.loads(lbl_content, strict=False)
         start_byte_fut = cls._get_start_byte(label)
         shape_fut = cls._get_shape(label)
@@ -212,7 +318,7 @@ class PDSImage:
         self._data = data
 
     def __repr__(self) -> str:
-        return f'{self.__class__.__name__}({self._label["PRODUCT_ID"]})'
+        return f'{self.__class__.__name__}({self._label.get("PRODUCT_ID")})'
 
     @property
     async def product_id(self) -> str:
@@ -234,6 +340,16 @@ class PDSImage:
         """:class:`pvl.PVLModule` : Copy of the image's label"""
         return self._label.copy()
 
+    @property
+    async def metadata(self) -> Dict[str, Any]:
+        """:obj:`dict` : Values from the label stored with the image
+
+        See Also
+        --------
+        :func:`get_metadata`
+        """
+        return get_metadata(self._label)
+
     @property
     async def bands(self) -> int:
         """:obj:`int` : The number of bands in the image"""
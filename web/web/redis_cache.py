@@ -1,51 +1,145 @@
-import os
 import re
 import abc
 import json
+import time
 import asyncio
 import logging
 from datetime import datetime
-from typing import Any, List, Dict, Union
+from typing import Any, List, Dict, Tuple, Union, Optional, NamedTuple
 
 import pvl
 import aioredis
 import numpy as np  # type: ignore
 from async_lru import alru_cache
 
+from web import labels, metrics
+from web.config import Config
 from web.pdsimage import PDSImage
-
-REDIS_PORT = 6379
+from web.backends import (
+    CacheBackend,
+    RedisBackend,
+    MemoryBackend,
+    FilesystemBackend,
+    SharedSubscription,
+    InstrumentedBackend,
+    close_shared_subscriptions,
+)
+
+REDIS_HOST = Config.REDIS_HOST
+REDIS_PORT = Config.REDIS_PORT
+REDIS_POOLS = Config.REDIS_POOLS
+CACHE_BACKEND = Config.CACHE_BACKEND
+CACHE_DIR = Config.CACHE_DIR
 
 logger = logging.getLogger(__name__)
 
+_OPEN_POOLS: List[aioredis.Redis] = []
 
-@alru_cache()
-async def get_rcache() -> aioredis.Redis:
-    """Get a redis object to interact with the redis cache in docker
+
+async def get_rcache(pool: str = 'control') -> aioredis.Redis:
+    """Get a pooled redis client to interact with the redis cache in docker
+
+    Each pool is only created once per process and shared by every caller.
+
+    Parameters
+    ----------
+    pool : :obj:`str`
+        The name of the pool in ``REDIS_POOLS``. Use ``'data'`` for large
+        image payloads and ``'control'`` (the default) for everything else
 
     Returns
     -------
-    rcache : :class:`redis.Redis`
+    rcache : :class:`aioredis.Redis`
         Redis interface connected to the server in docker
     """
-    # Default for dockertoolbox. Set DOCKER_IP to 127.0.0.1 if not on toolbox
-    redis_host = os.environ.get('DOCKER_IP', '192.168.99.100')
-    address = (redis_host, REDIS_PORT)
-    rcache = await aioredis.create_redis(address)
+    if pool not in REDIS_POOLS:
+        raise ValueError(f'Unknown redis pool {repr(pool)}')
+    # The cache is keyed on the arguments as passed, so the name is always
+    # passed the same way for every caller to share the pool
+    return await _get_rcache(pool)
+
+
+@alru_cache()
+async def _get_rcache(pool: str) -> aioredis.Redis:
+    address = (REDIS_HOST, REDIS_PORT)
+    logger.info(f'Creating redis pool {pool} at {address}')
+    rcache = await aioredis.create_redis_pool(address, **REDIS_POOLS[pool])
+    _OPEN_POOLS.append(rcache)
     return rcache
 
 
+async def close_rcache() -> None:
+    """Close every pool created by :func:`get_rcache`
+
+    The shared subscriptions are closed first as they hold their own
+    connections.
+    """
+    await close_shared_subscriptions()
+    while _OPEN_POOLS:
+        rcache = _OPEN_POOLS.pop()
+        rcache.close()
+        await rcache.wait_closed()
+    _get_rcache.cache_clear()
+
+
+_LOCAL_BACKENDS: Dict[str, CacheBackend] = {}
+
+
+async def get_backend(pool: str = 'control') -> CacheBackend:
+    """Get the cache backend selected by ``CACHE_BACKEND``
+
+    ``'redis'`` uses the redis pools from :func:`get_rcache`,
+    ``'filesystem'`` stores the cache in ``CACHE_DIR`` and ``'memory'`` keeps
+    it in the memory of the current process.
+
+    Parameters
+    ----------
+    pool : :obj:`str`
+        The redis pool to use. Ignored by the other backends
+
+    Returns
+    -------
+    backend : :class:`web.backends.CacheBackend`
+        The backend for the cache interfaces
+    """
+    if CACHE_BACKEND == 'redis':
+        return RedisBackend(await get_rcache(pool))
+    if CACHE_BACKEND not in _LOCAL_BACKENDS:
+        backend: CacheBackend
+        if CACHE_BACKEND == 'memory':
+            backend = MemoryBackend()
+        elif CACHE_BACKEND == 'filesystem':
+            backend = FilesystemBackend(CACHE_DIR)
+        else:
+            raise ValueError(f'Unknown cache backend {repr(CACHE_BACKEND)}')
+        _LOCAL_BACKENDS[CACHE_BACKEND] = backend
+    return _LOCAL_BACKENDS[CACHE_BACKEND]
+
+
 class RedisCache:
     """Base class for redis cache interface
 
     Parameters
     ----------
-    rcache : :class:`aioredis.Redis`
-        Connected redis instance
+    backend : :class:`web.backends.CacheBackend` or :class:`aioredis.Redis`
+        The storage for the cache. A connected redis instance is wrapped in a
+        :class:`web.backends.RedisBackend`
+
+    The backend is wrapped in a :class:`web.backends.InstrumentedBackend` so
+    the operations are recorded in :mod:`web.metrics` under the class name.
     """
 
-    def __init__(self, rcache: aioredis.Redis):
-        self._rcache = rcache
+    def __init__(self, backend: Union[CacheBackend, aioredis.Redis]):
+        if not isinstance(backend, CacheBackend):
+            backend = RedisBackend(backend)
+        self._cache = self.__class__.__name__
+        if isinstance(backend, InstrumentedBackend):
+            backend = backend.backend
+        self._backend = InstrumentedBackend(backend, self._cache)
+
+    def _lookup(self, hit: bool) -> None:
+        result = 'hit' if hit else 'miss'
+        metrics.CACHE_LOOKUPS.inc((self._cache, result))
 
 
 class HashCache(RedisCache):
@@ -53,8 +147,8 @@ class HashCache(RedisCache):
 
     Parameters
     ----------
-    rcache : :class:`aioredis.Redis`
-        Connected redis instance
+    backend : :class:`web.backends.CacheBackend` or :class:`aioredis.Redis`
+        The storage for the cache
     """
 
     def __repr__(self):
@@ -80,7 +174,7 @@ class HashCache(RedisCache):
             Whether or not the key exists
         """
 
-        return await self._rcache.hexists(await self.name, key)
+        return await self._backend.hexists(await self.name, key)
 
     async def keys(self) -> List[str]:
         """Get all the keys in the hash
@@ -92,7 +186,7 @@ class HashCache(RedisCache):
         """
 
         keys = []
-        for key in await self._rcache.hkeys(await self.name):
+        for key in await self._backend.hkeys(await self.name):
             keys.append(key.decode())
         return keys
 
@@ -111,7 +205,7 @@ class HashCache(RedisCache):
         """
 
         if await self.exists(key):
-            return await self._rcache.hget(await self.name, key)
+            return await self._backend.hget(await self.name, key)
         else:
             raise KeyError(f'{repr(key)}')
 
@@ -153,7 +247,7 @@ class HashCache(RedisCache):
 
         if not isinstance(key, str):
             raise TypeError('key must be string')
-        await self._rcache.hset(await self.name, key, value)
+        await self._backend.hset(await self.name, key, value)
 
     async def delete(self, key: str) -> None:
         """Delete a key from the hash
@@ -165,20 +259,55 @@ class HashCache(RedisCache):
         """
 
         if await self.exists(key):
-            await self._rcache.hdel(await self.name, key)
+            await self._backend.hdel(await self.name, key)
+            metrics.CACHE_EVICTIONS.inc((self._cache,))
         else:
             raise KeyError(f'{repr(key)}')
 
     async def clear(self) -> None:
         """Clear all entries in the hash"""
-        await self._rcache.delete(await self.name)
+        await self._backend.delete(await self.name)
+        metrics.CACHE_EVICTIONS.inc((self._cache,))
 
 
 class ImageCache(HashCache):
+    """Redis cache interface for images
+
+    Parameters
+    ----------
+    backend : :class:`web.backends.CacheBackend` or :class:`aioredis.Redis`
+        The storage for the cache
+    block_lines : :obj:`int`, optional
+        Number of image lines to store per hash field. When ``None`` (the
+        default) the whole data array is stored in a single field. Storing
+        blocks lets :meth:`get_lines` read only part of a large image.
+    label_format : :obj:`str`
+        How labels are stored. ``'json'`` (the default) uses the fast
+        encoding in :mod:`web.labels` and ``'pvl'`` stores the PVL text.
+        Labels in either format can be read back.
+    """
 
     _TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
-    _SUBS = ['data', 'label', 'dtype', 'shape']
-    _INTERNAL_KEY = re.compile(r':(data|dtype|shape|label)')
+    _SUBS = ['label', 'dtype', 'shape']
+    _LAYOUTS = ['data', 'blocks']
+    _INTERNAL_KEY = re.compile(r':(data|dtype|shape|label|blocks)')
+    _LABEL_FORMATS = {
+        'json': labels.dumps,
+        'pvl': pvl.dumps,
+    }
+
+    def __init__(self, backend: Union[CacheBackend, aioredis.Redis],
+                 block_lines: Optional[int] = None,
+                 label_format: str = 'json'):
+        super().__init__(backend)
+        if block_lines is not None and block_lines < 1:
+            raise ValueError('block_lines must be a positive integer')
+        if label_format not in self._LABEL_FORMATS:
+            raise ValueError(
+                f'label_format must be one of {list(self._LABEL_FORMATS)}'
+            )
+        self._block_lines = block_lines
+        self._dump_label = self._LABEL_FORMATS[label_format]
 
     @property
     async def name(self) -> str:
@@ -227,11 +356,41 @@ class ImageCache(HashCache):
 
     async def _set_data(self, key: str, image: PDSImage) -> None:
         data = await image.data
-        await super().set(f'{key}:data', data.tobytes())
+        name = await self.name
+        if self._block_lines is None:
+            await asyncio.gather(
+                self._backend.set_arrays(name, {f'{key}:data': data}),
+                self._backend.hdel(name, f'{key}:blocks'),
+            )
+        else:
+            await asyncio.gather(
+                self._set_blocks(key, data),
+                self._backend.hdel(name, f'{key}:data'),
+            )
+
+    async def _set_blocks(self, key: str, data: np.ndarray) -> None:
+        step = self._block_lines
+        blocks = {}
+        for n, start in enumerate(range(0, data.shape[-2], step)):
+            blocks[f'{key}:data:{n}'] = data[..., start:start + step, :]
+        await self._backend.set_arrays(await self.name, blocks)
+        await super().set(f'{key}:blocks', str(step))
+
+    async def _block_fields(self, key: str) -> List[str]:
+        # The fields of the blocks in the layout the image is stored in
+        name = await self.name
+        step, shape = await asyncio.gather(
+            self._backend.hget(name, f'{key}:blocks'),
+            self._backend.hget(name, f'{key}:shape'),
+        )
+        if step is None or shape is None:
+            return []
+        count = -(-json.loads(shape)[-2] // int(step))
+        return [f'{key}:data:{n}' for n in range(count)]
 
     async def _set_label(self, key: str, image: PDSImage) -> None:
         label = await image.label
-        await super().set(f'{key}:label', pvl.dumps(label))
+        await super().set(f'{key}:label', self._dump_label(label))
 
     async def _set_dtype(self, key: str, image: PDSImage) -> None:
         await super().set(f'{key}:dtype', str(await image.dtype))
@@ -255,6 +414,7 @@ class ImageCache(HashCache):
 
         logger.info(f'Seting {key}: {repr(PDSImage)} to ImageCache')
 
+        previous = await self._block_fields(key)
         await asyncio.gather(
             self.set_time(key),
             self._set_data(key, image),
@@ -262,29 +422,97 @@ class ImageCache(HashCache):
             self._set_dtype(key, image),
             self._set_shape(key, image),
         )
+        # Blocks of a previous layout the new one does not overwrite
+        current = set(await self._block_fields(key))
+        stale = [field for field in previous if field not in current]
+        if stale:
+            await self._backend.hdel(await self.name, *stale)
 
-    async def get(self, key: str) -> PDSImage:
+    async def get(self, key: str, label: bool = True) -> PDSImage:
         """Get an image from the cache
 
         Parameters
         ----------
         key : :obj:`str`
             The name of the image
+        label : :obj:`bool`
+            Whether or not to read the label. When ``False`` the image gets
+            an empty label and no time is spent decoding it
         """
 
         logger.info(f'Getting {key} from ImageCache')
-        dtype, shape, data, label = await asyncio.gather(
+        try:
+            if not label:
+                image = PDSImage(await self.get_lines(key), pvl.PVLModule())
+            else:
+                data, content = await asyncio.gather(
+                    self.get_lines(key),
+                    super().get(f'{key}:label'),
+                )
+                image = PDSImage(data, labels.loads(content))
+        except KeyError:
+            self._lookup(False)
+            raise
+        self._lookup(True)
+        return image
+
+    async def get_lines(self, key: str, start: int = 0,
+                        stop: Optional[int] = None) -> np.ndarray:
+        """Get a range of lines of an image's data from the cache
+
+        When the image was stored in blocks only the blocks covering the
+        requested lines are read from the cache.
+
+        Parameters
+        ----------
+        key : :obj:`str`
+            The name of the image
+        start : :obj:`int`
+            The first line to get. ``0`` by default
+        stop : :obj:`int`, optional
+            The line to stop at (exclusive). ``None`` reads to the last line
+
+        Returns
+        -------
+        data : :class:`numpy.ndarray`
+            The image data with the lines restricted to ``start:stop``
+        """
+
+        name = await self.name
+        dtype, shape, step = await asyncio.gather(
             super().get(f'{key}:dtype'),
             super().get(f'{key}:shape'),
-            super().get(f'{key}:data'),
-            super().get(f'{key}:label'),
+            self._backend.hget(name, f'{key}:blocks'),
         )
         dtype = np.dtype(dtype)
         shape = tuple(json.loads(shape))
-        data = np.frombuffer(data, dtype=dtype)
-        data = data.reshape(shape).copy()
-        label = pvl.loads(label)
-        return PDSImage(data, label)
+        start, stop, _ = slice(start, stop).indices(shape[-2])
+        stop = max(start, stop)
+        if step is None:
+            data, = await self._backend.get_arrays(
+                name, [f'{key}:data'], dtype, [shape],
+            )
+            if data is None:
+                raise KeyError(f'{repr(key)}')
+            return data[..., start:stop, :].copy()
+
+        out = np.empty(shape[:-2] + (stop - start, shape[-1]), dtype=dtype)
+        if stop == start:
+            return out
+        step = int(step)
+        numbers = range(start // step, (stop - 1) // step + 1)
+        fields = [f'{key}:data:{n}' for n in numbers]
+        bounds = [(n * step, min(n * step + step, shape[-2])) for n in numbers]
+        shapes = [shape[:-2] + (b - a, shape[-1]) for a, b in bounds]
+        blocks = await self._backend.get_arrays(name, fields, dtype, shapes)
+        for (first, last), block in zip(bounds, blocks):
+            if block is None:
+                raise KeyError(f'{repr(key)}')
+            low, high = max(start, first), min(stop, last)
+            out[..., low - start:high - start, :] = (
+                block[..., low - first:high - first, :]
+            )
+        return out
 
     async def keys(self) -> List[str]:
         """Get a list of image names in the cache
@@ -324,59 +552,413 @@ class ImageCache(HashCache):
             Whether or not the image is in the cache
         """
 
-        if not await super().exists(key):
-            return False
-        elif await self._is_internal(key):
-            return True
+        # Only lookups of images count, not the internal keys HashCache.get
+        # checks through this method
+        if self._INTERNAL_KEY.search(key) is not None:
+            return await super().exists(key)
+        elif not await super().exists(key):
+            found = False
         else:
             exists = super().exists
-            tasks = [exists(f'{key}:{sub}') for sub in self._SUBS]
-            return all(await asyncio.gather(*tasks))
+            subs, layouts = await asyncio.gather(
+                asyncio.gather(*[exists(f'{key}:{s}') for s in self._SUBS]),
+                asyncio.gather(*[exists(f'{key}:{s}') for s in self._LAYOUTS]),
+            )
+            found = all(subs) and any(layouts)
+        self._lookup(found)
+        return found
+
+
+class Progress(NamedTuple):
+    """Progress of a download
+
+    Sizes are in bytes and times are unix timestamps in seconds.
+    """
+
+    #: Bytes received so far across every part of the download
+    received: int = 0
+    #: Bytes expected across every part, ``0`` while unknown
+    total: int = 0
+    #: When the download started
+    started: float = 0.0
+    #: When the record was last updated
+    updated: float = 0.0
+    #: Moving average of the transfer rate in bytes per second
+    rate: float = 0.0
+    #: Whether or not every part was received
+    finished: bool = False
+    #: Whether or not the download failed, it will not finish then
+    failed: bool = False
+
+    @property
+    def progress(self) -> float:
+        """:obj:`float` : Fraction of the bytes received"""
+        if self.finished:
+            return 1.0
+        elif not self.total:
+            return 0.0
+        return min(self.received / self.total, 1.0)
+
+    @property
+    def eta(self) -> Optional[float]:
+        """:obj:`float` : Estimated seconds left, ``None`` when unknown"""
+        if self.finished:
+            return 0.0
+        elif self.failed or not self.total or not self.rate:
+            return None
+        return max(self.total - self.received, 0) / self.rate
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Get the record with the derived ``progress`` and ``eta``"""
+        record = self._asdict()
+        record['progress'] = self.progress
+        record['eta'] = self.eta
+        return record
+
+    def dumps(self) -> str:
+        return json.dumps(self._asdict())
+
+    @classmethod
+    def loads(cls, data: Union[str, bytes]) -> 'Progress':
+        return cls(**json.loads(data))
+
+
+class ProgressSubscription:
+    """Updates to the progress of downloads
+
+    Returned by :meth:`ProgressCache.subscribe`. Use it as an async context
+    manager to watch the downloads and iterate over it to get
+    ``(ID, progress)`` pairs as they are published.
+
+    Parameters
+    ----------
+    backend : :class:`web.backends.CacheBackend`
+        The backend the updates are published with
+    channels : :obj:`dict`
+        Map of the channels to watch to the download IDs
+    """
+
+    def __init__(self, backend: CacheBackend, channels: Dict[str, str]):
+        self._backend = backend
+        self._channels = channels
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._shared: Optional[SharedSubscription] = None
+
+    async def __aenter__(self) -> 'ProgressSubscription':
+        self._shared = await self._backend.shared_subscription()
+        await self._shared.add(self._queue, *self._channels)
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        if self._shared is not None:
+            await self._shared.remove(self._queue, *self._channels)
+            self._shared = None
+
+    def __aiter__(self) -> 'ProgressSubscription':
+        return self
+
+    async def __anext__(self) -> Tuple[str, Progress]:
+        return await self.get()
+
+    async def get(self) -> Tuple[str, Progress]:
+        """Wait for the next update
+
+        Returns
+        -------
+        ID : :obj:`str`
+            The ID of the download
+        progress : :class:`Progress`
+            The progress of the download
+        """
+        channel, message = await self._queue.get()
+        return self._channels[channel], Progress.loads(message)
 
 
 class ProgressCache(RedisCache):
+    """Cache interface for the progress of downloads
+
+    The progress of each download is a hash and every update is a single
+    atomic call to the backend, which adds the bytes, overwrites the other
+    fields and reads the hash back. The bytes received are also counted per
+    second so the transfer rate is a moving average computed when the record
+    is read. The :class:`Progress` record is published on the channel from
+    :meth:`channel` so watchers do not need to poll, at most every
+    :attr:`PUBLISH_INTERVAL` seconds while the download runs.
+    """
 
     EXPIRE = 60 * 5
+    CHANNEL = 'progress'
+    # Seconds over which the transfer rate is averaged
+    RATE_WINDOW = 5
+    # Prefix of the fields counting the bytes received in each second
+    _RATE = 'rate:'
+    # Updates are published at most every PUBLISH_INTERVAL seconds unless
+    # the progress moved by PUBLISH_STEP
+    PUBLISH_INTERVAL = 0.5
+    PUBLISH_STEP = 0.01
+
+    def __init__(self, backend: Union[CacheBackend, aioredis.Redis]):
+        super().__init__(backend)
+        # Time and progress of the last record published for each download
+        self._published: Dict[str, Tuple[float, float]] = {}
+
+    @classmethod
+    def channel(cls, ID: str) -> str:
+        """Get the channel the progress of a download is published on
 
-    async def _set(self, ID: str, progress: float, total: int,
-                   size: int) -> None:
-        await asyncio.gather(
-            self._rcache.set(ID, str(progress), expire=self.EXPIRE),
-            self._rcache.set(f'{ID}:total', str(total), expire=self.EXPIRE),
-            self._rcache.set(f'{ID}:size', str(size), expire=self.EXPIRE),
+        Parameters
+        ----------
+        ID : :obj:`str`
+            The ID of the download
+
+        Returns
+        -------
+        channel : :obj:`str`
+            The name of the channel
+        """
+        return f'{cls.CHANNEL}:{ID}'
+
+    def _key(self, ID: str) -> str:
+        return f'{self.CHANNEL}:{ID}'
+
+    def _parse(self, values: Optional[Dict[bytes, bytes]]
+               ) -> Tuple[Optional[Progress], List[str]]:
+        # Returns the record and the counts that left the rate window
+        if not values:
+            return None, []
+        fields = {key.decode(): value for key, value in values.items()}
+        finished = fields.get('finished') == b'1'
+        failed = fields.get('failed') == b'1'
+        if 'started' not in fields and not failed:
+            return None, []
+        updated = float(fields.get('updated', time.time()))
+        started = float(fields.get('started', updated))
+        received = int(fields.get('received', 0))
+        total = int(fields.get('total', 0))
+        if finished:
+            total = max(total, received)
+        # The rate of a download that ended is frozen at its last update
+        end = updated if finished or failed else time.time()
+        window = 0
+        stale = []
+        for field, value in fields.items():
+            if not field.startswith(self._RATE):
+                continue
+            second = int(field[len(self._RATE):])
+            if second > end - self.RATE_WINDOW:
+                window += int(value)
+            else:
+                stale.append(field)
+        duration = max(min(self.RATE_WINDOW, end - started), 1e-3)
+        record = Progress(
+            received=received,
+            total=total,
+            started=started,
+            updated=updated,
+            rate=window / duration,
+            finished=finished,
+            failed=failed,
         )
+        return record, stale
+
+    def _throttled(self, ID: str, record: Progress) -> bool:
+        # Whether publishing the record can wait for a later update
+        if record.finished or record.failed:
+            self._published.pop(ID, None)
+            return False
+        published = self._published.get(ID)
+        if published is not None:
+            when, progress = published
+            if (record.updated - when < self.PUBLISH_INTERVAL
+                    and record.progress - progress < self.PUBLISH_STEP):
+                return True
+        self._published[ID] = (record.updated, record.progress)
+        return False
+
+    async def _update(self, ID: str, values: Dict[str, Any],
+                      increments: Optional[Dict[str, int]] = None,
+                      create: bool = False,
+                      force: bool = False) -> Optional[Progress]:
+        # A single atomic update reading the hash back, so the record
+        # includes every concurrent update that came before it
+        key = self._key(ID)
+        record, stale = self._parse(await self._backend.hupdate(
+            key, values, increments or {}, expire=self.EXPIRE, create=create,
+        ))
+        if record is None:
+            return None
+        if stale:
+            await self._backend.hdel(key, *stale)
+        if force:
+            self._published[ID] = (record.updated, record.progress)
+        elif self._throttled(ID, record):
+            return record
+        await self._backend.publish(self.channel(ID), record.dumps())
+        return record
+
+    async def start(self, ID: str, size: Optional[int] = None) -> Progress:
+        """Start the progress of a download
 
-    async def start(self, ID: str, size: int) -> None:
+        Parameters
+        ----------
+        ID : :obj:`str`
+            The ID of the download
+        size : :obj:`int`, optional
+            The number of bytes expected across every part. ``None`` when
+            not known yet
+
+        Returns
+        -------
+        record : :class:`Progress`
+            The new record
+        """
         logger.info(f'{ID} progress started')
-        await self._set(ID, 0.0, 0, size)
-
-    async def _exists(self, key: str) -> bool:
-        return await self._rcache.exists(key)
-
-    async def _get(self, key: str, valtype: type) -> Union[int, float]:
-        value = await self._rcache.get(key)
-        if value is None:
-            value = '-1'
-        return valtype(value)
-
-    async def progress(self, ID: str, chunk: int) -> None:
-        if await self._exists(ID):
-            progress: float
-            total: int
-            size: int
-            awaitables = [
-                self._get(ID, float),
-                self._get(f'{ID}:total', int),
-                self._get(f'{ID}:size', int),
-            ]
-            progress, total, size = await asyncio.gather(*awaitables)
-            total += chunk
-            if total >= size:
-                total = size
-                logger.info(f'{ID} progress finished')
-            progress = total / size
-            await self._set(ID, progress, total, size)
+        now = time.time()
+        # Counts of a previous download of the same ID start over
+        await self._backend.delete(self._key(ID))
+        return await self._update(ID, {
+            'received': 0,
+            'total': size or 0,
+            'started': now,
+            'updated': now,
+            'finished': 0,
+            'failed': 0,
+        }, create=True, force=True)
+
+    async def expect(self, ID: str, size: int) -> Progress:
+        """Add the size of another part to the bytes expected
+
+        Parameters
+        ----------
+        ID : :obj:`str`
+            The ID of the download
+        size : :obj:`int`
+            The number of bytes in the part
+
+        Returns
+        -------
+        record : :class:`Progress`
+            The updated record
+        """
+        record = await self._update(
+            ID, {}, {'total': size}, force=True,
+        )
+        if record is None:
+            return await self.start(ID, size)
+        return record
+
+    async def progress(self, ID: str, received: int) -> Optional[Progress]:
+        """Record bytes received for a download
+
+        Does nothing if the download was not started. The record is only
+        published every :attr:`PUBLISH_INTERVAL` seconds or
+        :attr:`PUBLISH_STEP` of progress so watchers are not flooded.
+
+        Parameters
+        ----------
+        ID : :obj:`str`
+            The ID of the download
+        received : :obj:`int`
+            The number of bytes just received
+
+        Returns
+        -------
+        record : :class:`Progress` or ``None``
+            The updated record
+        """
+        now = time.time()
+        return await self._update(ID, {'updated': now}, {
+            'received': received,
+            f'{self._RATE}{int(now)}': received,
+        })
+
+    async def finish(self, ID: str,
+                     failed: bool = False) -> Optional[Progress]:
+        """Mark a download as finished or failed
+
+        Parameters
+        ----------
+        ID : :obj:`str`
+            The ID of the download
+        failed : :obj:`bool`
+            Whether the download failed. A failed download gets a record
+            even if it was not started so watchers stop waiting for it
+
+        Returns
+        -------
+        record : :class:`Progress` or ``None``
+            The updated record, ``None`` if a finished download was not
+            started
+        """
+        now = time.time()
+        if failed:
+            logger.info(f'{ID} progress failed')
+            return await self._update(ID, {
+                'updated': now,
+                'finished': 0,
+                'failed': 1,
+            }, create=True)
+        record = await self._update(ID, {'updated': now, 'finished': 1})
+        if record is not None:
+            logger.info(f'{ID} progress finished')
+        return record
+
+    async def get_record(self, ID: str) -> Optional[Progress]:
+        """Get the progress record of a download
+
+        Parameters
+        ----------
+        ID : :obj:`str`
+            The ID of the download
+
+        Returns
+        -------
+        record : :class:`Progress` or ``None``
+            The record, ``None`` if the download was not started or expired
+        """
+        key = self._key(ID)
+        record, _ = self._parse(await self._backend.hgetall(key))
+        return record
 
     async def get(self, ID: str) -> float:
+        """Get the fraction of a download received
+
+        Parameters
+        ----------
+        ID : :obj:`str`
+            The ID of the download
+
+        Returns
+        -------
+        progress : :obj:`float`
+            The fraction received, ``-1`` if the download was not started
+        """
         logger.info(f'Getting Progress {ID}')
-        return await self._get(ID, float)
+        record = await self.get_record(ID)
+        self._lookup(record is not None)
+        return -1 if record is None else record.progress
+
+    def subscribe(self, IDs: List[str]) -> ProgressSubscription:
+        """Watch the progress of downloads
+
+        Every subscription in the process shares one subscription to the
+        backend so adding watchers does not add connections.
+
+        .. code-block:: python
+
+            async with progress_cache.subscribe(['a', 'b']) as updates:
+                async for ID, progress in updates:
+                    ...
+
+        Parameters
+        ----------
+        IDs : :obj:`list` of :obj:`str`
+            The IDs of the downloads to watch
+
+        Returns
+        -------
+        subscription : :class:`ProgressSubscription`
+            The updates to the downloads
+        """
+        channels = {self.channel(ID): ID for ID in IDs}
+        return ProgressSubscription(self._backend, channels)
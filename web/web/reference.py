@@ -0,0 +1,171 @@
+"""In-process cache for the small reference tables served by the API
+
+Cameras and product types are read on every page but almost never change so
+each web worker keeps a copy that is served while it is fresh, served while
+it is refreshed in the background once stale and dropped as soon as a
+resource is created.
+"""
+import asyncio
+import logging
+from time import monotonic
+from typing import Any, Dict, Callable, Optional, Awaitable
+
+from web.backends import CacheBackend
+
+logger = logging.getLogger(__name__)
+
+
+class ReferenceCache:
+    """Cache of a value with a TTL, a version and stale-while-revalidate
+
+    Parameters
+    ----------
+    fetch : :obj:`callable`
+        Coroutine function without arguments getting the current value
+    ttl : :obj:`float`
+        Seconds a value is served without being refreshed
+    max_stale : :obj:`float`
+        Seconds after the TTL a stale value is still served while a refresh
+        runs in the background. Older values are refreshed before returning
+    """
+
+    def __init__(self, fetch: Callable[[], Awaitable[Any]], ttl: float = 60,
+                 max_stale: float = 600):
+        self._fetch = fetch
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.version = 0
+        self._value: Any = None
+        self._fetched: Optional[float] = None
+        self._refresh: Optional[asyncio.Future] = None
+
+    @property
+    def age(self) -> Optional[float]:
+        """:obj:`float` : Seconds since the value was fetched or ``None``"""
+        if self._fetched is None:
+            return None
+        return monotonic() - self._fetched
+
+    async def _load(self, version: int) -> Any:
+        value = await self._fetch()
+        # Do not keep a value fetched before an invalidation, it may miss the
+        # change that caused it
+        if version == self.version:
+            self._value = value
+            self._fetched = monotonic()
+        return value
+
+    def _start_refresh(self) -> asyncio.Future:
+        if self._refresh is None:
+            self._refresh = asyncio.ensure_future(self._load(self.version))
+            self._refresh.add_done_callback(self._refresh_done)
+        return self._refresh
+
+    def _refresh_done(self, future: asyncio.Future) -> None:
+        if self._refresh is future:
+            self._refresh = None
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f'Failed refreshing: {future.exception()!r}')
+
+    async def get(self) -> Any:
+        """Get the value, fetching it if there is no usable copy
+
+        Returns
+        -------
+        value
+            The cached or fetched value
+        """
+        age = self.age
+        if age is None or age >= self.ttl + self.max_stale:
+            # Concurrent callers share the same fetch
+            return await asyncio.shield(self._start_refresh())
+        if age >= self.ttl:
+            self._start_refresh()
+        return self._value
+
+    def invalidate(self) -> None:
+        """Drop the value so the next :meth:`get` fetches it"""
+        self.version += 1
+        self._value = None
+        self._fetched = None
+        # A refresh in flight will not store its value so let the next
+        # caller start another one
+        self._refresh = None
+
+
+class ReferenceCaches:
+    """Named :class:`ReferenceCache` invalidated across every worker
+
+    Invalidations are applied to the local cache right away and published
+    through the cache backend so the other workers drop their copy too.
+    """
+
+    CHANNEL = 'reference'
+
+    def __init__(self):
+        self._caches: Dict[str, ReferenceCache] = {}
+        self._backend: Optional[CacheBackend] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._listener: Optional[asyncio.Future] = None
+
+    def __getitem__(self, name: str) -> ReferenceCache:
+        return self._caches[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._caches
+
+    def add(self, name: str, cache: ReferenceCache) -> None:
+        """Add a cache under a name"""
+        self._caches[name] = cache
+
+    def _channel(self, name: str) -> str:
+        return f'{self.CHANNEL}:{name}'
+
+    async def invalidate(self, name: str) -> None:
+        """Invalidate a cache in this worker and the others
+
+        Parameters
+        ----------
+        name : :obj:`str`
+            The name of the cache
+        """
+        self._caches[name].invalidate()
+        if self._backend is not None:
+            await self._backend.publish(self._channel(name), name)
+
+    async def start(self, backend: CacheBackend) -> None:
+        """Start applying the invalidations published by other workers
+
+        Parameters
+        ----------
+        backend : :class:`web.backends.CacheBackend`
+            The backend to publish and receive invalidations with
+        """
+        self._backend = backend
+        queue: asyncio.Queue = asyncio.Queue()
+        shared = await backend.shared_subscription()
+        channels = [self._channel(name) for name in self._caches]
+        await shared.add(queue, *channels)
+        self._queue = queue
+        self._listener = asyncio.ensure_future(self._listen(queue))
+
+    async def stop(self) -> None:
+        """Stop applying invalidations from other workers"""
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+        if self._backend is not None and self._queue is not None:
+            shared = await self._backend.shared_subscription()
+            channels = [self._channel(name) for name in self._caches]
+            await shared.remove(self._queue, *channels)
+            self._backend = None
+            self._queue = None
+
+    async def _listen(self, queue: asyncio.Queue) -> None:
+        while True:
+            _, message = await queue.get()
+            name = message.decode()
+            if name in self._caches:
+                logger.info(f'Invalidating the {name} reference cache')
+                self._caches[name].invalidate()
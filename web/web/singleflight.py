@@ -0,0 +1,102 @@
+import uuid
+import asyncio
+import logging
+from typing import Any, Dict, Union, Callable, Optional, Awaitable
+
+import aioredis
+
+from web.backends import CacheBackend
+from web.redis_cache import RedisCache
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """Run a single call at a time for each key within the process
+
+    Callers that arrive while a call for the same key is running wait for
+    and share its result instead of starting a new call.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._calls
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        """Call ``func`` unless a call for ``key`` is already running
+
+        Parameters
+        ----------
+        key : :obj:`str`
+            The key identifying the call
+        func : :obj:`callable`
+            Coroutine function to call without arguments
+
+        Returns
+        -------
+        result
+            The result of the call running for ``key``
+        """
+        if key in self._calls:
+            logger.info(f'Waiting on call in flight for {key}')
+        else:
+            future = asyncio.ensure_future(func())
+            self._calls[key] = future
+            future.add_done_callback(lambda _: self._calls.pop(key, None))
+        # Shield so a cancelled caller does not cancel the shared call
+        return await asyncio.shield(self._calls[key])
+
+
+class Lease(RedisCache):
+    """Lease in the cache so only one worker does a job at a time
+
+    The lease is a key set only if it does not already exist and it expires
+    on its own if the holder dies before releasing it.
+
+    Parameters
+    ----------
+    backend : :class:`web.backends.CacheBackend` or :class:`aioredis.Redis`
+        The cache holding the lease
+    key : :obj:`str`
+        Name of what is being leased
+    expire : :obj:`int`
+        Seconds until the lease expires
+    token : :obj:`str`, optional
+        The token of a lease acquired before. A new token is created by
+        default
+    """
+
+    PREFIX = 'lease'
+
+    def __init__(self, backend: Union[CacheBackend, aioredis.Redis], key: str,
+                 expire: int = 600, token: Optional[str] = None):
+        super().__init__(backend)
+        self.key = f'{self.PREFIX}:{key}'
+        self.expire = expire
+        self.token = token or uuid.uuid4().hex
+
+    async def acquire(self) -> bool:
+        """Try to take the lease
+
+        Returns
+        -------
+        acquired : :obj:`bool`
+            Whether or not the lease was taken
+        """
+        return await self._backend.set_if_not_exists(
+            self.key,
+            self.token,
+            expire=self.expire,
+        )
+
+    async def release(self) -> bool:
+        """Release the lease if it is still held with this token
+
+        Returns
+        -------
+        released : :obj:`bool`
+            Whether or not the lease was released
+        """
+        return await self._backend.delete_if_equals(self.key, self.token)
@@ -1,6 +1,13 @@
+// Default number of images in a page of /services/images
+var IMAGES_PAGE = 50;
+// Milliseconds between refreshes while waiting for an image to be cached
+var REFRESH_DELAY = 300;
+// Refreshes before giving up on an image showing up in the cache
+var REFRESH_ATTEMPTS = 100;
+
 angular.module('homeApp').component('home', {
     templateUrl: '/static/pages/home/template.html',
-    controller: function homeController($uibModal, $timeout, homeService) {
+    controller: function homeController($uibModal, $timeout, $q, homeService) {
         $ctrl = this;
         $ctrl.productTypeName = '';
         $ctrl.selectedProductType = null;
@@ -9,7 +16,11 @@ angular.module('homeApp').component('home', {
         $ctrl.selectedCamera = null;
         $ctrl.cameras = [];
         $ctrl.allImages = [];
+        // Cursor of the next page of images, null on the last page
+        $ctrl.nextImages = null;
         $ctrl.progress = {};
+        // Images whose download or caching failed
+        $ctrl.failed = {};
         $ctrl.imageSrc = '';
         setProductTypes();
         setCameras();
@@ -43,54 +54,96 @@ angular.module('homeApp').component('home', {
         }
 
         function setImages() {
-            return homeService.getImages().then(function(data) {
+            // Reload as many images as are shown
+            var params = {};
+            if ($ctrl.allImages.length > IMAGES_PAGE) {
+                params.limit = $ctrl.allImages.length;
+            }
+            return homeService.getImages(params).then(function(data) {
                 $ctrl.allImages = data.data.data;
+                $ctrl.nextImages = data.data.next;
                 return data.data.data;
             });
         }
 
+        $ctrl.loadMoreImages = function() {
+            var params = {cursor: $ctrl.nextImages};
+            homeService.getImages(params).then(function(data) {
+                $ctrl.allImages = $ctrl.allImages.concat(data.data.data);
+                $ctrl.nextImages = data.data.next;
+                cacheImages(data.data.data);
+            });
+        }
+
         function cacheImage(image) {
             return homeService.cacheImage(image);
         }
 
         function cacheImages(images) {
-            return angular.forEach(images, function(image, idx) {
-                cacheImage(
+            var requests = images.map(function(image) {
+                return cacheImage(
                     {
                         url: image['URL'],
                         name: image['Name']
                     }
-                );
-                setProgress(image['Name'])
+                ).then(function(response) {
+                    // 202 means the image is queued or already being cached
+                    return response.status == 202 ? image['Name'] : null;
+                });
+            });
+            return $q.all(requests).then(function(IDs) {
+                streamProgress(IDs.filter(function(ID) {
+                    return ID !== null;
+                }));
             });
         }
 
-        $ctrl.setProgress = function(ID) {
-            var progress = -1;
-            progressPromise = homeService.getProgress(ID).then(
-                function(data) {
-                    progress = data.data.data;
-                    if (progress == -1) {
-                        $timeout(function() {
-                            $ctrl.setProgress(ID)
-                        }, 300);
-                    } else {
-                        progress = progress * 100;
-                        $ctrl.progress[ID] = progress
-                        $timeout(function() {
-                            $ctrl.setProgress(ID)
-                        }, 100);
-                    }
-                    return progress
-                },
-                function(data) {
-                    console.log('ERROR');
-                    return 100;
+        function refreshUntilCached(ID, attempts) {
+            // Images are stored in the cache right after the download
+            // finishes so refresh the list until the image shows up
+            if (attempts === undefined) {
+                attempts = REFRESH_ATTEMPTS;
+            }
+            setImages().then(function(images) {
+                var cached = images.some(function(image) {
+                    return image['Name'] == ID && image['cached'];
+                });
+                if (!cached && attempts > 1 && !$ctrl.failed[ID]) {
+                    $timeout(function() {
+                        refreshUntilCached(ID, attempts - 1);
+                    }, REFRESH_DELAY);
                 }
-            );
-            return progressPromise;
-            
-        };
+            });
+        }
+
+        function streamProgress(IDs) {
+            if (IDs.length == 0) {
+                return null;
+            }
+            var source = homeService.streamProgress(IDs);
+            source.addEventListener('progress', function(event) {
+                var data = JSON.parse(event.data);
+                $timeout(function() {
+                    $ctrl.progress[data.ID] = data.progress * 100;
+                    if (data.finished) {
+                        refreshUntilCached(data.ID);
+                    }
+                });
+            });
+            // Caching the image failed, it will not show up in the cache
+            source.addEventListener('failed', function(event) {
+                var data = JSON.parse(event.data);
+                $timeout(function() {
+                    $ctrl.failed[data.ID] = true;
+                });
+            });
+            // The server ends the stream once every image is downloaded or
+            // failed, close it so the browser does not reconnect
+            source.addEventListener('done', function() {
+                source.close();
+            });
+            return source;
+        }
 
         $ctrl.getProgress = function(ID) {
             var progress = $ctrl.progress[ID];
@@ -124,10 +177,12 @@ angular.module('homeApp').component('home', {
                                     url: image['URL'],
                                     name: image['Name']
                                 }
-                            ).then(function() {
+                            ).then(function(response) {
                                 setImages();
+                                if (response.status == 202) {
+                                    streamProgress([image['Name']]);
+                                }
                             });
-                            $ctrl.setProgress(image['Name']);
                         });
                     });
                 },
@@ -5,8 +5,8 @@ angular.module('homeApp').service('homeService', function($http) {
     this.getCameraNames = function() { 
         return $http.get('/services/cameras');
     }
-    this.getImages = function() {
-        return $http.get('/services/images');
+    this.getImages = function(params) {
+        return $http.get('/services/images', {params: params});
     }
     this.registerImage = function(data) {
         return $http.post('/services/images', data=data);
@@ -14,7 +14,10 @@ angular.module('homeApp').service('homeService', function($http) {
     this.cacheImage = function(data) {
         return $http.post('/services/cache_image', data=data);
     }
-    this.getProgress = function(ID) {
-        return $http.post('/services/progress', data={ID: ID});
+    this.streamProgress = function(IDs) {
+        var query = IDs.map(function(ID) {
+            return 'id=' + encodeURIComponent(ID);
+        }).join('&');
+        return new EventSource('/services/progress/stream?' + query);
     }
 });
\ No newline at end of file